@@ -1,3 +1,4 @@
+import os
 from functools import lru_cache
 from copy import deepcopy
 import json
@@ -60,6 +61,8 @@ DEFAULT_LANGUAGES = config.get("DEFAULT_LANGUAGES")
 CITIES = config.get("CITIES")
 COUNTRY_CHOICES = config.get("COUNTRY_CHOICES")
 DB_DSN = config.get("DB_DSN")
+# Подробные info-логи успешных запросов db_utils (по умолчанию выключены; env DB_LOG_VERBOSE=1)
+DB_LOG_VERBOSE = bool(config.get("DB_LOG_VERBOSE")) or os.getenv("DB_LOG_VERBOSE") == "1"
 
 STARS_ACCEPT_PRICE = config.get("STARS_ACCEPT_PRICE", 0)
 STARS_ITEM_LABEL = config.get("STARS_ITEM_LABEL", "Accepting an order")
@@ -186,5 +189,13 @@ TABLES_SCHEMAS = {
         "level": "VARCHAR(10)",
         "position": "VARCHAR(20)",
         "created_at": "TIMESTAMPTZ NOT NULL DEFAULT now()"
+    },
+    "driver_stats": {
+        "driver_id": "BIGINT PRIMARY KEY",
+        "completed": "INTEGER NOT NULL DEFAULT 0",
+        "canceled": "INTEGER NOT NULL DEFAULT 0",
+        "active": "INTEGER NOT NULL DEFAULT 0",
+        "total_commission": "NUMERIC NOT NULL DEFAULT 0",
+        "total_revenue": "NUMERIC NOT NULL DEFAULT 0"
     }
 }
@@ -4,7 +4,7 @@ import json
 import time
 
 from typing import Any, Dict, List, Tuple, Optional
-from db.db_table_init import get_connection, release_connection
+from db.db_table_init import acquire
 from log.log import log_info
 from config.config import get_settings, CITIES, COUNTRY_CHOICES
 
@@ -25,42 +25,74 @@ _config_cache: Optional[Dict[str, Any]] = None
 _config_ts: float = 0.0
 _CONFIG_TTL = 5.0
 
+# Нормализованный снимок для get_all_config: записи через этот модуль обновляют его сразу,
+# а правки из других процессов (web UI, второй инстанс бота) подхватываются по TTL.
+# Версия растёт при каждой записи и при обнаружении чужой правки (ключ для производных кешей).
+_ALL_CONFIG_TTL = 30.0
+_all_config_cache: Optional[Dict[str, Any]] = None
+_all_config_ts: float = 0.0
+_config_version: int = 0
+
+# Списки для клавиатур админки: ключ ("countries",) / ("regions", страна) / ("cities", страна, земля)
+# -> (момент заполнения, кортеж названий). Сбрасываются любой записью через этот модуль,
+# TTL страхует от изменений из других процессов.
+_LISTS_TTL = 30.0
+_lists_cache: Dict[tuple, Tuple[float, Tuple[str, ...]]] = {}
+
 def _invalidate_cache():
-    global _config_cache, _config_ts
+    global _config_cache, _config_ts, _all_config_cache, _config_version
     _config_cache, _config_ts = None, 0.0
+    _all_config_cache = None
+    _lists_cache.clear()
+    _config_version += 1
+
+
+def invalidate_config_cache() -> None:
+    """Сброс кешей config; вызывать после COMMIT транзакции, в которой менялся config."""
+    _invalidate_cache()
+
+
+def config_version() -> int:
+    """Текущая версия config (растёт при записи через этот модуль и при обнаружении чужой правки)."""
+    return _config_version
+
 
-async def _get_config_cached() -> Dict[str, Any]:
-    """Лёгкий TTL-кеш одной строки config (id=1)."""
+def store_config_row(row: Dict[str, Any]) -> None:
+    """Write-through: кладёт строку из UPDATE ... RETURNING * в кеш get_all_config."""
+    global _all_config_cache, _all_config_ts
+    _invalidate_cache()
+    if row:
+        _all_config_cache = _config_view(dict(row))
+        _all_config_ts = time.monotonic()
+
+async def _get_config_cached(conn=None) -> Dict[str, Any]:
+    """Лёгкий TTL-кеш одной строки config (id=1). conn — уже взятое соединение (опционально)."""
     global _config_cache, _config_ts
     now = time.monotonic()
     if _config_cache is not None and (now - _config_ts) < _CONFIG_TTL:
         return _config_cache
 
     # прежняя логика _fetch_config_row, но без ensure_config_exists() внутри
-    conn = None
     try:
-        conn = await get_connection()
-        row = await conn.fetchrow(
-            f"""
-            SELECT id, cities, stars_enabled, recruitment_scan_intervel,
-                   check_country, region_in_bot,
-                   recruitment_max_minutes, updated_at,
-                   country_choices
-              FROM {CONFIG_TABLE}
-             WHERE id = $1
-             LIMIT 1
-            """,
-            CONFIG_ID,
-        )
-        _config_cache = dict(row) if row else {}
-        _config_ts = now
-        return _config_cache
+        async with acquire(conn) as conn:
+            row = await conn.fetchrow(
+                f"""
+                SELECT id, cities, stars_enabled, recruitment_scan_intervel,
+                       check_country, region_in_bot,
+                       recruitment_max_minutes, updated_at,
+                       country_choices
+                  FROM {CONFIG_TABLE}
+                 WHERE id = $1
+                 LIMIT 1
+                """,
+                CONFIG_ID,
+            )
+            _config_cache = dict(row) if row else {}
+            _config_ts = now
+            return _config_cache
     except Exception as e:
         await log_info(f"_get_config_cached failed: {e}", type_msg="error")
         return _config_cache or {}
-    finally:
-        if conn:
-            await release_connection(conn)
 
 def normalize_cities_tree(obj: Any) -> Dict[str, Dict[str, List[str]]]:
     """country -> region -> [cities] (всегда строки, без дублей, отсортировано)."""
@@ -96,10 +128,11 @@ def normalize_cities_tree(obj: Any) -> Dict[str, Dict[str, List[str]]]:
     return out
 
 
-async def ensure_config_exists() -> Dict[str, Any]:
+async def ensure_config_exists(conn=None) -> Dict[str, Any]:
     """
     Гарантирует наличие строки config id=1 + приводит структуру.
     Синхронизация из config.json включается, если "SYNC_JSON_WITH_DB": true.
+    conn — уже взятое соединение вызывающего (иначе берётся из пула).
     """
     cfg = get_settings("config/config.json") or {}
     # defaults из файла (без ошибок, строго к ожидаемым типам)
@@ -126,8 +159,7 @@ async def ensure_config_exists() -> Dict[str, Any]:
     cc_from_json     = _norm_cc(cfg.get("COUNTRY_CHOICES") or cfg.get("country_choices"))
     do_sync          = bool(cfg.get("SYNC_JSON_WITH_DB", False))
 
-    conn = await get_connection()
-    try:
+    async with acquire(conn) as conn:
         row = await conn.fetchrow(f"SELECT * FROM {CONFIG_TABLE} WHERE id=$1", CONFIG_ID)
         if not row:
             # нет записи — создаём, опираясь на config.json (если он есть)
@@ -199,8 +231,6 @@ async def ensure_config_exists() -> Dict[str, Any]:
         # вернуть актуальную строку
         row = await conn.fetchrow(f"SELECT * FROM {CONFIG_TABLE} WHERE id=$1", CONFIG_ID)
         return dict(row or {})
-    finally:
-        await release_connection(conn)
 
 
 # рядом с остальными утилитами
@@ -363,23 +393,8 @@ async def get_city_names() -> list[str]:
     return names
 
 async def _fetch_config_row() -> Optional[Dict[str, Any]]:
-    conn = None
     try:
-        conn = await get_connection()
-        row = await conn.fetchrow(
-            f"""
-            SELECT id, cities, stars_enabled, recruitment_scan_intervel,
-                   check_country, region_in_bot,
-                   recruitment_max_minutes, updated_at
-              FROM {CONFIG_TABLE}
-             WHERE id = $1
-             LIMIT 1
-            """,
-            CONFIG_ID,
-        )
-        if not row:
-            await log_info(f"{CONFIG_TABLE} id={CONFIG_ID} не найдена → создаю дефолт", type_msg="warning")
-            await ensure_config_exists()
+        async with acquire() as conn:
             row = await conn.fetchrow(
                 f"""
                 SELECT id, cities, stars_enabled, recruitment_scan_intervel,
@@ -392,14 +407,25 @@ async def _fetch_config_row() -> Optional[Dict[str, Any]]:
                 CONFIG_ID,
             )
             if not row:
-                return None
-        return dict(row)
+                await log_info(f"{CONFIG_TABLE} id={CONFIG_ID} не найдена → создаю дефолт", type_msg="warning")
+                await ensure_config_exists()
+                row = await conn.fetchrow(
+                    f"""
+                    SELECT id, cities, stars_enabled, recruitment_scan_intervel,
+                           check_country, region_in_bot,
+                           recruitment_max_minutes, updated_at
+                      FROM {CONFIG_TABLE}
+                     WHERE id = $1
+                     LIMIT 1
+                    """,
+                    CONFIG_ID,
+                )
+                if not row:
+                    return None
+            return dict(row)
     except Exception as e:
         await log_info(f"_fetch_config_row failed: {e}", type_msg="error")
         return None
-    finally:
-        if conn:
-            await release_connection(conn)
 
 
 # ──────────────────────────────────────────────────────────────────────────────
@@ -473,12 +499,21 @@ async def get_updated_at():
     return (row or {}).get("updated_at")
 
 
-async def get_all_config() -> Dict[str, Any]:
-    row = await _fetch_config_row() or {}
+def _sorted_cities_tree(tree: Dict[str, Any]) -> Dict[str, Any]:
+    """Копия дерева со странами и землями в отсортированном порядке вставки (порядок городов сохраняется)."""
+    out: Dict[str, Any] = {}
+    for country in sorted(tree):
+        regions = tree[country]
+        out[country] = {r: regions[r] for r in sorted(regions)} if isinstance(regions, dict) else regions
+    return out
+
+
+def _config_view(row: Dict[str, Any]) -> Dict[str, Any]:
     cities_val = _as_json_obj(row.get("cities", {}))
     return {
         "id": row.get("id", CONFIG_ID),
-        "cities": cities_val if isinstance(cities_val, dict) else {},
+        # Сортируем один раз при заполнении кеша — отрисовка дерева идёт простым обходом
+        "cities": _sorted_cities_tree(cities_val) if isinstance(cities_val, dict) else {},
         "stars_enabled": bool(row.get("stars_enabled", False)),
         "check_country": bool(row.get("check_country", False)),    # ← новое
         "region_in_bot": bool(row.get("region_in_bot", True)),     # ← новое
@@ -488,37 +523,85 @@ async def get_all_config() -> Dict[str, Any]:
     }
 
 
+async def get_all_config() -> Dict[str, Any]:
+    global _all_config_cache, _all_config_ts
+    cached = _all_config_cache
+    now = time.monotonic()
+    if cached is None or (now - _all_config_ts) >= _ALL_CONFIG_TTL:
+        version = _config_version
+        row = await _fetch_config_row()
+        if not row:
+            # Без строки в БД не кешируем — следующий вызов попробует снова
+            return cached.copy() if cached is not None else _config_view({})
+        fresh = _config_view(row)
+        # Запись, прошедшая во время чтения, уже сбросила кеш — устаревший снимок не сохраняем
+        if version == _config_version:
+            if cached is not None and fresh != cached:
+                # config изменили в обход этого процесса — сбрасываем и производные кеши (версия++)
+                _invalidate_cache()
+            _all_config_cache, _all_config_ts = fresh, now
+        cached = fresh
+    # Поверхностная копия: вызывающие не должны портить общий снимок
+    return cached.copy()
+
+
 # === ВЫБОРКИ ДЛЯ КЛАВИАТУР ====================================================
 
-async def list_countries() -> List[str]:
-    data = (await _get_config_cached()).get("cities")
+async def _cached_list(key: tuple, pick, conn=None) -> Tuple[str, ...]:
+    """
+    Кортеж из _lists_cache по key; при промахе/истёкшем TTL — pick(нормализованное дерево).
+    Кортеж неизменяем, поэтому отдаётся вызывающим без копирования.
+    """
+    now = time.monotonic()
+    hit = _lists_cache.get(key)
+    if hit is not None and (now - hit[0]) < _LISTS_TTL:
+        return hit[1]
+    version = _config_version
+    data = (await _get_config_cached(conn)).get("cities")
     if isinstance(data, str):
         try: data = json.loads(data)
         except Exception: data = {}
-    tree = normalize_cities_tree(data)
-    return sorted(tree.keys(), key=str.casefold)
+    value = tuple(pick(normalize_cities_tree(data or {})))
+    # запись, прошедшая во время чтения, уже сбросила кеш — устаревший список не сохраняем
+    if version == _config_version:
+        _lists_cache[key] = (now, value)
+    return value
 
 
-async def list_regions(country: str) -> List[str]:
-    tree = normalize_cities_tree((await _get_config_cached()).get("cities") or {})
-    regions = tree.get((country or "").strip()) or {}
-    return sorted(regions.keys(), key=str.casefold)
+async def list_countries(conn=None) -> Tuple[str, ...]:
+    return await _cached_list(
+        ("countries",),
+        lambda tree: sorted(tree.keys(), key=str.casefold),
+        conn,
+    )
 
 
-async def list_cities(country: str, region: str) -> List[str]:
-    tree = normalize_cities_tree((await _get_config_cached()).get("cities") or {})
-    arr = (tree.get((country or "").strip()) or {}).get((region or "").strip()) or []
-    return arr  # уже отсортировано и без дублей
+async def list_regions(country: str, conn=None) -> Tuple[str, ...]:
+    country = (country or "").strip()
+    return await _cached_list(
+        ("regions", country),
+        lambda tree: sorted((tree.get(country) or {}).keys(), key=str.casefold),
+        conn,
+    )
+
+
+async def list_cities(country: str, region: str, conn=None) -> Tuple[str, ...]:
+    country, region = (country or "").strip(), (region or "").strip()
+    return await _cached_list(
+        ("cities", country, region),
+        # уже отсортировано и без дублей
+        lambda tree: (tree.get(country) or {}).get(region) or (),
+        conn,
+    )
 
 
 # === JSONB: страны / земли (регионы) =====================================================
 
-async def _upsert_country_sql(country: str) -> dict:
+async def _upsert_country_sql(country: str, conn=None) -> dict:
     country = country.strip()
     if not country:
         return {}
-    conn = await get_connection()
-    try:
+    async with acquire(conn) as conn:
         row = await conn.fetchrow(
             f"""
             WITH base AS (
@@ -544,11 +627,9 @@ async def _upsert_country_sql(country: str) -> dict:
         )
         _invalidate_cache()  # важно
         return dict(row or {})
-    finally:
-        await release_connection(conn)
 
 
-async def _upsert_city_sql(country: str, region: str, city: str) -> dict:
+async def _upsert_city_sql(country: str, region: str, city: str, conn=None) -> dict:
     """
     Вставляет city в конец {country,region} без дублей (case-insensitive).
     Если пути нет — создаёт. Возвращает обновлённые cities, updated_at.
@@ -556,8 +637,7 @@ async def _upsert_city_sql(country: str, region: str, city: str) -> dict:
     country, region, city = country.strip(), region.strip(), city.strip()
     if not (country and region and city):
         return {}
-    conn = await get_connection()
-    try:
+    async with acquire(conn) as conn:
         row = await conn.fetchrow(
             f"""
             WITH base AS (
@@ -597,20 +677,18 @@ async def _upsert_city_sql(country: str, region: str, city: str) -> dict:
             """,
             CONFIG_ID, country, region, city,
         )
+        _invalidate_cache()
         return dict(row or {})
-    finally:
-        await release_connection(conn)
 
 
-async def _remove_city_sql_tree(country: str, region: str, city: str) -> dict:
+async def _remove_city_sql_tree(country: str, region: str, city: str, conn=None) -> dict:
     """
     Удаляет city из массива {country,region}. Если пути нет — noop.
     """
     country, region, city = country.strip(), region.strip(), city.strip()
     if not (country and region and city):
         return {}
-    conn = await get_connection()
-    try:
+    async with acquire(conn) as conn:
         row = await conn.fetchrow(
             f"""
             WITH base AS (
@@ -660,17 +738,15 @@ async def _remove_city_sql_tree(country: str, region: str, city: str) -> dict:
             """,
             CONFIG_ID, country, region, city,
         )
+        _invalidate_cache()
         return dict(row or {})
-    finally:
-        await release_connection(conn)
 
 
-async def _remove_country_sql(country: str) -> dict:
+async def _remove_country_sql(country: str, conn=None) -> dict:
     country = country.strip()
     if not country:
         return {}
-    conn = await get_connection()
-    try:
+    async with acquire(conn) as conn:
         row = await conn.fetchrow(
             f"""
             UPDATE {CONFIG_TABLE}
@@ -685,17 +761,15 @@ async def _remove_country_sql(country: str) -> dict:
             """,
             CONFIG_ID, country,
         )
+        _invalidate_cache()
         return dict(row or {})
-    finally:
-        await release_connection(conn)
 
 
-async def _upsert_region_sql(country: str, region: str) -> dict:
+async def _upsert_region_sql(country: str, region: str, conn=None) -> dict:
     country, region = country.strip(), region.strip()
     if not country or not region:
         return {}
-    conn = await get_connection()
-    try:
+    async with acquire(conn) as conn:
         row = await conn.fetchrow(
             f"""
             WITH base AS (
@@ -721,16 +795,13 @@ async def _upsert_region_sql(country: str, region: str) -> dict:
         )
         _invalidate_cache()  # важно
         return dict(row or {})
-    finally:
-        await release_connection(conn)
 
 
-async def _remove_region_sql(country: str, region: str) -> dict:
+async def _remove_region_sql(country: str, region: str, conn=None) -> dict:
     country, region = country.strip(), region.strip()
     if not country or not region:
         return {}
-    conn = await get_connection()
-    try:
+    async with acquire(conn) as conn:
         row = await conn.fetchrow(
             f"""
             WITH base AS (
@@ -759,33 +830,27 @@ async def _remove_region_sql(country: str, region: str) -> dict:
         )
         _invalidate_cache()  # важно
         return dict(row or {})
-    finally:
-        await release_connection(conn)
 
 
 async def read_cities_json() -> Dict[str, Any]:
     """Читает колонку config.cities (id=1) и возвращает Python-объект или {} при ошибке."""
-    conn = None
     try:
-        conn = await get_connection()
-        row = await conn.fetchrow(f"SELECT cities FROM {CONFIG_TABLE} WHERE id=$1 LIMIT 1", CONFIG_ID)
-        if not row:
-            await log_info("read_cities_json(): строка config id=1 не найдена", type_msg="warning")
-            return {}
-        val = row["cities"]
-        if isinstance(val, str):
-            try:
-                return json.loads(val)
-            except Exception as e:
-                await log_info(f"read_cities_json(): не удалось распарсить JSON: {e}", type_msg="warning")
+        async with acquire() as conn:
+            row = await conn.fetchrow(f"SELECT cities FROM {CONFIG_TABLE} WHERE id=$1 LIMIT 1", CONFIG_ID)
+            if not row:
+                await log_info("read_cities_json(): строка config id=1 не найдена", type_msg="warning")
                 return {}
-        return val if isinstance(val, (dict, list)) else {}
+            val = row["cities"]
+            if isinstance(val, str):
+                try:
+                    return json.loads(val)
+                except Exception as e:
+                    await log_info(f"read_cities_json(): не удалось распарсить JSON: {e}", type_msg="warning")
+                    return {}
+            return val if isinstance(val, (dict, list)) else {}
     except Exception as e:
         await log_info(f"read_cities_json() failed: {e}", type_msg="error")
         return {}
-    finally:
-        if conn:
-            await release_connection(conn)
 
 def _pick_name(x: Any) -> str:
     if isinstance(x, str):
@@ -883,14 +948,11 @@ async def load_cities() -> Dict[str, Dict[str, List[str]]]:
 
 async def load_country_choices() -> List[Tuple[str, str, str, Optional[int], Optional[int]]]:
     # 1) БД
-    conn = await get_connection()
-    try:
+    async with acquire() as conn:
         row = await conn.fetchrow('SELECT country_choices FROM "config" WHERE id=1;')
         if not row:
             row = await conn.fetchrow('SELECT country_choices FROM "config" ORDER BY id LIMIT 1;')
         raw = row['country_choices'] if row else None
-    finally:
-        await release_connection(conn)
 
     if isinstance(raw, str):
         try: raw = json.loads(raw)
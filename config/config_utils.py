@@ -1,3 +1,4 @@
+from functools import lru_cache
 from typing import Optional
 from config.config import SUPPORTED_LANGUAGES, DEFAULT_LANGUAGES, MESSAGES  # MESSAGES = lang_dict["MESSAGES"]
 
@@ -8,15 +9,20 @@ def resolve_lang(user_lang: Optional[str]) -> str:
     lang = (user_lang or "").lower()
     return lang if lang in supported else default
 
-def lang_dict(key: str, user_lang: Optional[str] = None, **fmt) -> str:
-    """Достаёт перевод по ключу с фолбэком на DEFAULT_LANGUAGES. Поддерживает .format()."""
+@lru_cache(maxsize=4096)
+def _lang_template(key: str, user_lang: Optional[str]) -> str:
+    """Шаблон перевода по (key, язык); MESSAGES загружается один раз при импорте и не меняется."""
     lang = resolve_lang(user_lang)
     default = (DEFAULT_LANGUAGES or "en").lower()
-    val = (
+    return (
         (MESSAGES or {}).get(lang, {}).get(key)
         or (MESSAGES or {}).get(default, {}).get(key)
         or key
     )
+
+def lang_dict(key: str, user_lang: Optional[str] = None, **fmt) -> str:
+    """Достаёт перевод по ключу с фолбэком на DEFAULT_LANGUAGES. Поддерживает .format()."""
+    val = _lang_template(key, user_lang)
     try:
         return val.format(**fmt) if fmt else val
     except Exception:
@@ -1,9 +1,11 @@
 import asyncpg
 import asyncio
+import orjson
 from log.log import log_info
 from config.config import DB_DSN, TABLES_SCHEMAS
-from typing import Optional
+from typing import Optional, AsyncIterator
 from dataclasses import dataclass
+from contextlib import asynccontextmanager
 from datetime import datetime
 
 _pool = None
@@ -21,24 +23,82 @@ class PoolStats:
     busy_pct: float        # % занятых от созданных (0-100)
     capacity_pct: float    # % использованной ёмкости от max_size (0-100)
 
+def _jsonb_encode(value) -> bytes:
+    """Бинарный формат JSONB: байт версии 0x01 + JSON-текст."""
+    # Вызовы с уже сериализованной строкой ($n::jsonb + json.dumps) передаём как есть
+    if isinstance(value, str):
+        return b"\x01" + value.encode("utf-8")
+    return b"\x01" + orjson.dumps(value)
+
+
+def _jsonb_decode(data: bytes):
+    return orjson.loads(data[1:])
+
+
+# Горячие запросы (SQL + безопасные параметры), которые прогреваются в кэше
+# подготовленных выражений каждого нового соединения пула
+_WARMUP_STATEMENTS: list[tuple[str, tuple]] = []
+
+
+def register_warmup_statement(query: str, *args) -> None:
+    """Регистрирует запрос для подготовки при открытии соединения (Parse один раз на соединение)."""
+    _WARMUP_STATEMENTS.append((query, args))
+
+
+async def _init_connection(conn):
+    """Настройка каждого нового соединения пула: JSONB читается сразу в dict/list через orjson."""
+    await conn.set_type_codec(
+        "jsonb",
+        encoder=_jsonb_encode,
+        decoder=_jsonb_decode,
+        schema="pg_catalog",
+        format="binary",
+    )
+    for query, args in _WARMUP_STATEMENTS:
+        try:
+            await conn.fetch(query, *args)
+        except asyncpg.PostgresError:
+            # Первый запуск: таблицы ещё не созданы — выражение подготовится при первом вызове
+            break
+
+
 async def create_pool():
     global _pool
     if _pool is None:
-        _pool = await asyncpg.create_pool(DB_DSN, min_size=2, max_size=10)
+        _pool = await asyncpg.create_pool(DB_DSN, min_size=2, max_size=10, init=_init_connection)
         await log_info("Создан пул соединений PostgreSQL", type_msg="info")
     return _pool
 
+# Ожидание свободного соединения пула: при исчерпании — ошибка вместо вечного ожидания
+_ACQUIRE_TIMEOUT = 10.0
+
+
 async def get_connection():
     global _pool
     if _pool is None:
         await create_pool()
-    return await _pool.acquire()
+    return await _pool.acquire(timeout=_ACQUIRE_TIMEOUT)
 
 async def release_connection(connection):
     global _pool
     if _pool is not None:
         await _pool.release(connection)
 
+@asynccontextmanager
+async def acquire(connection: Optional[asyncpg.Connection] = None) -> AsyncIterator[asyncpg.Connection]:
+    """
+    Контекст соединения из пула: гарантирует возврат соединения даже при исключении.
+    Если передано уже взятое соединение — используется оно (без acquire/release).
+    """
+    if connection is not None:
+        yield connection
+        return
+    connection = await get_connection()
+    try:
+        yield connection
+    finally:
+        await release_connection(connection)
+
 async def close_pool():
     global _pool
     if _pool is None:
@@ -59,6 +119,46 @@ async def close_pool():
         _pool = None
 
 
+# Индексы под горячие запросы db_utils. CONCURRENTLY — чтобы не блокировать запись в orders
+# на живой базе; каждый выполняется отдельной командой вне транзакции.
+_INDEXES = (
+    # list_available_orders_for_driver: WHERE + ORDER BY целиком из индекса, ранняя остановка по LIMIT
+    """
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_orders_available
+        ON orders (COALESCE(city, ''), scheduled_at NULLS LAST, order_date DESC NULLS LAST, order_id DESC)
+     WHERE status = 'pending' AND driver_id IS NULL;
+    """,
+    # get_active_order_for_driver: driver_id фиксирован равенством, остальное покрывает ORDER BY
+    """
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_orders_driver_active
+        ON orders (driver_id, order_date DESC NULLS LAST, order_id DESC)
+     WHERE status IN ('accepted','in_place','come_out','started','awaiting_fee');
+    """,
+    # list_future_orders_for_passenger: фильтр и сортировка по scheduled_at прямо по индексу
+    """
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_orders_passenger_future
+        ON orders (passenger_id, scheduled_at)
+     WHERE scheduled_at IS NOT NULL;
+    """,
+    # list_order_history_for_user: выражение в индексе совпадает с ORDER BY запроса (по ролям)
+    """
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_orders_hist_pass
+        ON orders (passenger_id, COALESCE(trip_end, order_date) DESC NULLS LAST, order_id DESC)
+     WHERE status IN ('completed','canceled');
+    """,
+    """
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_orders_hist_driver
+        ON orders (driver_id, COALESCE(trip_end, order_date) DESC NULLS LAST, order_id DESC)
+     WHERE status IN ('completed','canceled');
+    """,
+    # get_driver_stats_summary: агрегат по driver_id как index-only scan (без чтения heap)
+    """
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_orders_driver_stats
+        ON orders (driver_id) INCLUDE (status, commission, cost);
+    """,
+)
+
+
 async def _ensure_indexes(conn):
     """Создаём полезные индексы (idempotent)."""
     try:
@@ -68,6 +168,122 @@ async def _ensure_indexes(conn):
     except asyncpg.PostgresError as e:
         await log_info(f"Ошибка создания индексов: {e}", type_msg="error")
 
+    for ddl in _INDEXES:
+        try:
+            await conn.execute(ddl)
+        except asyncpg.PostgresError as e:
+            await log_info(f"Ошибка создания индекса: {e}", type_msg="error")
+
+
+# Инкрементальная поддержка driver_stats: триггер вычитает вклад OLD-строки и добавляет вклад NEW
+_DRIVER_STATS_FUNCTION = """
+CREATE OR REPLACE FUNCTION driver_stats_add(
+    p_driver_id BIGINT, p_status TEXT, p_commission NUMERIC, p_cost NUMERIC, p_sign INTEGER
+) RETURNS void AS $$
+    INSERT INTO driver_stats AS ds (driver_id, completed, canceled, active, total_commission, total_revenue)
+    VALUES (
+        p_driver_id,
+        p_sign * (p_status = 'completed')::int,
+        p_sign * (p_status = 'canceled')::int,
+        p_sign * (p_status IN ('accepted','in_place','come_out','started','awaiting_fee'))::int,
+        p_sign * COALESCE(p_commission, 0),
+        p_sign * COALESCE(p_cost, 0)
+    )
+    ON CONFLICT (driver_id) DO UPDATE
+       SET completed        = ds.completed + EXCLUDED.completed,
+           canceled         = ds.canceled + EXCLUDED.canceled,
+           active           = ds.active + EXCLUDED.active,
+           total_commission = ds.total_commission + EXCLUDED.total_commission,
+           total_revenue    = ds.total_revenue + EXCLUDED.total_revenue;
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION driver_stats_apply() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.driver_id IS NOT NULL THEN
+        PERFORM driver_stats_add(OLD.driver_id, OLD.status, OLD.commission, OLD.cost, -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.driver_id IS NOT NULL THEN
+        PERFORM driver_stats_add(NEW.driver_id, NEW.status, NEW.commission, NEW.cost, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+_DRIVER_STATS_BACKFILL = """
+INSERT INTO driver_stats (driver_id, completed, canceled, active, total_commission, total_revenue)
+SELECT driver_id,
+       COUNT(*) FILTER (WHERE status = 'completed'),
+       COUNT(*) FILTER (WHERE status = 'canceled'),
+       COUNT(*) FILTER (WHERE status IN ('accepted','in_place','come_out','started','awaiting_fee')),
+       COALESCE(SUM(commission), 0),
+       COALESCE(SUM(cost), 0)
+  FROM orders
+ WHERE driver_id IS NOT NULL
+ GROUP BY driver_id;
+"""
+
+
+async def _ensure_driver_stats_trigger(conn):
+    """
+    Ставит триггер orders → driver_stats и однократно заполняет driver_stats из истории заказов.
+    Повторный запуск только обновляет тело функции.
+    """
+    try:
+        await conn.execute(_DRIVER_STATS_FUNCTION)
+        exists = await conn.fetchval(
+            "SELECT 1 FROM pg_trigger WHERE tgname = 'trg_orders_driver_stats' AND NOT tgisinternal;"
+        )
+        if exists:
+            return
+        async with conn.transaction():
+            # Блокируем запись в orders, чтобы между заполнением и включением триггера ничего не потерялось
+            await conn.execute("LOCK TABLE orders IN SHARE ROW EXCLUSIVE MODE;")
+            await conn.execute("TRUNCATE driver_stats;")
+            await conn.execute(_DRIVER_STATS_BACKFILL)
+            await conn.execute(
+                """
+                CREATE TRIGGER trg_orders_driver_stats
+                AFTER INSERT OR DELETE OR UPDATE OF status, driver_id, commission, cost ON orders
+                FOR EACH ROW EXECUTE FUNCTION driver_stats_apply();
+                """
+            )
+        await log_info("Создан триггер driver_stats и заполнена статистика водителей", type_msg="info")
+    except asyncpg.PostgresError as e:
+        await log_info(f"Ошибка настройки driver_stats: {e}", type_msg="error")
+
+
+# Уведомления об изменении набора ожидающих заказов по городу (слушатель — db_utils)
+_PENDING_CITY_FUNCTION = """
+CREATE OR REPLACE FUNCTION orders_notify_pending_city() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.status = 'pending' THEN
+        PERFORM pg_notify('order_pending_city', COALESCE(OLD.city, ''));
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.status = 'pending' THEN
+        PERFORM pg_notify('order_pending_city', COALESCE(NEW.city, ''));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+
+async def _ensure_pending_city_trigger(conn):
+    """Ставит триггер orders → NOTIFY order_pending_city (idempotent)."""
+    try:
+        await conn.execute(_PENDING_CITY_FUNCTION)
+        await conn.execute(
+            """
+            DROP TRIGGER IF EXISTS trg_orders_pending_city ON orders;
+            CREATE TRIGGER trg_orders_pending_city
+            AFTER INSERT OR DELETE OR UPDATE OF status, driver_id, city ON orders
+            FOR EACH ROW EXECUTE FUNCTION orders_notify_pending_city();
+            """
+        )
+    except asyncpg.PostgresError as e:
+        await log_info(f"Ошибка настройки триггера order_pending_city: {e}", type_msg="error")
+
 
 async def _reconcile_orders_trip_start_default(conn):
     """
@@ -135,6 +351,8 @@ async def init_db_tables():
         # Доп. согласования для orders:
         await _reconcile_orders_trip_start_default(connection)
         await _ensure_indexes(connection)
+        await _ensure_driver_stats_trigger(connection)
+        await _ensure_pending_city_trigger(connection)
 
     except Exception as e:
         await log_info(f"Ошибка инициализации таблиц: {e}", type_msg="error")
@@ -1,11 +1,71 @@
-from db.db_table_init import get_connection, release_connection
-from log.log import log_info
-from typing import Optional, Dict, List, Union, Tuple, Any, Iterable, Literal
+from db.db_table_init import acquire, register_warmup_statement
+from log.log import log_info_nowait
+from typing import Optional, Dict, List, Union, Tuple, Any, Iterable, Literal, Mapping
 import json
+import bisect
+import asyncio
+import asyncpg
 from datetime import datetime, date, time, timezone
 from decimal import Decimal
+from types import MappingProxyType
 from enum import Enum
-from config.config import get_settings
+from dataclasses import dataclass, fields
+from time import monotonic
+from config.config import get_settings, DB_LOG_VERBOSE, DB_DSN
+
+# Наборы статусов заказов (собираются один раз на модуль и передаются как $n::text[])
+ACTIVE_STATUSES: Tuple[str, ...] = ('pending', 'accepted', 'in_place', 'started')
+ALL_OPEN_STATUSES: Tuple[str, ...] = ('pending', 'accepted', 'in_place', 'come_out', 'started')
+DRIVER_ACTIVE_STATUSES: Tuple[str, ...] = ('accepted', 'in_place', 'come_out', 'started', 'awaiting_fee')
+HISTORY_STATUSES: Tuple[str, ...] = ('completed', 'canceled')
+
+
+def _sql_in_list(values: Tuple[str, ...]) -> str:
+    """SQL-литерал для IN (...) из доверенных констант модуля (не для пользовательского ввода)."""
+    return ", ".join("'" + v.replace("'", "''") + "'" for v in values)
+
+
+# Запросы под частичные индексы (idx_orders_driver_active, idx_orders_hist_*) держат список статусов
+# литералом: с параметром $n::text[] планировщик не докажет предикат индекса в generic-плане,
+# на который asyncpg переходит после 5 выполнений. Списки совпадают с WHERE индексов в db_table_init.
+_DRIVER_ACTIVE_IN = _sql_in_list(DRIVER_ACTIVE_STATUSES)
+_HISTORY_IN = _sql_in_list(HISTORY_STATUSES)
+
+@dataclass(slots=True)
+class OrderRow:
+    """Строка заказа для списков UI. Порядок полей совпадает с порядком колонок в SELECT."""
+    order_id: int
+    status: str
+    passenger_id: Optional[int]
+    driver_id: Optional[int]
+    city: Optional[str]
+    address_from: Optional[str]
+    address_to: Optional[str]
+    order_date: Optional[datetime]
+    scheduled_at: Optional[datetime]
+    in_place_at: Optional[datetime]
+    trip_start: Optional[datetime]
+    trip_end: Optional[datetime]
+    distance_km: Optional[Decimal]
+    cost: Optional[Decimal]
+    commission_stars: Optional[int]
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return getattr(self, key, default)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in ORDER_LIST_COLUMNS}
+
+
+# Колонки заказа, которые реально нужны спискам/карточкам в UI (вместо SELECT *)
+ORDER_LIST_COLUMNS: Tuple[str, ...] = tuple(f.name for f in fields(OrderRow))
+_ORDER_LIST_SELECT = ", ".join(ORDER_LIST_COLUMNS)
+
+# Заглушки карточек на случай отсутствия строки/ошибки БД (read-only, без аллокаций на вызов)
+_EMPTY_PASSENGER = MappingProxyType({"first_name": "-", "phone_passenger": "-"})
+_EMPTY_DRIVER = MappingProxyType({
+    "first_name": "-", "phone_driver": "-", "car_model": "-", "car_color": "-", "car_number": "-"
+})
 
 def _jsonable(obj):
     if obj is None or isinstance(obj, (bool, int, float, str)):
@@ -43,15 +103,18 @@ def _jsonable(obj):
 
 def _normalize_support_thread(raw: Any) -> Dict[str, Any]:
     """Возвращает корректный словарь диалога, даже если в БД лежат повреждённые данные."""
-    thread: Dict[str, Any] = {"items": [], "cursors": {}, "meta": {}}
+    # Быстрый путь: структура уже корректна (обычный случай) — отдаём как есть, без копий
+    if (
+        isinstance(raw, dict)
+        and isinstance(raw.get("items"), list)
+        and isinstance(raw.get("cursors"), dict)
+        and isinstance(raw.get("meta"), dict)
+    ):
+        return raw
 
-    # Преобразуем строковое JSON-представление, если колонка хранится как TEXT
-    if isinstance(raw, str):
-        try:
-            raw = json.loads(raw)
-        except json.JSONDecodeError:
-            return thread
+    thread: Dict[str, Any] = {"items": [], "cursors": {}, "meta": {}}
 
+    # JSONB декодируется кодеком пула (db_table_init._init_connection) сразу в dict
     if isinstance(raw, dict):
         items = raw.get("items")
         if isinstance(items, list):
@@ -98,12 +161,17 @@ def _latest_timestamp(items: List[Dict[str, Any]], *, author: str | None = None)
         return max(candidates)
 
 
+_SUPPORT_TS_MIN = datetime.min.replace(tzinfo=timezone.utc)
+
+
+def _support_item_sort_key(item: Dict[str, Any]) -> datetime:
+    """Ключ сортировки сообщения по временной метке."""
+    return _parse_support_ts(item.get("ts")) or _SUPPORT_TS_MIN
+
+
 def _sorted_support_items(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     """Возвращает список сообщений, отсортированный по временной метке."""
-    return sorted(
-        items,
-        key=lambda item: _parse_support_ts(item.get("ts")) or datetime.min.replace(tzinfo=timezone.utc),
-    )
+    return sorted(items, key=_support_item_sort_key)
 
 
 async def _save_support_thread(connection, user_id: int, thread: Dict[str, Any]) -> None:
@@ -121,24 +189,20 @@ async def _save_support_thread(connection, user_id: int, thread: Dict[str, Any])
 
 async def get_support_thread(user_id: int) -> Dict[str, Any]:
     """Возвращает историю обращений пользователя в техподдержку."""
-    connection = None
     try:
-        connection = await get_connection()
-        row = await connection.fetchrow('SELECT messages FROM "support_requests" WHERE user_id = $1;', user_id)
-        payload = dict(row).get("messages") if row else None
-        thread = _normalize_support_thread(payload)
-        thread["items"] = _sorted_support_items(thread.get("items", []))
-        return thread
+        async with acquire() as connection:
+            row = await connection.fetchrow('SELECT messages FROM "support_requests" WHERE user_id = $1;', user_id)
+            payload = row["messages"] if row else None
+            thread = _normalize_support_thread(payload)
+            thread["items"] = _sorted_support_items(thread.get("items", []))
+            return thread
     except Exception as error:
-        await log_info(
+        log_info_nowait(
             f"get_support_thread: ошибка чтения диалога → {error}",
             type_msg="error",
             user_id=user_id,
         )
         return {"items": [], "cursors": {}, "meta": {}}
-    finally:
-        if connection:
-            await release_connection(connection)
 
 
 async def append_support_message(
@@ -148,50 +212,47 @@ async def append_support_message(
     author: Literal["user", "admin"],
 ) -> Dict[str, Any] | None:
     """Добавляет сообщение в историю техподдержки с учётом блокировок."""
-    connection = None
     try:
-        connection = await get_connection()
-        async with connection.transaction():
-            row = await connection.fetchrow(
-                'SELECT messages FROM "support_requests" WHERE user_id = $1 FOR UPDATE;',
-                user_id,
+        async with acquire() as connection:
+            async with connection.transaction():
+                row = await connection.fetchrow(
+                    'SELECT messages FROM "support_requests" WHERE user_id = $1 FOR UPDATE;',
+                    user_id,
+                )
+                payload = row["messages"] if row else None
+                thread = _normalize_support_thread(payload)
+                items: List[Dict[str, Any]] = thread.get("items", [])
+
+                safe_entry = dict(entry or {})
+                safe_entry.setdefault("author", author)
+                if safe_entry.get("ts"):
+                    # Явная метка от вызывающего: вставляем на своё место без пересортировки
+                    bisect.insort_right(items, safe_entry, key=_support_item_sort_key)
+                else:
+                    # Метка «сейчас» всегда самая свежая — список остаётся упорядоченным
+                    safe_entry["ts"] = datetime.now(timezone.utc).isoformat()
+                    items.append(safe_entry)
+                thread["items"] = items
+
+                ts = safe_entry["ts"]
+                cursors_key = "user_last_read" if author == "user" else "admin_last_read"
+                thread["cursors"] = {**thread.get("cursors", {}), cursors_key: ts}
+                thread["meta"] = {**thread.get("meta", {}), "updated_at": ts, "last_author": author}
+
+                await _save_support_thread(connection, user_id, thread)
+
+        if DB_LOG_VERBOSE:
+            log_info_nowait(
+                "append_support_message: сообщение сохранено", type_msg="info", user_id=user_id
             )
-            payload = dict(row).get("messages") if row else None
-            thread = _normalize_support_thread(payload)
-            items: List[Dict[str, Any]] = thread.get("items", [])
-
-            safe_entry = dict(entry or {})
-            safe_entry.setdefault("author", author)
-            if not safe_entry.get("ts"):
-                safe_entry["ts"] = datetime.now(timezone.utc).isoformat()
-
-            items.append(safe_entry)
-            thread["items"] = _sorted_support_items(items)
-
-            cursors = thread.setdefault("cursors", {})
-            cursors_key = "user_last_read" if author == "user" else "admin_last_read"
-            cursors[cursors_key] = safe_entry.get("ts")
-
-            meta = thread.setdefault("meta", {})
-            meta["updated_at"] = safe_entry.get("ts")
-            meta["last_author"] = author
-
-            await _save_support_thread(connection, user_id, thread)
-
-        await log_info(
-            "append_support_message: сообщение сохранено", type_msg="info", user_id=user_id
-        )
         return thread
     except Exception as error:
-        await log_info(
+        log_info_nowait(
             f"append_support_message: ошибка записи сообщения → {error}",
             type_msg="error",
             user_id=user_id,
         )
         return None
-    finally:
-        if connection:
-            await release_connection(connection)
 
 
 async def mark_support_thread_read(
@@ -200,51 +261,48 @@ async def mark_support_thread_read(
     ts: str | None = None,
 ) -> bool:
     """Обновляет курсор прочитанных сообщений для пользователя или администратора."""
-    connection = None
     try:
-        connection = await get_connection()
-        async with connection.transaction():
-            row = await connection.fetchrow(
-                'SELECT messages FROM "support_requests" WHERE user_id = $1 FOR UPDATE;',
-                user_id,
+        async with acquire() as connection:
+            async with connection.transaction():
+                row = await connection.fetchrow(
+                    'SELECT messages FROM "support_requests" WHERE user_id = $1 FOR UPDATE;',
+                    user_id,
+                )
+                payload = row["messages"] if row else None
+                if payload is None:
+                    return False
+
+                thread = _normalize_support_thread(payload)
+                items = _sorted_support_items(thread.get("items", []))
+                thread["items"] = items
+
+                cursor_key = "user_last_read" if role == "user" else "admin_last_read"
+                target_ts = ts or _latest_timestamp(items)
+                if not target_ts:
+                    return False
+
+                prev_dt = _parse_support_ts(thread.get("cursors", {}).get(cursor_key))
+                next_dt = _parse_support_ts(target_ts)
+                if prev_dt and next_dt and next_dt <= prev_dt:
+                    return True
+
+                thread.setdefault("cursors", {})[cursor_key] = target_ts
+                thread.setdefault("meta", {})["last_read_role"] = role
+
+                await _save_support_thread(connection, user_id, thread)
+
+        if DB_LOG_VERBOSE:
+            log_info_nowait(
+                f"mark_support_thread_read: курсор для {role} обновлён", type_msg="info", user_id=user_id
             )
-            payload = dict(row).get("messages") if row else None
-            if payload is None:
-                return False
-
-            thread = _normalize_support_thread(payload)
-            items = _sorted_support_items(thread.get("items", []))
-            thread["items"] = items
-
-            cursor_key = "user_last_read" if role == "user" else "admin_last_read"
-            target_ts = ts or _latest_timestamp(items)
-            if not target_ts:
-                return False
-
-            prev_dt = _parse_support_ts(thread.get("cursors", {}).get(cursor_key))
-            next_dt = _parse_support_ts(target_ts)
-            if prev_dt and next_dt and next_dt <= prev_dt:
-                return True
-
-            thread.setdefault("cursors", {})[cursor_key] = target_ts
-            thread.setdefault("meta", {})["last_read_role"] = role
-
-            await _save_support_thread(connection, user_id, thread)
-
-        await log_info(
-            f"mark_support_thread_read: курсор для {role} обновлён", type_msg="info", user_id=user_id
-        )
         return True
     except Exception as error:
-        await log_info(
+        log_info_nowait(
             f"mark_support_thread_read: ошибка обновления курсора → {error}",
             type_msg="error",
             user_id=user_id,
         )
         return False
-    finally:
-        if connection:
-            await release_connection(connection)
 
 async def user_exists(user_id: int) -> bool:
     """
@@ -256,32 +314,29 @@ async def user_exists(user_id: int) -> bool:
     Returns:
       True if the user is found, False if the user doesn't exist or an error occurred.
     """
-    connection = None
     try:
-        connection = await get_connection()
-        # Execute a query to check if the user exists.
-        # Here the table is called "chat_ids", and it's assumed to have a "user_id" column.
-        query = "SELECT 1 FROM users WHERE user_id = $1 LIMIT 1;"
-        result = await connection.fetchval(query, user_id)
+        async with acquire() as connection:
+            # Execute a query to check if the user exists.
+            # Here the table is called "chat_ids", and it's assumed to have a "user_id" column.
+            query = "SELECT 1 FROM users WHERE user_id = $1 LIMIT 1;"
+            result = await connection.fetchval(query, user_id)
         
-        await log_info(
-            f"Проверка user_id {user_id} в таблице users завершена успешно.",
-            type_msg="info",
-            user_id=user_id,
-        )
+            if DB_LOG_VERBOSE:
+                log_info_nowait(
+                    f"Проверка user_id {user_id} в таблице users завершена успешно.",
+                    type_msg="info",
+                    user_id=user_id,
+                )
         
-        # If result is not None, the user was found.
-        return True if result else False
+            # If result is not None, the user was found.
+            return True if result else False
     except Exception as e:
-        await log_info(
+        log_info_nowait(
             f"Ошибка проверки пользователя {user_id}: {e}",
             type_msg="error",
             user_id=user_id,
         )
         return False
-    finally:
-        if connection:
-            await release_connection(connection)
 
 async def insert_into_table(table_name: str, data: dict, return_order_id: bool = False) -> bool:
     """
@@ -295,8 +350,7 @@ async def insert_into_table(table_name: str, data: dict, return_order_id: bool =
       - Если order_id == True → вернёт сгенерированный PK из колонки order_id (int или None при ошибке).
       - Если order_id == False → вернёт True/False по результату вставки.
     """
-    connection = await get_connection()
-    try:
+    async with acquire() as connection:
         cols = ", ".join(data.keys())
         vals = ", ".join([f"${i}" for i in range(1, len(data) + 1)])
 
@@ -306,19 +360,42 @@ async def insert_into_table(table_name: str, data: dict, return_order_id: bool =
             try:
                 return await connection.fetchval(q, *data.values())  # -> int | None
             except Exception as e:
-                await log_info(f"insert_into_table RETURNING order_id failed: {e}", type_msg="error")
+                log_info_nowait(f"insert_into_table RETURNING order_id failed: {e}", type_msg="error")
                 return None
         else:
             # обычная вставка без возврата
             q = f"INSERT INTO {table_name} ({cols}) VALUES ({vals})"
             try:
                 await connection.execute(q, *data.values())
+                if table_name == "users" and "user_id" in data:
+                    invalidate_user_theme(data["user_id"])
+                    invalidate_user_row(data["user_id"])
                 return True
             except Exception as e:
-                await log_info(f"insert_into_table failed: {e}", type_msg="error")
+                log_info_nowait(f"insert_into_table failed: {e}", type_msg="error")
                 return False
-    finally:
-        await release_connection(connection)
+
+async def insert_user_if_absent(data: dict) -> bool:
+    """
+    Вставляет строку users, если такого user_id ещё нет (ON CONFLICT DO NOTHING).
+
+    Возвращает:
+      True — строка создана этим вызовом; False — пользователь уже был или ошибка вставки.
+    """
+    cols = ", ".join(data.keys())
+    vals = ", ".join([f"${i}" for i in range(1, len(data) + 1)])
+    q = f"INSERT INTO users ({cols}) VALUES ({vals}) ON CONFLICT (user_id) DO NOTHING RETURNING user_id"
+    try:
+        async with acquire() as connection:
+            inserted = await connection.fetchval(q, *data.values())
+    except Exception as e:
+        log_info_nowait(f"insert_user_if_absent failed: {e}", type_msg="error")
+        return False
+    if inserted is None:
+        return False
+    invalidate_user_theme(inserted)
+    invalidate_user_row(inserted)
+    return True
 
 async def update_table(table_name: str, user_id: int, updates: dict, data_order_id: bool = False) -> bool:
     """
@@ -332,78 +409,139 @@ async def update_table(table_name: str, user_id: int, updates: dict, data_order_
     Returns:
         bool: True, если обновление прошло успешно, False в случае ошибки.
     """
-    connection = None
     try:
-        connection = await get_connection()
-
-        if data_order_id:
-            set_expr = ", ".join([f'"{col}" = ${i+1}' for i, col in enumerate(updates.keys())])
-            values = list(updates.values())
-
-            # добавляем order_id в параметры
-            query = f'UPDATE "{table_name}" SET {set_expr} WHERE order_id = ${len(values) + 1};'
-            values.append(user_id)
-
-            await connection.execute(query, *values)
-
-            await log_info(
-                f"Обновлены колонки {list(updates.keys())} в таблице {table_name} для order_id={user_id}",
-                type_msg="info",
-                user_id=user_id,
-            )
-            return True
-        else:
-            # формируем SET часть запроса
-            set_expr = ", ".join([f'"{col}" = ${i+1}' for i, col in enumerate(updates.keys())])
-            values = list(updates.values())
-
-            # добавляем user_id в параметры
-            query = f'UPDATE "{table_name}" SET {set_expr} WHERE user_id = ${len(values) + 1};'
-            values.append(user_id)
-
-            await connection.execute(query, *values)
-
-            await log_info(
-                f"Обновлены колонки {list(updates.keys())} в таблице {table_name} для user_id={user_id}",
-                type_msg="info",
-                user_id=user_id,
-            )
-            return True
-
+        async with acquire() as connection:
+            if data_order_id:
+                set_expr = ", ".join([f'"{col}" = ${i+1}' for i, col in enumerate(updates.keys())])
+                values = list(updates.values())
+
+                # добавляем order_id в параметры
+                query = f'UPDATE "{table_name}" SET {set_expr} WHERE order_id = ${len(values) + 1};'
+                values.append(user_id)
+
+                await connection.execute(query, *values)
+
+                if DB_LOG_VERBOSE:
+                    log_info_nowait(
+                        f"Обновлены колонки {list(updates.keys())} в таблице {table_name} для order_id={user_id}",
+                        type_msg="info",
+                        user_id=user_id,
+                    )
+                return True
+            else:
+                # формируем SET часть запроса
+                set_expr = ", ".join([f'"{col}" = ${i+1}' for i, col in enumerate(updates.keys())])
+                values = list(updates.values())
+
+                # добавляем user_id в параметры
+                query = f'UPDATE "{table_name}" SET {set_expr} WHERE user_id = ${len(values) + 1};'
+                values.append(user_id)
+
+                await connection.execute(query, *values)
+                if table_name == "users":
+                    invalidate_user_row(user_id)
+                    if "theme_mode" in updates:
+                        invalidate_user_theme(user_id)
+
+                if DB_LOG_VERBOSE:
+                    log_info_nowait(
+                        f"Обновлены колонки {list(updates.keys())} в таблице {table_name} для user_id={user_id}",
+                        type_msg="info",
+                        user_id=user_id,
+                    )
+                return True
     except Exception as e:
-        await log_info(
+        log_info_nowait(
             f"Ошибка при обновлении таблицы {table_name} для user_id={user_id}: {e}",
             type_msg="error",
             user_id=user_id,
         )
         return False
 
-    finally:
-        if connection:
-            await release_connection(connection)
+# Запись одной транзакции в users.transactions: элемент с тем же order_id заменяется на месте,
+# иначе дописывается в конец. В Postgres уходит только сама транзакция, а не вся история.
+_UPSERT_USER_TX_SQL = """
+UPDATE "users" AS u SET transactions = CASE
+    WHEN u.transactions @> jsonb_build_array(jsonb_build_object('order_id', $2::text)) THEN (
+        SELECT jsonb_agg(CASE WHEN t.e->>'order_id' = $2::text THEN $1::jsonb ELSE t.e END ORDER BY t.i)
+        FROM jsonb_array_elements(u.transactions) WITH ORDINALITY AS t(e, i)
+    )
+    WHEN jsonb_typeof(u.transactions) = 'array' THEN u.transactions || jsonb_build_array($1::jsonb)
+    ELSE jsonb_build_array($1::jsonb)
+END,
+    balance = COALESCE(u.balance, 0) + $4,
+    balance_updated_at = CASE WHEN $4 <> 0 THEN NOW() ELSE u.balance_updated_at END{extra}
+WHERE u.user_id = $3
+  -- уже проведённую транзакцию не переписываем и баланс повторно не сдвигаем:
+  -- защита от параллельной доставки одного и того же платежа
+  AND NOT COALESCE(
+      u.transactions @> jsonb_build_array(jsonb_build_object('order_id', $2::text, 'status', 'succeeded')),
+      FALSE
+  )
+RETURNING u.balance
+"""
+
+
+async def upsert_user_transaction(
+    user_id: int,
+    tx: Dict[str, Any],
+    balance_delta: int = 0,
+    updates: Dict[str, Any] | None = None,
+) -> int | None:
+    """
+    Записывает транзакцию tx (ключ — tx["order_id"]) в JSONB-массив users.transactions
+    без выгрузки и перезаписи всей истории из Python и атомарно сдвигает баланс на balance_delta.
+    updates — дополнительные колонки users, обновляемые тем же UPDATE.
+
+    Returns:
+        int | None: баланс после операции; None — пользователь не найден или транзакция
+        с этим order_id уже в статусе succeeded (ничего не изменено).
+        Ошибки БД пробрасываются вызывающему.
+    """
+    updates = updates or {}
+    extra = "".join(f', "{col}" = ${i + 5}' for i, col in enumerate(updates))
+    async with acquire() as connection:
+        row = await connection.fetchrow(
+            _UPSERT_USER_TX_SQL.format(extra=extra),
+            tx,
+            str(tx.get("order_id") or ""),
+            user_id,
+            int(balance_delta),
+            *updates.values(),
+        )
+    if row is None:
+        return None
+    invalidate_user_row(user_id)
+    if DB_LOG_VERBOSE:
+        log_info_nowait(
+            f"upsert_user_transaction: order_id={tx.get('order_id')} записан, delta={balance_delta}",
+            type_msg="info",
+            user_id=user_id,
+        )
+    return int(row["balance"])
+
 
 async def delete_user(user_id: int) -> bool:
     """Удаляем пользователя по user_id."""
-    connection = None
     try:
-        connection = await get_connection()
-        await connection.execute('DELETE FROM "users" WHERE user_id = $1;', user_id)
-        await log_info(
-            f"Удалена строка пользователя user_id={user_id} из таблицы users",
-            type_msg="info",
-            user_id=user_id,
-        )
-        return True
+        async with acquire() as connection:
+            await connection.execute('DELETE FROM "users" WHERE user_id = $1;', user_id)
+            invalidate_user_theme(user_id)
+            invalidate_user_row(user_id)
+            if DB_LOG_VERBOSE:
+                log_info_nowait(
+                    f"Удалена строка пользователя user_id={user_id} из таблицы users",
+                    type_msg="info",
+                    user_id=user_id,
+                )
+            return True
     except Exception as e:
-        await log_info(
+        log_info_nowait(
             f"Ошибка удаления пользователя user_id={user_id}: {e}",
             type_msg="error",
             user_id=user_id,
         )
         return False
-    finally:
-        if connection:
-            await release_connection(connection)
 
 async def get_user_data(table_name: str, user_id: int) -> dict | None:
     """
@@ -416,56 +554,79 @@ async def get_user_data(table_name: str, user_id: int) -> dict | None:
     Returns:
         dict | None: словарь с данными пользователя или None, если не найдено/ошибка
     """
-    connection = None
     try:
-        connection = await get_connection()
-
-        query = f'SELECT * FROM "{table_name}" WHERE user_id = $1 LIMIT 1;'
-        row = await connection.fetchrow(query, user_id)
-
-        if row:
-            await log_info(
-                f"Данные получены из {table_name} для user_id={user_id}",
-                type_msg="info",
+        async with acquire() as connection:
+            query = f'SELECT * FROM "{table_name}" WHERE user_id = $1 LIMIT 1;'
+            row = await connection.fetchrow(query, user_id)
+
+            if row:
+                if DB_LOG_VERBOSE:
+                    log_info_nowait(
+                        f"Данные получены из {table_name} для user_id={user_id}",
+                        type_msg="info",
+                        user_id=user_id,
+                    )
+                return dict(row)
+
+            log_info_nowait(
+                f"Запись не найдена в {table_name} для user_id={user_id}",
+                type_msg="warning",
                 user_id=user_id,
             )
-            return dict(row)
-
-        await log_info(
-            f"Запись не найдена в {table_name} для user_id={user_id}",
-            type_msg="warning",
-            user_id=user_id,
-        )
-        return None
-
+            return None
     except Exception as e:
-        await log_info(
+        log_info_nowait(
             f"Ошибка при получении данных из {table_name} для user_id={user_id}: {e}",
             type_msg="error",
             user_id=user_id,
         )
         return None
 
-    finally:
-        if connection:
-            await release_connection(connection)
+# TTL-кеш строк users для дешёвых проверок на горячих путях (/start: есть ли пользователь, не заблокирован ли).
+# user_id -> (момент устаревания, строка). Кешируются только найденные строки; записи через
+# update_table/insert_into_table/delete_user сбрасывают запись, прочие писатели — через invalidate_user_row.
+# Для read-modify-write (баланс, транзакции) использовать get_user_data — здесь данные могут отставать на TTL.
+_user_row_cache: Dict[int, Tuple[float, dict]] = {}
+_USER_ROW_TTL = 60.0
+_USER_ROW_CACHE_MAX = 10_000
+
+
+def invalidate_user_row(user_id: int) -> None:
+    """Сбрасывает закешированную строку пользователя."""
+    _user_row_cache.pop(user_id, None)
+
+
+async def get_user_row_cached(user_id: int) -> dict | None:
+    """
+    Строка users по user_id из TTL-кеша (при промахе — get_user_data).
+    Возвращаемый dict общий для всех вызывающих — его нельзя мутировать.
+    """
+    now = monotonic()
+    cached = _user_row_cache.get(user_id)
+    if cached is not None and cached[0] > now:
+        return cached[1]
+    row = await get_user_data("users", user_id)
+    if row is not None:
+        if len(_user_row_cache) >= _USER_ROW_CACHE_MAX:
+            # Вытесняем самую старую запись (dict хранит порядок вставки)
+            _user_row_cache.pop(next(iter(_user_row_cache)))
+        _user_row_cache[user_id] = (now + _USER_ROW_TTL, row)
+    return row
 
 async def get_available_drivers(city: str):
     """Список доступных водителей в городе"""
-    connection = await get_connection()
-    try:
-        query = """
-            SELECT user_id FROM users
-            WHERE role = 'driver'
-              AND is_working = TRUE
-              AND city = $1
-        """
-        return await connection.fetch(query, city)
-    except Exception as e:
-        await log_info(f"Ошибка при получении доступных водителей в {city}: {e}", type_msg="error")
-        return []
-    finally:
-        await release_connection(connection)
+    async with acquire() as connection:
+        try:
+            query = """
+                SELECT user_id FROM users
+                WHERE role = 'driver'
+                  AND is_working = TRUE
+                  AND city = $1
+            """
+            return await connection.fetch(query, city)
+        except Exception as e:
+            log_info_nowait(f"Ошибка при получении доступных водителей в {city}: {e}", type_msg="error")
+            return []
 
 async def reserve_order(order_id: int, driver_id: int) -> Optional[Dict]:
     """
@@ -473,110 +634,96 @@ async def reserve_order(order_id: int, driver_id: int) -> Optional[Dict]:
     SET driver_id, status='accepted' WHERE id=$1 AND driver_id IS NULL AND status='pending'
     Возвращает краткие данные заказа (для сообщений) или None.
     """
-    connection = await get_connection()
-    try:
-        row = await connection.fetchrow(
-            """
-            UPDATE orders
-            SET driver_id = $1, status = 'accepted'
-            WHERE order_id = $2 AND driver_id IS NULL AND status = 'pending'
-            RETURNING passenger_id, city, address_from, address_to
-            """,
-            driver_id, order_id
-        )
-        return dict(row) if row else None
-    except Exception as e:
-        await log_info(
-            f"reserve_order failed: {e}",
-            type_msg="error",
-            user_id=driver_id,
-        )
-        return None
-    finally:
-        await release_connection(connection)
+    async with acquire() as connection:
+        try:
+            row = await connection.fetchrow(
+                """
+                UPDATE orders
+                SET driver_id = $1, status = 'accepted'
+                WHERE order_id = $2 AND driver_id IS NULL AND status = 'pending'
+                RETURNING passenger_id, city, address_from, address_to
+                """,
+                driver_id, order_id
+            )
+            return dict(row) if row else None
+        except Exception as e:
+            log_info_nowait(
+                f"reserve_order failed: {e}",
+                type_msg="error",
+                user_id=driver_id,
+            )
+            return None
 
 
 async def set_driver_working(driver_id: int, is_working: bool) -> bool:
-    connection = await get_connection()
-    try:
-        await connection.execute("UPDATE users SET is_working = $1 WHERE user_id = $2", is_working, driver_id)
-        return True
-    except Exception as e:
-        await log_info(
-            f"set_driver_working failed: {e}",
-            type_msg="error",
-            user_id=driver_id,
-        )
-        return False
-    finally:
-        await release_connection(connection)
+    async with acquire() as connection:
+        try:
+            await connection.execute("UPDATE users SET is_working = $1 WHERE user_id = $2", is_working, driver_id)
+            return True
+        except Exception as e:
+            log_info_nowait(
+                f"set_driver_working failed: {e}",
+                type_msg="error",
+                user_id=driver_id,
+            )
+            return False
 
 
-async def fetch_passenger_contact(passenger_id: int) -> Dict:
-    connection = await get_connection()
-    try:
-        row = await connection.fetchrow(
-            "SELECT first_name, phone_passenger FROM users WHERE user_id = $1",
-            passenger_id
-        )
-        return dict(row) if row else {"first_name": "-", "phone_passenger": "-"}
-    except Exception as e:
-        await log_info(
-            f"fetch_passenger_contact failed: {e}",
-            type_msg="error",
-            user_id=passenger_id,
-        )
-        return {"first_name": "-", "phone_passenger": "-"}
-    finally:
-        await release_connection(connection)
+async def fetch_passenger_contact(passenger_id: int) -> Mapping[str, Any]:
+    async with acquire() as connection:
+        try:
+            row = await connection.fetchrow(
+                "SELECT first_name, phone_passenger FROM users WHERE user_id = $1",
+                passenger_id
+            )
+            return dict(row) if row else _EMPTY_PASSENGER
+        except Exception as e:
+            log_info_nowait(
+                f"fetch_passenger_contact failed: {e}",
+                type_msg="error",
+                user_id=passenger_id,
+            )
+            return _EMPTY_PASSENGER
 
 
-async def fetch_driver_card(driver_id: int) -> Dict:
-    connection = await get_connection()
-    try:
-        row = await connection.fetchrow(
-            """
-            SELECT first_name, phone_driver, car_model, car_color, car_number
-            FROM users WHERE user_id = $1
-            """,
-            driver_id
-        )
-        return dict(row) if row else {
-            "first_name": "-", "phone_driver": "-", "car_model": "-", "car_color": "-", "car_number": "-"
-        }
-    except Exception as e:
-        await log_info(
-            f"fetch_driver_card failed: {e}",
-            type_msg="error",
-            user_id=driver_id,
-        )
-        return {
-            "first_name": "-", "phone_driver": "-", "car_model": "-", "car_color": "-", "car_number": "-"
-        }
-    finally:
-        await release_connection(connection)
+async def fetch_driver_card(driver_id: int) -> Mapping[str, Any]:
+    async with acquire() as connection:
+        try:
+            row = await connection.fetchrow(
+                """
+                SELECT first_name, phone_driver, car_model, car_color, car_number
+                FROM users WHERE user_id = $1
+                """,
+                driver_id
+            )
+            return dict(row) if row else _EMPTY_DRIVER
+        except Exception as e:
+            log_info_nowait(
+                f"fetch_driver_card failed: {e}",
+                type_msg="error",
+                user_id=driver_id,
+            )
+            return _EMPTY_DRIVER
 
 
 async def list_other_available_drivers(city: str, exclude_user_id: int) -> List[int]:
-    connection = await get_connection()
-    try:
-        rows = await connection.fetch(
-            """
-            SELECT user_id FROM users
-            WHERE role = 'driver' AND is_working = TRUE AND city = $1 AND user_id != $2
-            """,
-            city, exclude_user_id
-        )
-        return [r["user_id"] for r in rows]
-    except Exception as e:
-        await log_info(
-            f"list_other_available_drivers failed: {e}",
-            type_msg="error",
-            user_id=exclude_user_id,
-        )
-        return []
-    finally:
-        await release_connection(connection)
+    async with acquire() as connection:
+        try:
+            rows = await connection.fetch(
+                """
+                SELECT user_id FROM users
+                WHERE role = 'driver' AND is_working = TRUE AND city = $1 AND user_id != $2
+                """,
+                city, exclude_user_id
+            )
+            return [r["user_id"] for r in rows]
+        except Exception as e:
+            log_info_nowait(
+                f"list_other_available_drivers failed: {e}",
+                type_msg="error",
+                user_id=exclude_user_id,
+            )
+            return []
 
 
 async def cancel_order(order_id: int, initiator_id: int) -> Optional[Dict]:
@@ -585,188 +732,166 @@ async def cancel_order(order_id: int, initiator_id: int) -> Optional[Dict]:
     Ставит status='canceled', инициатора и trip_end=NOW() (момент отмены).
     Возвращает {'passenger_id': int, 'driver_id': Optional[int]} или None.
     """
-    connection = await get_connection()
-    try:
-        row = await connection.fetchrow(
-            """
-            UPDATE orders
-            SET status = 'canceled',
-                initiator_id = $2,
-                trip_end = NOW()
-            WHERE order_id = $1
-              AND status IN ('pending','accepted','in_place','come_out','started')
-            RETURNING passenger_id, driver_id
-            """,
-            order_id, initiator_id
-        )
-        if not row:
+    async with acquire() as connection:
+        try:
+            row = await connection.fetchrow(
+                """
+                UPDATE orders
+                SET status = 'canceled',
+                    initiator_id = $2,
+                    trip_end = NOW()
+                WHERE order_id = $1
+                  AND status = ANY($3::text[])
+                RETURNING passenger_id, driver_id
+                """,
+                order_id, initiator_id, ALL_OPEN_STATUSES
+            )
+            if not row:
+                return None
+            return {"passenger_id": row["passenger_id"], "driver_id": row["driver_id"]}
+        except Exception as e:
+            log_info_nowait(
+                f"cancel_order failed: {e}",
+                type_msg="error",
+                user_id=initiator_id,
+            )
             return None
-        return {"passenger_id": row["passenger_id"], "driver_id": row["driver_id"]}
-    except Exception as e:
-        await log_info(
-            f"cancel_order failed: {e}",
-            type_msg="error",
-            user_id=initiator_id,
-        )
-        return None
-    finally:
-        await release_connection(connection)
 
 async def get_order_data(order_id: int) -> Optional[Dict]:
     """Вернуть полную строку заказа по order_id."""
-    connection = None
     try:
-        connection = await get_connection()
-        row = await connection.fetchrow('SELECT * FROM orders WHERE order_id = $1 LIMIT 1;', order_id)
-        return dict(row) if row else None
+        async with acquire() as connection:
+            row = await connection.fetchrow('SELECT * FROM orders WHERE order_id = $1 LIMIT 1;', order_id)
+            return dict(row) if row else None
     except Exception as e:
-        await log_info(f"get_order_data failed: {e}", type_msg="error")
+        log_info_nowait(f"get_order_data failed: {e}", type_msg="error")
         return None
-    finally:
-        if connection:
-            await release_connection(connection)
 
 async def get_order_message_id(order_id: int) -> Optional[int]:
     """Вернуть message_id служебного сообщения заказа (для reply-треда)."""
-    connection = None
     try:
-        connection = await get_connection()
-        mid = await connection.fetchval('SELECT message_id FROM orders WHERE order_id = $1;', order_id)
-        return int(mid) if mid else None
+        async with acquire() as connection:
+            mid = await connection.fetchval('SELECT message_id FROM orders WHERE order_id = $1;', order_id)
+            return int(mid) if mid else None
     except Exception as e:
-        await log_info(f"get_order_message_id failed: {e}", type_msg="error")
+        log_info_nowait(f"get_order_message_id failed: {e}", type_msg="error")
         return None
-    finally:
-        if connection:
-            await release_connection(connection)
 
 
 async def complete_order(order_id: int, driver_id: int) -> Optional[int]:
     """status='completed', trip_end=NOW()."""
-    conn = await get_connection()
-    try:
-        row = await conn.fetchrow(
-            """
-            UPDATE orders
-               SET status = 'completed',
-                   trip_end = NOW()
-             WHERE order_id = $1
-               AND driver_id = $2
-               AND status NOT IN ('canceled','completed')
-            RETURNING passenger_id
-            """, order_id, driver_id
-        )
-        return row["passenger_id"] if row else None
-    except Exception as e:
-        await log_info(
-            f"complete_order failed: {e}",
-            type_msg="error",
-            user_id=driver_id,
-        )
-        return None
-    finally:
-        await release_connection(conn)
+    async with acquire() as conn:
+        try:
+            row = await conn.fetchrow(
+                """
+                UPDATE orders
+                   SET status = 'completed',
+                       trip_end = NOW()
+                 WHERE order_id = $1
+                   AND driver_id = $2
+                   AND status NOT IN ('canceled','completed')
+                RETURNING passenger_id
+                """, order_id, driver_id
+            )
+            return row["passenger_id"] if row else None
+        except Exception as e:
+            log_info_nowait(
+                f"complete_order failed: {e}",
+                type_msg="error",
+                user_id=driver_id,
+            )
+            return None
 
 async def mark_trip_started(order_id: int, driver_id: int) -> bool:
     """status='started', trip_start=NOW()."""
-    conn = await get_connection()
-    try:
-        row = await conn.fetchrow(
-            """
-            UPDATE orders
-               SET status = 'started',
-                   trip_start = COALESCE(trip_start, NOW())
-             WHERE order_id = $1
-               AND driver_id = $2
-               AND status NOT IN ('canceled','completed')
-            RETURNING order_id
-            """, order_id, driver_id
-        )
-        return bool(row)
-    except Exception as e:
-        await log_info(
-            f"mark_trip_started failed: {e}",
-            type_msg="error",
-            user_id=driver_id,
-        )
-        return False
-    finally:
-        await release_connection(conn)
+    async with acquire() as conn:
+        try:
+            row = await conn.fetchrow(
+                """
+                UPDATE orders
+                   SET status = 'started',
+                       trip_start = COALESCE(trip_start, NOW())
+                 WHERE order_id = $1
+                   AND driver_id = $2
+                   AND status NOT IN ('canceled','completed')
+                RETURNING order_id
+                """, order_id, driver_id
+            )
+            return bool(row)
+        except Exception as e:
+            log_info_nowait(
+                f"mark_trip_started failed: {e}",
+                type_msg="error",
+                user_id=driver_id,
+            )
+            return False
 
 async def mark_driver_arrived(order_id: int) -> bool:
     """status='in_place', in_place_at=NOW()."""
-    conn = await get_connection()
-    try:
-        row = await conn.fetchrow(
-            """
-            UPDATE orders
-               SET status = 'in_place',
-                   in_place_at = COALESCE(in_place_at, NOW())
-             WHERE order_id = $1
-               AND status NOT IN ('canceled','completed')
-            RETURNING order_id
-            """, order_id
-        )
-        return bool(row)
-    except Exception as e:
-        await log_info(f"mark_driver_arrived failed: {e}", type_msg="error")
-        return False
-    finally:
-        await release_connection(conn)
+    async with acquire() as conn:
+        try:
+            row = await conn.fetchrow(
+                """
+                UPDATE orders
+                   SET status = 'in_place',
+                       in_place_at = COALESCE(in_place_at, NOW())
+                 WHERE order_id = $1
+                   AND status NOT IN ('canceled','completed')
+                RETURNING order_id
+                """, order_id
+            )
+            return bool(row)
+        except Exception as e:
+            log_info_nowait(f"mark_driver_arrived failed: {e}", type_msg="error")
+            return False
 
 async def ensure_order_date_now(order_id: int) -> None:
     """
     Если у заказа order_date = NULL (нет DEFAULT в схеме) — проставляет NOW().
     Безопасно, ничего не возвращает.
     """
-    conn = await get_connection()
-    try:
-        await conn.execute(
-            """
-            UPDATE orders
-               SET order_date = COALESCE(order_date, NOW())
-             WHERE order_id = $1
-            """,
-            order_id
-        )
-    except Exception as e:
-        await log_info(f"ensure_order_date_now failed: {e}", type_msg="error")
-    finally:
-        await release_connection(conn)
+    async with acquire() as conn:
+        try:
+            await conn.execute(
+                """
+                UPDATE orders
+                   SET order_date = COALESCE(order_date, NOW())
+                 WHERE order_id = $1
+                """,
+                order_id
+            )
+        except Exception as e:
+            log_info_nowait(f"ensure_order_date_now failed: {e}", type_msg="error")
 
 async def mark_passenger_comeout(order_id: int) -> bool:
     """status='come_out', come_out_at=NOW()."""
-    conn = await get_connection()
-    try:
-        row = await conn.fetchrow(
-            """
-            UPDATE orders
-               SET status = 'come_out',
-                   come_out_at = COALESCE(come_out_at, NOW())
-             WHERE order_id = $1
-               AND status NOT IN ('canceled','completed')
-            RETURNING order_id
-            """, order_id
-        )
-        return bool(row)
-    except Exception as e:
-        await log_info(f"mark_passenger_comeout failed: {e}", type_msg="error")
-        return False
-    finally:
-        await release_connection(conn)
+    async with acquire() as conn:
+        try:
+            row = await conn.fetchrow(
+                """
+                UPDATE orders
+                   SET status = 'come_out',
+                       come_out_at = COALESCE(come_out_at, NOW())
+                 WHERE order_id = $1
+                   AND status NOT IN ('canceled','completed')
+                RETURNING order_id
+                """, order_id
+            )
+            return bool(row)
+        except Exception as e:
+            log_info_nowait(f"mark_passenger_comeout failed: {e}", type_msg="error")
+            return False
 
 async def mark_auto_start_hint_sent(order_id: int) -> None:
     """Помечаем момент отправки auto_start_hint."""
-    conn = await get_connection()
-    try:
-        await conn.execute(
-            "UPDATE orders SET auto_start_hint_at = COALESCE(auto_start_hint_at, NOW()) WHERE order_id = $1",
-            order_id
-        )
-    except Exception as e:
-        await log_info(f"mark_auto_start_hint_sent failed: {e}", type_msg="error")
-    finally:
-        await release_connection(conn)
+    async with acquire() as conn:
+        try:
+            await conn.execute(
+                "UPDATE orders SET auto_start_hint_at = COALESCE(auto_start_hint_at, NOW()) WHERE order_id = $1",
+                order_id
+            )
+        except Exception as e:
+            log_info_nowait(f"mark_auto_start_hint_sent failed: {e}", type_msg="error")
 
 # === Сохранение/восстановление снапшота рантайм-переменных ===
 
@@ -775,25 +900,23 @@ async def save_runtime_snapshot(key: str, payload: dict) -> bool:
     UPSERT снапшота (key -> JSONB payload).
     Без asyncpg.Json: сериализуем сами и кастуем к ::jsonb.
     """
-    conn = await get_connection()
-    try:
-        json_ready = _jsonable(payload)
-        await conn.execute(
-            """
-            INSERT INTO bot_runtime(key, payload)
-                 VALUES ($1, $2::jsonb)
-            ON CONFLICT (key)
-            DO UPDATE SET payload = EXCLUDED.payload,
-                          updated_at = NOW()
-            """,
-            key, json.dumps(json_ready, ensure_ascii=False)
-        )
-        return True
-    except Exception as e:
-        await log_info(f"save_runtime_snapshot failed: {e}", type_msg="error")
-        return False
-    finally:
-        await release_connection(conn)
+    async with acquire() as conn:
+        try:
+            json_ready = _jsonable(payload)
+            await conn.execute(
+                """
+                INSERT INTO bot_runtime(key, payload)
+                     VALUES ($1, $2::jsonb)
+                ON CONFLICT (key)
+                DO UPDATE SET payload = EXCLUDED.payload,
+                              updated_at = NOW()
+                """,
+                key, json.dumps(json_ready, ensure_ascii=False)
+            )
+            return True
+        except Exception as e:
+            log_info_nowait(f"save_runtime_snapshot failed: {e}", type_msg="error")
+            return False
 
 
 async def load_runtime_snapshot(key: str) -> Optional[dict]:
@@ -801,145 +924,275 @@ async def load_runtime_snapshot(key: str) -> Optional[dict]:
     Читает JSONB из bot_runtime.payload.
     asyncpg возвращает Python-объект (dict/list/...); если это dict — отдаём его.
     """
-    conn = await get_connection()
-    try:
-        row = await conn.fetchrow("SELECT payload FROM bot_runtime WHERE key = $1", key)
-        if not row:
+    async with acquire() as conn:
+        try:
+            row = await conn.fetchrow("SELECT payload FROM bot_runtime WHERE key = $1", key)
+            if not row:
+                return None
+            val = row["payload"]
+            return val if isinstance(val, dict) else None
+        except Exception as e:
+            log_info_nowait(f"load_runtime_snapshot failed: {e}", type_msg="error")
             return None
-        val = row["payload"]
-        return val if isinstance(val, dict) else None
-    except Exception as e:
-        await log_info(f"load_runtime_snapshot failed: {e}", type_msg="error")
-        return None
-    finally:
-        await release_connection(conn)
+
+async def _fetch_orders_by_statuses(select: str, statuses: Iterable[str]) -> List[asyncpg.Record]:
+    """Общий запрос выборки заказов по набору статусов; select — список колонок (константа модуля)."""
+    async with acquire() as connection:
+        return await connection.fetch(
+            f"SELECT {select} FROM orders WHERE status = ANY($1::text[])",
+            statuses if isinstance(statuses, (list, tuple)) else list(statuses),
+        )
+
 
 async def get_active_order_ids() -> List[int]:
     """
     Вернёт список order_id для активных заказов.
     Активные статусы: pending, accepted, in_place, started.
     """
-    connection = await get_connection()
     try:
-        rows = await connection.fetch(
-            """
-            SELECT order_id
-              FROM orders
-             WHERE status IN ('pending','accepted','in_place','started')
-            """
-        )
-        return [int(r["order_id"]) for r in rows]
+        rows = await _fetch_orders_by_statuses("order_id", ACTIVE_STATUSES)
+        return [r[0] for r in rows]
     except Exception as e:
-        await log_info(f"get_active_order_ids failed: {e}", type_msg="error")
+        log_info_nowait(f"get_active_order_ids failed: {e}", type_msg="error")
         return []
-    finally:
-        await release_connection(connection)
 
 async def get_orders_by_statuses(statuses: Iterable[str]) -> List[Dict]:
     """
     Вернёт полные строки заказов по списку статусов.
     """
-    connection = await get_connection()
     try:
-        rows = await connection.fetch(
-            """SELECT * FROM orders WHERE status = ANY($1::text[])""",
-            list(statuses)
-        )
+        rows = await _fetch_orders_by_statuses("*", statuses)
         return [dict(r) for r in rows]
     except Exception as e:
-        await log_info(f"get_orders_by_statuses failed: {e}", type_msg="error")
+        log_info_nowait(f"get_orders_by_statuses failed: {e}", type_msg="error")
         return []
-    finally:
-        await release_connection(connection)
 
 async def get_latest_open_order_id_for_passenger(passenger_id: int) -> Optional[int]:
     """
     Вернёт order_id последнего «живого» заказа пассажира или None.
     Активные статусы: pending, accepted, in_place, come_out, started.
     """
-    connection = None
     try:
-        connection = await get_connection()
-        order_id = await connection.fetchval(
-            """
-            SELECT order_id
-              FROM orders
-             WHERE passenger_id = $1
-               AND COALESCE(status,'pending') IN
-                   ('pending','accepted','in_place','come_out','started')
-             ORDER BY order_date DESC NULLS LAST, order_id DESC
-             LIMIT 1
-            """,
-            passenger_id
-        )
+        async with acquire() as connection:
+            order_id = await connection.fetchval(
+                """
+                SELECT order_id
+                  FROM orders
+                 WHERE passenger_id = $1
+                   AND COALESCE(status,'pending') = ANY($2::text[])
+                 ORDER BY order_date DESC NULLS LAST, order_id DESC
+                 LIMIT 1
+                """,
+                passenger_id, ALL_OPEN_STATUSES
+            )
 
-        if order_id:
-            await log_info(
-                f"Найден активный заказ для passenger_id={passenger_id}: order_id={order_id}",
-                type_msg="info",
+            if order_id:
+                if DB_LOG_VERBOSE:
+                    log_info_nowait(
+                        f"Найден активный заказ для passenger_id={passenger_id}: order_id={order_id}",
+                        type_msg="info",
+                        user_id=passenger_id,
+                    )
+                return int(order_id)
+
+            log_info_nowait(
+                f"Активный заказ для passenger_id={passenger_id} не найден.",
+                type_msg="warning",
                 user_id=passenger_id,
             )
-            return int(order_id)
-
-        await log_info(
-            f"Активный заказ для passenger_id={passenger_id} не найден.",
-            type_msg="warning",
-            user_id=passenger_id,
-        )
-        return None
-
+            return None
     except Exception as e:
-        await log_info(
+        log_info_nowait(
             f"get_latest_open_order_id_for_passenger failed: {e}",
             type_msg="error",
             user_id=passenger_id,
         )
         return None
 
-    finally:
-        if connection:
-            await release_connection(connection)
+_SQL_DRIVER_ACTIVE_ORDER = f"""
+    SELECT {_ORDER_LIST_SELECT}
+      FROM orders
+     WHERE driver_id = $1
+       AND status IN ({_DRIVER_ACTIVE_IN})
+     ORDER BY order_date DESC NULLS LAST, order_id DESC
+     LIMIT 1
+"""
+
 
 async def get_active_order_for_driver(driver_id: int) -> Optional[Dict[str, Any]]:
     """Возвращает активный заказ для водителя либо None."""
-    connection = None
     try:
-        connection = await get_connection()
-        row = await connection.fetchrow(
-            """
-            SELECT *
-              FROM orders
-             WHERE driver_id = $1
-               AND status IN ('accepted','in_place','come_out','started','awaiting_fee')
-             ORDER BY order_date DESC NULLS LAST, order_id DESC
-             LIMIT 1
-            """,
-            driver_id,
-        )
-        if row:
-            await log_info(
-                "[db_utils.get_active_order_for_driver] найден активный заказ",
-                type_msg="info",
+        async with acquire() as connection:
+            row = await connection.fetchrow(_SQL_DRIVER_ACTIVE_ORDER, driver_id)
+            if row:
+                if DB_LOG_VERBOSE:
+                    log_info_nowait(
+                        "[db_utils.get_active_order_for_driver] найден активный заказ",
+                        type_msg="info",
+                        user_id=driver_id,
+                        order_id=row["order_id"],
+                    )
+                return dict(row)
+            log_info_nowait(
+                "[db_utils.get_active_order_for_driver] активный заказ не найден",
+                type_msg="warning",
                 user_id=driver_id,
-                order_id=row["order_id"],
             )
-            return dict(row)
-        await log_info(
-            "[db_utils.get_active_order_for_driver] активный заказ не найден",
-            type_msg="warning",
-            user_id=driver_id,
-        )
-        return None
+            return None
     except Exception as error:
-        await log_info(
+        log_info_nowait(
             f"[db_utils.get_active_order_for_driver] ошибка: {error}",
             type_msg="error",
             user_id=driver_id,
         )
         return None
-    finally:
-        if connection:
-            await release_connection(connection)
+
+
+# Один статический запрос на все комбинации фильтров: NULL в параметре отключает условие
+_SQL_AVAILABLE_ORDERS = f"""
+    SELECT {_ORDER_LIST_SELECT}
+      FROM orders
+     WHERE status = 'pending'
+       AND driver_id IS NULL
+       AND ($1::text IS NULL OR COALESCE(city, '') = $1)
+       AND ($2::bigint IS NULL OR COALESCE(passenger_id, 0) <> $2)
+     ORDER BY scheduled_at NULLS LAST, order_date DESC NULLS LAST, order_id DESC
+     LIMIT $3
+"""
+register_warmup_statement(_SQL_AVAILABLE_ORDERS, None, None, 0)
+
+
+# === Города с ожидающими заказами (LISTEN/NOTIFY) ===
+# Триггер на orders шлёт NOTIFY с городом при любом изменении его pending-заказов,
+# воркер перепроверяет город в БД. Пока слушатель не готов — фильтр не применяется.
+_PENDING_CITY_CHANNEL = "order_pending_city"
+_cities_with_pending: set[str] = set()
+_pending_city_ready = False
+_pending_city_conn: Optional[asyncpg.Connection] = None
+_pending_city_queue: Optional[asyncio.Queue] = None
+_pending_city_task: Optional[asyncio.Task] = None
+_pending_city_supervisor: Optional[asyncio.Task] = None
+_pending_city_lost: Optional[asyncio.Event] = None
+_PENDING_CITY_RETRY_MIN = 1.0
+_PENDING_CITY_RETRY_MAX = 60.0
+
+_SQL_CITIES_WITH_PENDING = """
+    SELECT DISTINCT COALESCE(city, '') FROM orders
+     WHERE status = 'pending' AND driver_id IS NULL AND COALESCE(city, '') = ANY($1::text[])
+"""
+
+
+def _on_pending_city_notify(connection, pid, channel, payload) -> None:
+    if _pending_city_queue is not None:
+        _pending_city_queue.put_nowait(payload or "")
+
+
+def _on_pending_city_conn_lost(connection) -> None:
+    global _pending_city_ready
+    _pending_city_ready = False
+    if _pending_city_lost is not None:
+        _pending_city_lost.set()
+
+
+async def _pending_city_worker() -> None:
+    """Перепроверяет города из уведомлений; накопившуюся очередь схлопывает в один запрос."""
+    while True:
+        cities = {await _pending_city_queue.get()}
+        while not _pending_city_queue.empty():
+            cities.add(_pending_city_queue.get_nowait())
+        try:
+            async with acquire() as connection:
+                rows = await connection.fetch(_SQL_CITIES_WITH_PENDING, list(cities))
+            found = {r[0] for r in rows}
+            _cities_with_pending.difference_update(cities - found)
+            _cities_with_pending.update(found)
+        except Exception as error:
+            # Состояние неизвестно — считаем, что заказы есть (лишний запрос безопаснее пропуска)
+            _cities_with_pending.update(cities)
+            log_info_nowait(f"[db_utils.pending_city] ошибка проверки городов {sorted(cities)!r}: {error}", type_msg="error")
+
+
+async def _close_pending_city_conn() -> None:
+    global _pending_city_conn
+    if _pending_city_conn is not None:
+        try:
+            await _pending_city_conn.close()
+        except Exception:
+            pass
+        _pending_city_conn = None
+
+
+async def _connect_pending_city_listener() -> None:
+    """Открывает соединение, подписывается на канал и заново загружает набор городов."""
+    global _pending_city_conn, _pending_city_task, _pending_city_ready
+    _pending_city_lost.clear()
+    _pending_city_conn = await asyncpg.connect(DB_DSN)
+    _pending_city_conn.add_termination_listener(_on_pending_city_conn_lost)
+    await _pending_city_conn.add_listener(_PENDING_CITY_CHANNEL, _on_pending_city_notify)
+    # Воркер нужен только после успешного LISTEN
+    if _pending_city_task is None:
+        _pending_city_task = asyncio.create_task(_pending_city_worker())
+    # Снимок берём уже после LISTEN: изменения между ними придут уведомлениями,
+    # а пропущенные за время разрыва перекрываются полной перезагрузкой набора
+    async with acquire() as connection:
+        rows = await connection.fetch(
+            "SELECT DISTINCT COALESCE(city, '') FROM orders WHERE status = 'pending' AND driver_id IS NULL"
+        )
+    _cities_with_pending.clear()
+    _cities_with_pending.update(r[0] for r in rows)
+    _pending_city_ready = True
+
+
+async def _pending_city_keepalive() -> None:
+    """Ждёт потери соединения и переподключается с экспоненциальной паузой."""
+    global _pending_city_ready
+    delay = _PENDING_CITY_RETRY_MIN
+    while True:
+        if _pending_city_ready:
+            await _pending_city_lost.wait()
+            _pending_city_ready = False
+            log_info_nowait("[db_utils.pending_city] соединение слушателя потеряно, переподключаемся", type_msg="warning")
+        await _close_pending_city_conn()
+        await asyncio.sleep(delay)
+        try:
+            await _connect_pending_city_listener()
+            delay = _PENDING_CITY_RETRY_MIN
+        except Exception as error:
+            _pending_city_ready = False
+            delay = min(delay * 2, _PENDING_CITY_RETRY_MAX)
+            log_info_nowait(f"[db_utils.pending_city] переподключение не удалось: {error}", type_msg="error")
+
+
+async def start_pending_city_listener() -> None:
+    """Подписывается на order_pending_city и загружает стартовый набор городов."""
+    global _pending_city_queue, _pending_city_lost, _pending_city_supervisor, _pending_city_ready
+    if _pending_city_supervisor is not None:
+        return
+    _pending_city_queue = asyncio.Queue()
+    _pending_city_lost = asyncio.Event()
+    try:
+        await _connect_pending_city_listener()
+    except Exception as error:
+        # Пока слушатель не готов, фильтр не применяется; дальше пробует keepalive
+        _pending_city_ready = False
+        log_info_nowait(f"[db_utils.pending_city] слушатель не запущен: {error}", type_msg="error")
+    _pending_city_supervisor = asyncio.create_task(_pending_city_keepalive())
+
+
+async def stop_pending_city_listener() -> None:
+    """Останавливает слушателя и воркер (при завершении приложения)."""
+    global _pending_city_task, _pending_city_supervisor, _pending_city_ready
+    _pending_city_ready = False
+    for task in (_pending_city_supervisor, _pending_city_task):
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+    _pending_city_supervisor = None
+    _pending_city_task = None
+    await _close_pending_city_conn()
 
 
 async def list_available_orders_for_driver(
@@ -947,93 +1200,68 @@ async def list_available_orders_for_driver(
     limit: int = 20,
     *,
     exclude_user_id: int | None = None,
-) -> List[Dict[str, Any]]:
+) -> List[OrderRow]:
     """Возвращает список доступных заказов для водителя."""
 
-    connection = None
+    if city and _pending_city_ready and city not in _cities_with_pending:
+        return []
     try:
-        connection = await get_connection()
-        clauses = ["status = 'pending'", "driver_id IS NULL"]
-        params: list[Any] = []
-
-        if city:
-            params.append(city)
-            clauses.append(f"COALESCE(city, '') = ${len(params)}")
-
-        if exclude_user_id is not None:
-            params.append(exclude_user_id)
-            clauses.append(f"COALESCE(passenger_id, 0) <> ${len(params)}")
-
-        params.append(limit)
-        where_sql = " AND ".join(clauses)
-        query = (
-            f"""
-            SELECT *
-              FROM orders
-             WHERE {where_sql}
-             ORDER BY scheduled_at NULLS LAST, order_date DESC NULLS LAST, order_id DESC
-             LIMIT ${len(params)}
-            """
-        )
-
-        rows = await connection.fetch(query, *params)
-        result = [dict(row) for row in rows]
-        await log_info(
-            "[db_utils.list_available_orders_for_driver] получены доступные заказы",
-            type_msg="info",
-            user_id=exclude_user_id,
-            count=len(result),
-        )
-        return result
+        async with acquire() as connection:
+            # Селективность сильно зависит от города: generic-план (после 5 вызовов) здесь плох,
+            # поэтому в рамках транзакции заставляем планировщик учитывать реальные параметры
+            async with connection.transaction(readonly=True):
+                await connection.execute("SET LOCAL plan_cache_mode = force_custom_plan")
+                rows = await connection.fetch(_SQL_AVAILABLE_ORDERS, city or None, exclude_user_id, limit)
+            if DB_LOG_VERBOSE:
+                log_info_nowait(
+                    "[db_utils.list_available_orders_for_driver] получены доступные заказы",
+                    type_msg="info",
+                    user_id=exclude_user_id,
+                    count=len(rows),
+                )
+            return [OrderRow(*row) for row in rows]
     except Exception as error:
-        await log_info(
+        log_info_nowait(
             f"[db_utils.list_available_orders_for_driver] ошибка: {error}",
             type_msg="error",
             user_id=exclude_user_id,
         )
         return []
-    finally:
-        if connection:
-            await release_connection(connection)
 
 
-async def list_future_orders_for_passenger(passenger_id: int, limit: int = 20) -> List[Dict[str, Any]]:
+async def list_future_orders_for_passenger(passenger_id: int, limit: int = 20) -> List[OrderRow]:
     """Возвращает список будущих поездок пассажира."""
 
-    connection = None
     try:
-        connection = await get_connection()
-        rows = await connection.fetch(
-            """
-            SELECT *
-              FROM orders
-             WHERE passenger_id = $1
-               AND scheduled_at IS NOT NULL
-               AND scheduled_at > NOW()
-             ORDER BY scheduled_at ASC
-             LIMIT $2
-            """,
-            passenger_id,
-            limit,
-        )
-        result = [dict(row) for row in rows]
-        await log_info(
-            "[db_utils.list_future_orders_for_passenger] загружено поездок",
-            type_msg="info",
-            user_id=passenger_id,
-            count=len(result),
-        )
-        return result
+        async with acquire() as connection:
+            rows = await connection.fetch(
+                f"""
+                SELECT {_ORDER_LIST_SELECT}
+                  FROM orders
+                 WHERE passenger_id = $1
+                   AND scheduled_at IS NOT NULL
+                   AND scheduled_at > NOW()
+                 ORDER BY scheduled_at ASC
+                 LIMIT $2
+                """,
+                passenger_id,
+                limit,
+            )
+            if DB_LOG_VERBOSE:
+                log_info_nowait(
+                    "[db_utils.list_future_orders_for_passenger] загружено поездок",
+                    type_msg="info",
+                    user_id=passenger_id,
+                    count=len(rows),
+                )
+            return [OrderRow(*row) for row in rows]
     except Exception as error:
-        await log_info(
+        log_info_nowait(
             f"[db_utils.list_future_orders_for_passenger] ошибка: {error}",
             type_msg="error",
             user_id=passenger_id,
         )
         return []
-    finally:
-        if connection:
-            await release_connection(connection)
 
 
 async def list_order_history_for_user(
@@ -1041,79 +1269,82 @@ async def list_order_history_for_user(
     *,
     role: Literal["passenger", "driver"],
     limit: int = 20,
-) -> List[Dict[str, Any]]:
+) -> List[OrderRow]:
     """Возвращает историю поездок пользователя."""
 
-    connection = None
     column = "passenger_id" if role == "passenger" else "driver_id"
     try:
-        connection = await get_connection()
-        query = f"""
-            SELECT *
-              FROM orders
-             WHERE {column} = $1
-               AND status IN ('completed','canceled')
-             ORDER BY COALESCE(trip_end, order_date) DESC NULLS LAST, order_id DESC
-             LIMIT $2
-        """
-        rows = await connection.fetch(query, user_id, limit)
-        result = [dict(row) for row in rows]
-        await log_info(
-            "[db_utils.list_order_history_for_user] получена история поездок",
-            type_msg="info",
-            user_id=user_id,
-            role=role,
-            count=len(result),
-        )
-        return result
+        async with acquire() as connection:
+            query = f"""
+                SELECT {_ORDER_LIST_SELECT}
+                  FROM orders
+                 WHERE {column} = $1
+                   AND status IN ({_HISTORY_IN})
+                 ORDER BY COALESCE(trip_end, order_date) DESC NULLS LAST, order_id DESC
+                 LIMIT $2
+            """
+            rows = await connection.fetch(query, user_id, limit)
+            if DB_LOG_VERBOSE:
+                log_info_nowait(
+                    "[db_utils.list_order_history_for_user] получена история поездок",
+                    type_msg="info",
+                    user_id=user_id,
+                    role=role,
+                    count=len(rows),
+                )
+            return [OrderRow(*row) for row in rows]
     except Exception as error:
-        await log_info(
+        log_info_nowait(
             f"[db_utils.list_order_history_for_user] ошибка: {error}",
             type_msg="error",
             user_id=user_id,
         )
         return []
-    finally:
-        if connection:
-            await release_connection(connection)
+
+
+# Счётчики поддерживаются триггером на orders (db_table_init._ensure_driver_stats_trigger)
+_SQL_DRIVER_STATS = """
+    SELECT completed, canceled, active,
+           total_commission::float8 AS total_commission,
+           total_revenue::float8 AS total_revenue
+      FROM driver_stats
+     WHERE driver_id = $1
+"""
+
+
+def _driver_stats_from_row(row) -> Dict[str, Any]:
+    """Приводит строку агрегатов к словарю статистики водителя."""
+    if row is None:
+        # Водитель ещё без заказов — строки в driver_stats нет
+        return {"completed": 0, "canceled": 0, "active": 0, "total_commission": 0.0, "total_revenue": 0.0}
+    # Колонки driver_stats NOT NULL DEFAULT 0 — дополнительные `or 0` не нужны;
+    # суммы приходят уже как float8 (без промежуточного Decimal)
+    return {
+        "completed": row["completed"],
+        "canceled": row["canceled"],
+        "active": row["active"],
+        "total_commission": row["total_commission"],
+        "total_revenue": row["total_revenue"],
+    }
 
 
 async def get_driver_stats_summary(driver_id: int) -> Dict[str, Any]:
     """Собирает агрегированные метрики по заказам водителя."""
 
-    connection = None
     try:
-        connection = await get_connection()
-        row = await connection.fetchrow(
-            """
-            SELECT
-                COUNT(*) FILTER (WHERE status = 'completed') AS completed,
-                COUNT(*) FILTER (WHERE status = 'canceled') AS canceled,
-                COUNT(*) FILTER (WHERE status IN ('accepted','in_place','come_out','started','awaiting_fee')) AS active,
-                COALESCE(SUM(commission), 0) AS total_commission,
-                COALESCE(SUM(cost), 0) AS total_revenue
-              FROM orders
-             WHERE driver_id = $1
-            """,
-            driver_id,
-        )
-        payload = dict(row) if row else {}
-        stats = {
-            "completed": int(payload.get("completed") or 0),
-            "canceled": int(payload.get("canceled") or 0),
-            "active": int(payload.get("active") or 0),
-            "total_commission": float(payload.get("total_commission") or 0),
-            "total_revenue": float(payload.get("total_revenue") or 0),
-        }
-        await log_info(
-            "[db_utils.get_driver_stats_summary] статистика собрана",
-            type_msg="info",
-            user_id=driver_id,
-            stats=stats,
-        )
-        return stats
+        async with acquire() as connection:
+            row = await connection.fetchrow(_SQL_DRIVER_STATS, driver_id)
+            stats = _driver_stats_from_row(row)
+            if DB_LOG_VERBOSE:
+                log_info_nowait(
+                    "[db_utils.get_driver_stats_summary] статистика собрана",
+                    type_msg="info",
+                    user_id=driver_id,
+                    stats=stats,
+                )
+            return stats
     except Exception as error:
-        await log_info(
+        log_info_nowait(
             f"[db_utils.get_driver_stats_summary] ошибка: {error}",
             type_msg="error",
             user_id=driver_id,
@@ -1125,24 +1356,86 @@ async def get_driver_stats_summary(driver_id: int) -> Dict[str, Any]:
             "total_commission": 0.0,
             "total_revenue": 0.0,
         }
-    finally:
-        if connection:
-            await release_connection(connection)
+
+_SQL_USER_THEME = 'SELECT theme_mode FROM users WHERE user_id = $1'
+
+
+# TTL-кеш темы: user_id -> (момент устаревания, тема). Тема меняется редко, а читается на каждый запрос UI
+_theme_cache: Dict[int, Tuple[float, str | None]] = {}
+_THEME_TTL = 300.0
+_THEME_CACHE_MAX = 10_000
+
+
+def invalidate_user_theme(user_id: int) -> None:
+    """Сбрасывает закешированную тему пользователя (вызывается при записи theme_mode)."""
+    _theme_cache.pop(user_id, None)
+
 
 async def get_user_theme(user_id: int) -> str | None:
     """
     Возвращает 'light' / 'dark' или None, если записи нет/пусто.
     """
-    conn = None
+    now = monotonic()
+    cached = _theme_cache.get(user_id)
+    if cached is not None and cached[0] > now:
+        return cached[1]
+
+    async with acquire() as conn:
+        theme = await conn.fetchval(_SQL_USER_THEME, user_id)
+    return _remember_theme(user_id, theme, now)
+
+
+def _remember_theme(user_id: int, theme: Any, now: float) -> str | None:
+    """Нормализует тему и кладёт её в TTL-кеш."""
+    theme = theme if theme in ('light', 'dark') else None
+    if len(_theme_cache) >= _THEME_CACHE_MAX:
+        # Вытесняем самую старую запись (dict хранит порядок вставки)
+        _theme_cache.pop(next(iter(_theme_cache)))
+    _theme_cache[user_id] = (now + _THEME_TTL, theme)
+    return theme
+
+
+# Дашборд водителя одним запросом: активный заказ (LATERAL), счётчики и тема.
+# Колонки возвращаются нативными типами (без row_to_json), чтобы datetime/Decimal не превращались в строки.
+_SQL_DRIVER_DASHBOARD = f"""
+    SELECT a.*,
+           s.completed, s.canceled, s.active,
+           s.total_commission::float8 AS total_commission,
+           s.total_revenue::float8 AS total_revenue,
+           (SELECT theme_mode FROM users WHERE user_id = $1) AS theme_mode
+      FROM (SELECT 1) AS d
+      LEFT JOIN LATERAL (
+            SELECT {_ORDER_LIST_SELECT}
+              FROM orders
+             WHERE driver_id = $1
+               AND status IN ({_DRIVER_ACTIVE_IN})
+             ORDER BY order_date DESC NULLS LAST, order_id DESC
+             LIMIT 1
+      ) AS a ON TRUE
+      LEFT JOIN driver_stats AS s ON s.driver_id = $1
+"""
+register_warmup_statement(_SQL_DRIVER_DASHBOARD, 0)
+
+
+async def get_driver_dashboard(driver_id: int) -> Dict[str, Any]:
+    """
+    Активный заказ, статистика и тема водителя за один запрос.
+    Возвращает {"active_order": dict | None, "stats": dict, "theme": str | None}.
+    """
     try:
-        conn = await get_connection()
-        row = await conn.fetchrow(
-            'SELECT theme_mode FROM users WHERE user_id = $1', user_id
+        async with acquire() as connection:
+            row = await connection.fetchrow(_SQL_DRIVER_DASHBOARD, driver_id)
+        theme = _remember_theme(driver_id, row["theme_mode"], monotonic())
+        return {
+            "active_order": {name: row[name] for name in ORDER_LIST_COLUMNS} if row["order_id"] is not None else None,
+            "stats": _driver_stats_from_row(row if row["completed"] is not None else None),
+            "theme": theme,
+        }
+    except Exception as error:
+        log_info_nowait(
+            f"[db_utils.get_driver_dashboard] ошибка: {error}",
+            type_msg="error",
+            user_id=driver_id,
         )
-        if not row:
-            return None
-        theme = row['theme_mode']
-        return theme if theme in ('light', 'dark') else None
-    finally:
-        if conn:
-            await release_connection(conn)
+        return {"active_order": None, "stats": _driver_stats_from_row(None), "theme": None}
+
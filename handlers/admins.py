@@ -1,13 +1,17 @@
 from __future__ import annotations
-import json
+import orjson
 import asyncio
-from typing import Any, Dict, List
+import re
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+from functools import lru_cache
+from dataclasses import dataclass, asdict
 from datetime import datetime, timezone
 import bot_instance
 
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery, ReplyKeyboardRemove
 from aiogram.filters import Command
+from aiogram.filters.callback_data import CallbackData
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.fsm.context import FSMContext
 from aiogram.exceptions import TelegramBadRequest
@@ -15,14 +19,16 @@ from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
 from config.config import LOGGING_SETTINGS_TO_SEND_ADMINS as ADMINS_CFG
 from config.config_from_db import (
-    get_cities, get_all_config, ensure_config_exists,
+    get_cities, get_all_config, ensure_config_exists, store_config_row, config_version,
+    invalidate_config_cache,
     _upsert_country_sql, _remove_country_sql,
     _upsert_region_sql, _remove_region_sql,
     list_countries, list_regions, list_cities,
     _upsert_city_sql, _remove_city_sql_tree,
 )
-from db.db_table_init import get_connection, release_connection
-from log.log import log_info
+from db.db_table_init import acquire
+from db.db_utils import get_user_data, invalidate_user_row
+from log.log import log_info_nowait
 
 from keyboards.inline_kb_a import build_admin_kb
 from keyboards.reply_kb import reply_keyboard
@@ -34,6 +40,38 @@ INACTIVITY_TIMEOUT = 300
 router = Router(name="admins")
 
 
+class AdminCb(CallbackData, prefix="admin"):
+    """
+    Кнопки с параметром: admin:<action>:<level>:<country>:<region>:<city>:<user_id>.
+    Разбирается один раз фильтром AdminCb.filter(...), хэндлер получает готовый объект.
+    """
+    action: str
+    level: str | None = None
+    country: str | None = None
+    region: str | None = None
+    city: str | None = None
+    user_id: int | None = None
+
+
+def _pack_admin_cb(**fields: Any) -> str | None:
+    """
+    AdminCb.pack() без исключений: pack() отвергает «:» в значениях и данные длиннее 64 байт.
+    Такой пункт пропускаем (None), чтобы одно название не ломало всю клавиатуру.
+    """
+    try:
+        return AdminCb(**fields).pack()
+    except ValueError as e:
+        log_info_nowait(f"[admins] кнопка пропущена: {fields} → {e}", type_msg="warning", log="admins")
+        return None
+
+
+def _name_error(*names: str) -> str | None:
+    """Текст ошибки, если название нельзя передать в callback_data (разделитель «:»)."""
+    if any(":" in n for n in names):
+        return "Название не должно содержать «:». Введите ещё раз."
+    return None
+
+
 class AdminStates(StatesGroup):
     add_city = State()
     remove_city = State()
@@ -57,73 +95,155 @@ class AdminStates(StatesGroup):
     confirm_unblock_user = State() 
 
 
+# info_bot создаётся один раз при старте (bot_instance.initialize_bots) — кешируем ссылку
+_INFO_BOT = None
+
+
+def _get_info_bot():
+    global _INFO_BOT
+    if _INFO_BOT is None:
+        # None не кешируем: до старта ботов ссылка ещё не установлена
+        _INFO_BOT = getattr(bot_instance, "info_bot", None)
+    return _INFO_BOT
+
+
+def invalidate_info_bot() -> None:
+    """Сбросить кеш, если info_bot пересоздан (например, при смене токена)."""
+    global _INFO_BOT
+    _INFO_BOT = None
+
+
 # --- Унифицированное логирование ---
 
-async def _log_admin(message: str, *, type_msg: str, actor_id: int | None = None) -> None:
-    await log_info(message, type_msg=type_msg, log="admins", user_id=actor_id)
+def _log_admin(message: str, *, type_msg: str, actor_id: int | None = None) -> None:
+    # Запись уходит в фоновую очередь логов — хэндлер не ждёт файла/отправки в чат
+    log_info_nowait(message, type_msg=type_msg, log="admins", user_id=actor_id)
+
+
+# ====== Мелкие утилиты разбора ввода ======
+
+def _s(d: Dict[str, Any], key: str) -> str:
+    """Строковое значение из FSM-данных без пробелов по краям; не строка/нет ключа → ""."""
+    v = d.get(key)
+    return v.strip() if isinstance(v, str) else ""
+
+
+def _text(msg: Message) -> str:
+    """Текст сообщения без пробелов по краям ("" для сообщений без текста)."""
+    t = msg.text
+    return t.strip() if t else ""
 
 
 # ====== Утилиты доступа/проверки контекста ======
 
+# Параметры служебного чата не меняются во время работы — разбираем их один раз при импорте
+# Пустое множество = доступ выключен: проверка сводится к одному `in` без отдельного флага.
+_ALLOWED_ENABLED = bool(ADMINS_CFG and ADMINS_CFG.get("permission"))
+_ALLOWED_CHATS: frozenset[int] = frozenset({int(ADMINS_CFG["chat_id"])}) if _ALLOWED_ENABLED else frozenset()
+_ALLOWED_THREAD = ADMINS_CFG.get("message_thread_id") if _ALLOWED_ENABLED else None
+
+
 def _allowed_place(obj: Any) -> bool:
     """
     Команда/кнопки принимаются ТОЛЬКО info_bot'ом и только в указанном
     служебном чате/теме из LOGGING_SETTINGS_TO_SEND_SUPPORT.
     """
-    if not ADMINS_CFG or not ADMINS_CFG.get("permission"):
-        return False
+    # если задан thread id — тоже проверяем
+    chat = obj.chat if obj else None
+    return (
+        chat is not None
+        and chat.id in _ALLOWED_CHATS
+        and (_ALLOWED_THREAD is None or getattr(obj, "message_thread_id", None) == _ALLOWED_THREAD)
+    )
 
-    need_chat = int(ADMINS_CFG.get("chat_id"))
-    need_thread = ADMINS_CFG.get("message_thread_id")
 
-    chat_ok = getattr(obj.chat, "id", None) == need_chat
-    if not chat_ok:
-        return False
-
-    # если задан thread id — тоже проверяем
-    if need_thread is not None:
-        return getattr(obj, "message_thread_id", None) == need_thread
-    return True
+# Проверка места — фильтром роутера: чужие апдейты отсекаются до вызова хэндлеров
+router.message.filter(F.func(_allowed_place))
+router.callback_query.filter(F.message.func(_allowed_place))
 
 async def _delete_user_sql(user_id: int) -> bool:
-    conn = await get_connection()
-    try:
-        row = await conn.fetchrow("DELETE FROM users WHERE user_id = $1 RETURNING user_id", user_id)
-        return bool(row)
-    except Exception as e:
-        await _log_admin(f"delete user failed: {e}", type_msg="error", actor_id=user_id)
-        return False
-    finally:
-        await release_connection(conn)
-
+    async with acquire() as conn:
+        try:
+            row = await conn.fetchrow("DELETE FROM users WHERE user_id = $1 RETURNING user_id", user_id)
+            invalidate_user_row(user_id)
+            return bool(row)
+        except Exception as e:
+            _log_admin(f"delete user failed: {e}", type_msg="error", actor_id=user_id)
+            return False
+
+@lru_cache(maxsize=1)
 def _export_kb() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="⬅️ Назад", callback_data="admin:export_config:back")],
         [InlineKeyboardButton(text="Отмена", callback_data="admin:export_config:cancel")],
     ])
 
-async def _save_prompt(state: FSMContext, msg: Message) -> None:
-    await state.update_data(prompt_msg_id=msg.message_id, prompt_chat_id=msg.chat.id)
+@dataclass(slots=True)
+class PanelCtx:
+    """Привязка «живой» панели и одноразовой подсказки; в FSM хранится одним ключом ctx."""
+    panel_msg_id: int | None = None
+    panel_chat_id: int | None = None
+    panel_thread_id: int | None = None
+    prompt_msg_id: int | None = None
+    prompt_chat_id: int | None = None
+
+
+def _panel_ctx(data: Dict[str, Any]) -> PanelCtx:
+    return PanelCtx(**(data.get("ctx") or {}))
+
+
+async def _load_ctx(state: FSMContext) -> PanelCtx:
+    return _panel_ctx(await state.get_data())
+
+
+async def _store_ctx(state: FSMContext, ctx: PanelCtx) -> None:
+    await state.update_data(ctx=asdict(ctx))
+
+
+async def _save_prompt(state: FSMContext, msg: Message, ctx: PanelCtx | None = None) -> None:
+    """ctx — уже загруженный контекст: тогда он только дополняется, записывает вызывающий."""
+    own = ctx is None
+    if own:
+        ctx = await _load_ctx(state)
+    ctx.prompt_msg_id = msg.message_id
+    ctx.prompt_chat_id = msg.chat.id
+    if own:
+        await _store_ctx(state, ctx)
+
+async def _suppress(coro) -> None:
+    """Ожидает корутину, глотая исключения (для необязательных вызовов Bot API в gather)."""
+    try:
+        await coro
+    except Exception:
+        pass
+
+async def _delete_prompt_message(ctx: PanelCtx) -> bool:
+    """Удаляет сообщение-подсказку из ctx (без записи в FSM). True, если подсказка была."""
+    mid = ctx.prompt_msg_id
+    cid = ctx.prompt_chat_id
+    if not (mid and cid):
+        return False
+    _forget_edit_ids(cid, mid)
+    try:
+        ib = _get_info_bot()
+        if ib:
+            await ib.delete_message(cid, mid)
+    except Exception:
+        pass
+    return True
 
 async def _delete_saved_prompt(state: FSMContext) -> None:
-    data = await state.get_data()
-    mid = data.get("prompt_msg_id")
-    cid = data.get("prompt_chat_id")
-    if mid and cid:
-        try:
-            ib = getattr(bot_instance, "info_bot", None)
-            if ib:
-                await ib.delete_message(cid, mid)
-        except Exception:
-            pass
+    ctx = await _load_ctx(state)
+    if await _delete_prompt_message(ctx):
         # очистить, чтобы не дергать второй раз
-        await state.update_data(prompt_msg_id=None, prompt_chat_id=None)
+        ctx.prompt_msg_id = ctx.prompt_chat_id = None
+        await _store_ctx(state, ctx)
 
 async def _edit_saved_prompt_text(state: FSMContext, text: str):
-    data = await state.get_data()
-    mid = data.get("prompt_msg_id")
-    cid = data.get("prompt_chat_id")
-    ib = getattr(bot_instance, "info_bot", None)
+    ctx = await _load_ctx(state)
+    mid = ctx.prompt_msg_id
+    cid = ctx.prompt_chat_id
+    ib = _get_info_bot()
     if ib and mid and cid:
         try:
             await ib.edit_message_text(chat_id=cid, message_id=mid, text=text, reply_markup=_cancel_kb())
@@ -132,10 +252,7 @@ async def _edit_saved_prompt_text(state: FSMContext, text: str):
 
 def _fmt_user_card(d: Dict[str, Any]) -> str:
     if not d: return "—"
-    lines = []
-    for k, v in d.items():
-        lines.append(f"{k}: {v if v is not None else '—'}")
-    return "\n".join(lines)
+    return "\n".join(f"{k}: {v if v is not None else '—'}" for k, v in d.items())
 
 async def _send_panel(msg: Message, state: FSMContext) -> Message:
     kb = await build_admin_kb()
@@ -143,33 +260,113 @@ async def _send_panel(msg: Message, state: FSMContext) -> Message:
     await _start_panel_timer(panel, state)
     return panel
 
-async def _block_user_sql(user_id: int) -> bool:
-    conn = await get_connection()
+# Фоновые задачи (уведомления пользователей, таймеры): держим ссылки, чтобы их не собрал GC
+# до завершения, и логируем исключения — иначе они потеряются вместе с задачей
+_BG_TASKS: set[asyncio.Task] = set()
+
+
+def _on_bg_done(task: asyncio.Task) -> None:
+    _BG_TASKS.discard(task)
+    if task.cancelled():
+        return
+    exc = task.exception()
+    if exc is not None:
+        log_info_nowait(f"background task {task.get_name()} failed: {exc!r}", type_msg="error", log="admins")
+
+
+def _spawn(coro) -> None:
+    task = asyncio.get_running_loop().create_task(coro)
+    _BG_TASKS.add(task)
+    task.add_done_callback(_on_bg_done)
+
+
+async def _notify_user(uid: int, text: str, what: str, reply_markup=None) -> None:
+    """Сообщение пользователю основным ботом (не info_bot); ошибки только логируются."""
+    main_bot = getattr(bot_instance, "bot", None)
+    if not main_bot or not getattr(main_bot, "token", None):
+        log_info_nowait(f"notify {what}: main bot instance is missing or has no token", type_msg="warning", log="admins")
+        return
     try:
-        row = await conn.fetchrow(
-            "UPDATE users SET black_list = TRUE WHERE user_id = $1 RETURNING user_id",
-            user_id
-        )
-        return bool(row)
+        if reply_markup is None:
+            reply_markup = ReplyKeyboardRemove()
+        await main_bot.send_message(uid, text, reply_markup=reply_markup)
     except Exception as e:
-        await _log_admin(f"block user failed: {e}", type_msg="error", actor_id=user_id)
-        return False
-    finally:
-        await release_connection(conn)
+        log_info_nowait(f"notify {what} user failed: {e}", type_msg="warning", log="admins")
 
-async def _unblock_user_sql(user_id: int) -> bool:
-    conn = await get_connection()
+async def _notify_unblocked(uid: int) -> None:
     try:
-        row = await conn.fetchrow(
-            "UPDATE users SET black_list = FALSE WHERE user_id = $1 RETURNING user_id",
-            user_id
-        )
-        return bool(row)
+        kb = await reply_keyboard(uid)
     except Exception as e:
-        await _log_admin(f"unblock user failed: {e}", type_msg="error", actor_id=user_id)
-        return False
-    finally:
-        await release_connection(conn)
+        log_info_nowait(f"notify unblocked user failed: {e}", type_msg="warning", log="admins")
+        return
+    await _notify_user(uid, "Ваш доступ к сервису восстановлен. Добро пожаловать обратно!", "unblocked", kb)
+
+async def _block_user_sql(user_id: int) -> bool:
+    async with acquire() as conn:
+        try:
+            row = await conn.fetchrow(
+                "UPDATE users SET black_list = TRUE WHERE user_id = $1 RETURNING user_id",
+                user_id
+            )
+            invalidate_user_row(user_id)
+            return bool(row)
+        except Exception as e:
+            _log_admin(f"block user failed: {e}", type_msg="error", actor_id=user_id)
+            return False
+
+async def _unblock_user_sql(user_id: int) -> bool:
+    async with acquire() as conn:
+        try:
+            row = await conn.fetchrow(
+                "UPDATE users SET black_list = FALSE WHERE user_id = $1 RETURNING user_id",
+                user_id
+            )
+            invalidate_user_row(user_id)
+            return bool(row)
+        except Exception as e:
+            _log_admin(f"unblock user failed: {e}", type_msg="error", actor_id=user_id)
+            return False
+
+# Последнее отправленное содержимое сообщений панели: (chat_id, message_id) -> отпечаток (text, markup).
+# Повторный edit того же содержимого Telegram всё равно отклонит, а round-trip и флуд-лимит потратит.
+_LAST_EDIT: dict[tuple[int, int], int] = {}
+_LAST_EDIT_MAX = 1024
+
+
+def _edit_fingerprint(text: str, kb: InlineKeyboardMarkup | None) -> int:
+    return hash((text, kb.model_dump_json() if kb is not None else None))
+
+
+def _remember_edit(chat_id: int, message_id: int, fingerprint: int) -> None:
+    if len(_LAST_EDIT) >= _LAST_EDIT_MAX:
+        _LAST_EDIT.pop(next(iter(_LAST_EDIT)))
+    _LAST_EDIT[(chat_id, message_id)] = fingerprint
+
+
+def _forget_edit_ids(chat_id: int, message_id: int) -> None:
+    _LAST_EDIT.pop((chat_id, message_id), None)
+
+
+def _forget_edit(message) -> None:
+    """
+    Сообщение изменено в обход _safe_edit или удалено — сохранённый отпечаток больше не актуален.
+    Для удалённой панели это обязательно: иначе правка «того же» содержимого будет пропущена,
+    и новая панель не создастся.
+    """
+    chat = getattr(message, "chat", None)
+    if chat is not None:
+        _forget_edit_ids(chat.id, message.message_id)
+
+
+async def _safe_edit(msg, text: str, kb: InlineKeyboardMarkup | None) -> None:
+    """edit_text, пропускаемый, если сообщение уже показывает этот же текст и клавиатуру."""
+    fingerprint = _edit_fingerprint(text, kb)
+    key = (msg.chat.id, msg.message_id)
+    if _LAST_EDIT.get(key) == fingerprint:
+        return
+    await msg.edit_text(text, reply_markup=kb)
+    _remember_edit(key[0], key[1], fingerprint)
+
 
 async def _remove_panel_markup_safely(message) -> None:
     """
@@ -177,6 +374,7 @@ async def _remove_panel_markup_safely(message) -> None:
     Если уже убрано или редактирование запрещено — молча игнорируем,
     иначе пробуем отправить отдельное сообщение «Панель закрыта».
     """
+    _forget_edit(message)
     try:
         await message.edit_reply_markup(reply_markup=None)
     except TelegramBadRequest as e:
@@ -188,27 +386,40 @@ async def _remove_panel_markup_safely(message) -> None:
         except Exception:
             pass
 
+# Клавиатуры выбора страны/земли/города кешируются по (prefix, путь, кортеж пунктов):
+# после изменения дерева пункты другие — значит, и ключ другой, сброс кеша не нужен.
+# Статичные клавиатуры («Отмена», экран экспорта) строятся один раз.
+# Разметка общая для всех вызовов, поэтому её нельзя мутировать.
+
+# Кнопка «Отмена» без параметров — один экземпляр на все клавиатуры
+_CANCEL_BUTTON = InlineKeyboardButton(text="Отмена", callback_data="admin:cancel")
+
+@lru_cache(maxsize=1)
 def _cancel_kb() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
-        inline_keyboard=[[InlineKeyboardButton(text="Отмена", callback_data="admin:cancel")]]
+        inline_keyboard=[[_CANCEL_BUTTON]]
     )
 
-def _make_country_kb(prefix: str, items: List[str]) -> InlineKeyboardMarkup:
-    rows = []
-    for name in items:
-        rows.append([InlineKeyboardButton(text=name, callback_data=f"admin:{prefix}:country:{name}")])
+@lru_cache(maxsize=256)
+def _make_country_kb(prefix: str, items: Tuple[str, ...]) -> InlineKeyboardMarkup:
+    rows = [
+        [InlineKeyboardButton(text=name, callback_data=data)]
+        for name in items
+        if (data := _pack_admin_cb(action=prefix, level="country", country=name))
+    ]
     # ↓↓↓ добавили «Назад» в главное меню
     rows.append([InlineKeyboardButton(text="⬅️ Назад", callback_data=f"admin:{prefix}:back")])
-    rows.append([InlineKeyboardButton(text="Отмена", callback_data="admin:cancel")])
+    rows.append([_CANCEL_BUTTON])
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
 async def _edit_panel_main(cb_or_msg, state: FSMContext, subtitle: str, kb: InlineKeyboardMarkup | None):
     msg = cb_or_msg.message if isinstance(cb_or_msg, CallbackQuery) else cb_or_msg
     try:
-        await msg.edit_text(subtitle, reply_markup=kb)
+        await _safe_edit(msg, subtitle, kb)
     except TelegramBadRequest as e:
         m = (getattr(e, "message", "") or str(e)).lower()
         if "message is not modified" in m:
+            _forget_edit(msg)
             try:
                 await msg.edit_reply_markup(reply_markup=kb)
             except Exception:
@@ -223,23 +434,27 @@ async def _edit_panel_main_by_state(state: FSMContext, subtitle: str, kb: Inline
     Редактирует ГЛАВНОЕ МЕНЮ (без «дерева») по сохранённым panel_chat_id/panel_msg_id/(опц.)panel_thread_id.
     Если панель не найдена — создаёт новую в том же чате и том же топике.
     """
-    data = await state.get_data()
-    panel_msg_id = data.get("panel_msg_id")
-    panel_chat_id = data.get("panel_chat_id")
-    panel_thread_id = data.get("panel_thread_id")
+    ctx = await _load_ctx(state)
+    panel_msg_id = ctx.panel_msg_id
+    panel_chat_id = ctx.panel_chat_id
+    panel_thread_id = ctx.panel_thread_id
 
     # Фоллбэки из конфига (если первый запуск и ещё ничего не сохранено)
     chat_id = int(panel_chat_id or ADMINS_CFG.get("chat_id"))
     thread_id = panel_thread_id if panel_thread_id is not None else ADMINS_CFG.get("message_thread_id")
 
-    ib = getattr(bot_instance, "info_bot", None)
+    ib = _get_info_bot()
     if not ib:
         return
 
     if panel_msg_id:
+        fingerprint = _edit_fingerprint(subtitle, kb)
+        if _LAST_EDIT.get((chat_id, panel_msg_id)) == fingerprint:
+            return
         try:
             # edit в том же чате (thread_id не нужен для edit)
             await ib.edit_message_text(chat_id=chat_id, message_id=panel_msg_id, text=subtitle, reply_markup=kb)
+            _remember_edit(chat_id, panel_msg_id, fingerprint)
             return
         except Exception:
             # если не удалось — будем создавать заново ниже
@@ -252,47 +467,56 @@ async def _edit_panel_main_by_state(state: FSMContext, subtitle: str, kb: Inline
     panel = await ib.send_message(**kwargs, disable_notification=True)
     await _start_panel_timer(panel, state)
 
-async def _turn_into_panel(message: Message, state: FSMContext, subtitle: str = "Админ-панель"):
+async def _turn_into_panel(
+    message: Message,
+    state: FSMContext,
+    subtitle: str = "Админ-панель",
+    kb: InlineKeyboardMarkup | None = None,
+):
     """
     Редактирует ПРЯМО ЭТО сообщение (например, с «Подтвердить…») в админ-панель.
     Ставит таймер и сохраняет msg_id/chat_id/thread_id как «живую» панель.
+    kb — уже построенная клавиатура панели (если вызывающий строил её параллельно).
     """
-    kb = await build_admin_kb()
+    if kb is None:
+        kb = await build_admin_kb()
     try:
-        await message.edit_text(subtitle, reply_markup=kb)
+        await _safe_edit(message, subtitle, kb)
     except TelegramBadRequest:
         # если не редактируется — попробуем убрать клаву
+        _forget_edit(message)
         try:
             await message.edit_reply_markup(reply_markup=kb)
         except Exception:
             pass
     await _start_panel_timer(message, state) 
 
-def _make_region_kb(prefix: str, country: str, items: List[str]) -> InlineKeyboardMarkup:
-    rows = []
-    for name in items:
-        rows.append([InlineKeyboardButton(
-            text=name,
-            callback_data=f"admin:{prefix}:region:{country}|{name}"
-        )])
+@lru_cache(maxsize=256)
+def _make_region_kb(prefix: str, country: str, items: Tuple[str, ...]) -> InlineKeyboardMarkup:
+    rows = [
+        [InlineKeyboardButton(text=name, callback_data=data)]
+        for name in items
+        if (data := _pack_admin_cb(action=prefix, level="region", country=country, region=name))
+    ]
     rows.append([InlineKeyboardButton(text="⬅️ Назад", callback_data=f"admin:{prefix}:back:{country}")])
-    rows.append([InlineKeyboardButton(text="Отмена", callback_data="admin:cancel")])
+    rows.append([_CANCEL_BUTTON])
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
-def _make_city_kb(prefix: str, country: str, region: str, items: List[str]) -> InlineKeyboardMarkup:
-    rows = []
-    for name in items:
-        rows.append([InlineKeyboardButton(
-            text=name,
-            callback_data=f"admin:{prefix}:city:{country}|{region}|{name}"
-        )])
+@lru_cache(maxsize=256)
+def _make_city_kb(prefix: str, country: str, region: str, items: Tuple[str, ...]) -> InlineKeyboardMarkup:
+    rows = [
+        [InlineKeyboardButton(text=name, callback_data=data)]
+        for name in items
+        if (data := _pack_admin_cb(action=prefix, level="city", country=country, region=region, city=name))
+    ]
     rows.append([InlineKeyboardButton(text="⬅️ Назад", callback_data=f"admin:{prefix}:back:{country}|{region}")])
-    rows.append([InlineKeyboardButton(text="Отмена", callback_data="admin:cancel")])
+    rows.append([_CANCEL_BUTTON])
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
 
 async def _delete_panel_safely(message) -> None:
     """Удалить сообщение с панелью; если нельзя — убрать inline-клавиатуру."""
+    _forget_edit(message)
     try:
         await message.delete()
     except TelegramBadRequest:
@@ -300,84 +524,90 @@ async def _delete_panel_safely(message) -> None:
     except Exception:
         await _remove_panel_markup_safely(message)
 
-async def _set_state_timer(message, state: FSMContext, expected_state: State):
-    """Ставит таймер: если через 5 минут всё ещё expected_state — удаляет message и сбрасывает state."""
-    # отменим прежний таймер этого типа, если был
-    await _cancel_timer(state, "state_timer")
+# Таймеры неактивности: (ключ FSM, вид таймера) -> TimerHandle.
+# Один call_later на таймер вместо отдельной задачи; в FSM таймеры не сохраняются.
+_TIMERS: dict[tuple[Any, str], asyncio.TimerHandle] = {}
+
+
+def _schedule_timer(state: FSMContext, kind: str, callback, *args) -> None:
+    _drop_timer(state, kind)
+    key = (state.key, kind)
+    loop = asyncio.get_running_loop()
+    _TIMERS[key] = loop.call_later(INACTIVITY_TIMEOUT, _fire_timer, key, callback, args)
+
+
+def _fire_timer(key: tuple[Any, str], callback, args: tuple) -> None:
+    _TIMERS.pop(key, None)
+    _spawn(callback(*args))
+
+
+def _drop_timer(state: FSMContext, kind: str) -> None:
+    handle = _TIMERS.pop((state.key, kind), None)
+    if handle is not None:
+        handle.cancel()
+
 
-    async def _job():
+async def _expire_state(message, state: FSMContext, expected_state: State) -> None:
+    cur = await state.get_state()
+    if cur == expected_state.state:
+        # пробуем удалить сообщение с кнопкой «Отмена»
+        _forget_edit(message)
         try:
-            await asyncio.sleep(INACTIVITY_TIMEOUT)
-            cur = await state.get_state()
-            if cur == expected_state.state:
-                # пробуем удалить сообщение с кнопкой «Отмена»
-                try:
-                    await message.delete()
-                except Exception:
-                    pass
-                # сбрасываем состояние
-                await state.clear()
-        except asyncio.CancelledError:
+            await message.delete()
+        except Exception:
+            pass
+        # сбрасываем состояние
+        await state.clear()
+
+
+async def _expire_panel(message) -> None:
+    _forget_edit(message)
+    try:
+        await message.delete()
+    except Exception:
+        # если удалить нельзя — уберём клавиатуру
+        try:
+            await message.edit_reply_markup(reply_markup=None)
+        except Exception:
             pass
 
-    task = asyncio.create_task(_job())
-    await state.update_data(state_timer=task, state_timer_msg_id=message.message_id)
+
+async def _set_state_timer(message, state: FSMContext, expected_state: State):
+    """Ставит таймер: если через 5 минут всё ещё expected_state — удаляет message и сбрасывает state."""
+    # прежний таймер этого типа, если был, отменяется внутри _schedule_timer
+    _schedule_timer(state, "state_timer", _expire_state, message, state, expected_state)
 
 async def _cancel_state_timer(state: FSMContext):
-    await _cancel_timer(state, "state_timer")
+    _drop_timer(state, "state_timer")
 
 async def _start_panel_timer(message, state: FSMContext):
     """Ставит таймер: если 5 минут нет действий, удаляет панель /admin.
     Параллельно сохраняем chat_id и message_thread_id панели, чтобы потом редактировать/создавать её в том же месте.
     """
-    await _cancel_timer(state, "panel_timer")
-
-    async def _job():
-        try:
-            await asyncio.sleep(INACTIVITY_TIMEOUT)
-            try:
-                await message.delete()
-            except Exception:
-                # если удалить нельзя — уберём клавиатуру
-                try:
-                    await message.edit_reply_markup(reply_markup=None)
-                except Exception:
-                    pass
-        except asyncio.CancelledError:
-            pass
-
-    task = asyncio.create_task(_job())
+    _schedule_timer(state, "panel_timer", _expire_panel, message)
 
     # аккуратно обновляем state: если нет chat/thread у message (например «пустышка» после edit),
     # НЕ затираем прежние panel_chat_id/panel_thread_id
-    data = await state.get_data()
-    new_data = {
-        "panel_timer": task,
-        "panel_msg_id": getattr(message, "message_id", data.get("panel_msg_id")),
-        "panel_chat_id": getattr(getattr(message, "chat", None), "id", data.get("panel_chat_id")),
-        "panel_thread_id": getattr(message, "message_thread_id", data.get("panel_thread_id")),
-    }
-    await state.update_data(**new_data)
+    ctx = await _load_ctx(state)
+    ctx.panel_msg_id = getattr(message, "message_id", ctx.panel_msg_id)
+    ctx.panel_chat_id = getattr(getattr(message, "chat", None), "id", ctx.panel_chat_id)
+    ctx.panel_thread_id = getattr(message, "message_thread_id", ctx.panel_thread_id)
+    await _store_ctx(state, ctx)
 
 async def _restart_panel_timer(message, state: FSMContext):
     await _start_panel_timer(message, state)
 
 async def _cancel_panel_timer(state: FSMContext):
-    await _cancel_timer(state, "panel_timer")
+    _drop_timer(state, "panel_timer")
 
-async def _cancel_timer(state: FSMContext, key: str):
-    data = await state.get_data()
-    task = data.get(key)
-    if isinstance(task, asyncio.Task) and not task.done():
-        task.cancel()
-    if task:
-        # очистим, чтобы не висело в сторе
-        data.pop(key, None)
-        await state.update_data(**{key: None})
+@lru_cache(maxsize=32)
+def _fmt_utc_cached(dt: datetime) -> str:
+    # updated_at меняется только вместе со строкой config — одна и та же метка форматируется один раз
+    return dt.astimezone(timezone.utc).strftime("%Y-%m-%d %H:%M:%S UTC")
 
 def _fmt_utc(dt) -> str:
     if isinstance(dt, datetime):
-        return dt.astimezone(timezone.utc).strftime("%Y-%m-%d %H:%M:%S UTC")
+        return _fmt_utc_cached(dt)
     return str(dt) if dt is not None else "—"
 
 async def _preview_cities_text() -> str:
@@ -389,10 +619,11 @@ async def _preview_cities_text() -> str:
         return f"Дерево городов: —\nОбновлено: {updated}"
 
     lines: List[str] = []
-    for country, regions in sorted(data.items()):
+    # get_all_config отдаёт дерево уже отсортированным
+    for country, regions in data.items():
         lines.append(f"• {country}")
         if isinstance(regions, dict) and regions:
-            for region, cities in sorted(regions.items()):
+            for region, cities in regions.items():
                 if isinstance(cities, list):
                     lines.append(f"   ├─ {region}: {len(cities)}")
                 else:
@@ -406,7 +637,18 @@ async def _preview_cities_text() -> str:
 def _bool_ru(v: bool) -> str:
     return "Вкл" if bool(v) else "Выкл"
 
-def _format_cities_tree_readable(cities: Dict[str, Any]) -> str:
+# Последнее отрисованное дерево: (версия config, текст). Дерево приходит только из get_all_config,
+# поэтому версия однозначно определяет содержимое (id() объектов для ключа не годится — переиспользуется)
+_TREE_CACHE: tuple[int, str] | None = None
+
+# Элементы псевдографики дерева
+TWIG_LAST = "└─"
+TWIG_MID = "├─"
+VPAD_LAST = "   "
+VPAD_MID = "│  "
+
+
+def _format_cities_tree_readable(cities: Dict[str, Any], version: int | None = None) -> str:
     """
     Человекочитаемое дерево:
     ├─ Germany
@@ -416,49 +658,71 @@ def _format_cities_tree_readable(cities: Dict[str, Any]) -> str:
     │     └─ Flensburg
     └─ ...
     Без ограничений по числу городов.
+    version — версия config, к которой относится cities (None — без кеша).
     """
+    global _TREE_CACHE
     if not isinstance(cities, dict) or not cities:
         return "—"
 
-    def branch(is_last: bool) -> tuple[str, str]:
-        """Возвращает (вертикальная черта на следующем уровне, символ ветки на этом уровне)."""
-        return ("   " if is_last else "│  ", "└─" if is_last else "├─")
+    # Дерево меняется только вместе с config: перерисовываем лишь при новой версии
+    if version is not None and _TREE_CACHE is not None and _TREE_CACHE[0] == version:
+        return _TREE_CACHE[1]
 
     lines: list[str] = []
-    countries = sorted(cities.keys())
+    countries = list(cities)  # порядок уже отсортирован в get_all_config
+    last_country = len(countries) - 1
     for ci, country in enumerate(countries):
-        is_last_country = (ci == len(countries) - 1)
-        vpad_country, twig_country = branch(is_last_country)
+        if ci == last_country:
+            vpad_country, twig_country = VPAD_LAST, TWIG_LAST
+        else:
+            vpad_country, twig_country = VPAD_MID, TWIG_MID
         lines.append(f"{twig_country} {country}")
 
         regions = cities.get(country, {})
         if not isinstance(regions, dict) or not regions:
-            lines.append(f"{vpad_country}└─ (нет земель)")
+            lines.append(f"{vpad_country}{TWIG_LAST} (нет земель)")
             continue
 
-        region_names = sorted(regions.keys())
+        region_names = list(regions)
+        last_region = len(region_names) - 1
         for ri, region in enumerate(region_names):
-            is_last_region = (ri == len(region_names) - 1)
-            vpad_region, twig_region = branch(is_last_region)
+            if ri == last_region:
+                vpad_region, twig_region = VPAD_LAST, TWIG_LAST
+            else:
+                vpad_region, twig_region = VPAD_MID, TWIG_MID
             # вертикаль страны + ветка земли
             lines.append(f"{vpad_country}{twig_region} {region}")
 
             city_list = regions.get(region, [])
             if not isinstance(city_list, list) or not city_list:
-                lines.append(f"{vpad_country}{vpad_region}└─ —")
+                lines.append(f"{vpad_country}{vpad_region}{TWIG_LAST} —")
                 continue
 
-            for cj, city in enumerate(city_list):
-                is_last_city = (cj == len(city_list) - 1)
-                _vpad_city, twig_city = branch(is_last_city)
-                lines.append(f"{vpad_country}{vpad_region}{twig_city} {city}")
+            # Префикс одинаков для всех городов земли — собираем его один раз
+            pad = vpad_country + vpad_region
+            last_city = len(city_list) - 1
+            lines.extend(
+                f"{pad}{TWIG_LAST if cj == last_city else TWIG_MID} {city}"
+                for cj, city in enumerate(city_list)
+            )
+
+    text = "\n".join(lines)
+    if version is not None:
+        _TREE_CACHE = (version, text)
+    return text
+
+# Отчёт экспорта: (версия config, текст); повторный экспорт без изменений не перерисовывается
+_EXPORT_CACHE: tuple[int, str] | None = None
 
-    return "\n".join(lines)
 
-def _human_readable_config(cfg: Dict[str, Any]) -> str:
+def _human_readable_config(cfg: Dict[str, Any], version: int | None = None) -> str:
     """
     Собирает понятный для админа отчёт по config.
+    version — версия config, к которой относится cfg (None — без кеша).
     """
+    global _EXPORT_CACHE
+    if version is not None and _EXPORT_CACHE is not None and _EXPORT_CACHE[0] == version:
+        return _EXPORT_CACHE[1]
     updated = _fmt_utc(cfg.get("updated_at"))
     cities = cfg.get("cities") or {}
 
@@ -474,21 +738,53 @@ def _human_readable_config(cfg: Dict[str, Any]) -> str:
         f" • Поиск водителя: {int(cfg.get('recruitment_max_minutes', 15) or 15)} мин",
         "",
         "🏙️ Дерево городов",
-        _format_cities_tree_readable(cities),
+        _format_cities_tree_readable(cities, version),
         "",
         f"Обновлено: {updated}",
     ]
     text = "\n".join(parts)
+    if version is not None:
+        _EXPORT_CACHE = (version, text)
     return text
     
 
 # ── «живой» пост: формирование текста и единое редактирование ────────────────
+# Превью дерева для «живой» панели: (версия config, текст) и общий future текущей перерисовки,
+# чтобы одновременные клики нескольких админов не строили превью параллельно
+_PREVIEW_CACHE: tuple[int, str] | None = None
+_PREVIEW_FUTURE: asyncio.Future | None = None
+
+
+async def _preview_cities_text_single_flight() -> str:
+    global _PREVIEW_CACHE, _PREVIEW_FUTURE
+    version = config_version()
+    if _PREVIEW_CACHE is not None and _PREVIEW_CACHE[0] == version:
+        return _PREVIEW_CACHE[1]
+    if _PREVIEW_FUTURE is not None:
+        # shield: отмена одного ожидающего не должна отменять общий результат
+        return await asyncio.shield(_PREVIEW_FUTURE)
+
+    future = asyncio.get_running_loop().create_future()
+    _PREVIEW_FUTURE = future
+    try:
+        text = await _preview_cities_text()
+    except BaseException as e:
+        future.set_exception(e)
+        future.exception()  # помечаем как полученное, если ожидающих не было
+        raise
+    finally:
+        _PREVIEW_FUTURE = None
+    _PREVIEW_CACHE = (version, text)
+    future.set_result(text)
+    return text
+
+
 async def _panel_text_with_tree(action_hint: str = "") -> str:
     """
     Возвращает: [Дерево городов]\n\n[action_hint]
-    Дерево берём всегда актуальное из БД.
+    Дерево актуально для текущей версии config (перестраивается после каждой записи).
     """
-    tree = await _preview_cities_text()
+    tree = await _preview_cities_text_single_flight()
     suffix = f"\n\n{action_hint}" if action_hint else ""
     return f"{tree}{suffix}"
 
@@ -505,11 +801,12 @@ async def _edit_panel(cb_or_msg, state: FSMContext, action_hint: str, kb: Inline
         msg = cb_or_msg.message
         await _restart_panel_timer(msg, state)
         try:
-            await msg.edit_text(text, reply_markup=kb)
+            await _safe_edit(msg, text, kb)
             return
         except TelegramBadRequest as e:
             m = (getattr(e, "message", "") or str(e)).lower()
             if "message is not modified" in m:
+                _forget_edit(msg)
                 try:
                     await msg.edit_reply_markup(reply_markup=kb)
                     return
@@ -524,6 +821,7 @@ async def _edit_panel(cb_or_msg, state: FSMContext, action_hint: str, kb: Inline
 async def _clear_inline_kb(cb_or_msg):
     """Снять клавиатуру у текущего «живого» поста (если нужно без изменения текста)."""
     msg = cb_or_msg.message if isinstance(cb_or_msg, CallbackQuery) else cb_or_msg
+    _forget_edit(msg)
     try:
         await msg.edit_reply_markup(reply_markup=None)
     except Exception:
@@ -531,105 +829,101 @@ async def _clear_inline_kb(cb_or_msg):
 
 
 # ====== Низкоуровневые апдейтеры config ======
+# Возвращают всю строку config (RETURNING *), чтобы клавиатуру можно было собрать без SELECT
 
 async def _toggle_stars_enabled() -> Dict[str, Any]:
-    conn = await get_connection()
-    try:
+    async with acquire() as conn:
         row = await conn.fetchrow(
             f"""
             UPDATE {CONFIG_TABLE}
                SET stars_enabled = NOT stars_enabled,
                    updated_at = now()
              WHERE id = $1
-         RETURNING stars_enabled, updated_at
+         RETURNING *
             """,
             CONFIG_ID,
         )
+        store_config_row(row)
         return dict(row or {})
-    finally:
-        await release_connection(conn)
 
 async def _toggle_check_country() -> Dict[str, Any]:
-    conn = await get_connection()
-    try:
+    async with acquire() as conn:
         row = await conn.fetchrow(
             f"""
             UPDATE {CONFIG_TABLE}
                SET check_country = NOT COALESCE(check_country, FALSE),
                    updated_at = now()
              WHERE id = $1
-         RETURNING check_country, updated_at
+         RETURNING *
             """, CONFIG_ID)
+        store_config_row(row)
         return dict(row or {})
-    finally:
-        await release_connection(conn)
 
 async def _toggle_region_in_bot() -> Dict[str, Any]:
-    conn = await get_connection()
-    try:
+    async with acquire() as conn:
         row = await conn.fetchrow(
             f"""
             UPDATE {CONFIG_TABLE}
                SET region_in_bot = NOT COALESCE(region_in_bot, TRUE),
                    updated_at = now()
              WHERE id = $1
-         RETURNING region_in_bot, updated_at
+         RETURNING *
             """, CONFIG_ID)
+        store_config_row(row)
         return dict(row or {})
-    finally:
-        await release_connection(conn)
 
 async def _set_scan_intervel(seconds: int) -> Dict[str, Any]:
     if seconds <= 0:
         raise ValueError("seconds must be > 0")
-    conn = await get_connection()
-    try:
+    async with acquire() as conn:
         row = await conn.fetchrow(
             f"""
             UPDATE {CONFIG_TABLE}
                SET recruitment_scan_intervel = $1,
                    updated_at = now()
              WHERE id = $2
-         RETURNING recruitment_scan_intervel, updated_at
+         RETURNING *
             """,
             seconds, CONFIG_ID,
         )
+        store_config_row(row)
         return dict(row or {})
-    finally:
-        await release_connection(conn)
 
 async def _set_max_minutes(minutes: int) -> Dict[str, Any]:
     if minutes <= 0:
         raise ValueError("minutes must be > 0")
-    conn = await get_connection()
-    try:
+    async with acquire() as conn:
         row = await conn.fetchrow(
             f"""
             UPDATE {CONFIG_TABLE}
                SET recruitment_max_minutes = $1,
                    updated_at = now()
              WHERE id = $2
-         RETURNING recruitment_max_minutes, updated_at
+         RETURNING *
             """,
             minutes, CONFIG_ID,
         )
+        store_config_row(row)
         return dict(row or {})
-    finally:
-        await release_connection(conn)
 
-async def _clear_state_preserve_panel(state: FSMContext):
-    data = await state.get_data()
-    keep = {k: data.get(k) for k in ("panel_msg_id","panel_chat_id","panel_thread_id","panel_timer") if data.get(k) is not None}
+async def _ensure_and_list_countries() -> Tuple[str, ...]:
+    """Нормализация config и список стран — последовательно на одном соединении."""
+    async with acquire() as conn:
+        await ensure_config_exists(conn=conn)
+        return await list_countries(conn=conn)
+
+async def _clear_state_preserve_panel(state: FSMContext, ctx: PanelCtx | None = None):
+    if ctx is None:
+        ctx = await _load_ctx(state)
+    keep = PanelCtx(ctx.panel_msg_id, ctx.panel_chat_id, ctx.panel_thread_id)
     await state.clear()
-    if keep:
-        await state.update_data(**keep)
+    if keep != PanelCtx():
+        await _store_ctx(state, keep)
 
 # ====== Хэндлеры ======
 
 @router.message(Command("admin"))
 async def cmd_admin(msg: Message, state: FSMContext):
-    if not _allowed_place(msg):
-        return
     await state.clear()
     kb = await build_admin_kb()
     panel = await msg.answer("Админ-панель", reply_markup=kb, disable_notification=True)
@@ -638,129 +932,122 @@ async def cmd_admin(msg: Message, state: FSMContext):
 
 @router.callback_query(F.data == "admin:noop")
 async def cb_noop(cb: CallbackQuery):
-    if not _allowed_place(cb.message):
-        return
     await cb.answer(" ")
 
 
 @router.callback_query(F.data == "admin:refresh")
 async def cb_refresh(cb: CallbackQuery, state: FSMContext):
-    if not _allowed_place(cb.message):
-        return
     await cb.answer("Обновлено")
+    # «Обновить» должен показать актуальную строку БД, а не кеш (её могли поменять web UI и т.п.)
+    invalidate_config_cache()
     kb = await build_admin_kb()
     await _edit_panel_main_by_state(state, "Админ-панель", kb)
 
 
 @router.callback_query(F.data == "admin:toggle_stars")
 async def cb_toggle_stars(cb: CallbackQuery, state: FSMContext):
-    if not _allowed_place(cb.message):
-        return
     admin_id = cb.from_user.id
     upd = await _toggle_stars_enabled()
     await cb.answer(f"Stars: {'Включено' if upd.get('stars_enabled') else 'Выключено'}")
-    await _log_admin(
+    _log_admin(
         f"[admin {admin_id}] toggle stars_enabled → {bool(upd.get('stars_enabled'))}",
         type_msg="info",
         actor_id=admin_id,
     )
-    kb = await build_admin_kb()
+    kb = await build_admin_kb(cfg=upd)
     await _edit_panel_main_by_state(state, "Админ-панель", kb)
 
 
 @router.callback_query(F.data == "admin:set_scan")
 async def cb_set_scan(cb: CallbackQuery, state: FSMContext):
-    if not _allowed_place(cb.message):
-        return
     await state.set_state(AdminStates.set_scan)
+    # Изменения контекста панели копим и пишем одним update_data
+    ctx = await _load_ctx(state)
     await _cancel_panel_timer(state)
     await _delete_panel_safely(cb.message)
     prompt = await cb.message.answer("Введите интервал сканирования свободных водителей в секундах (> 0).", reply_markup=_cancel_kb(), disable_notification=True)
-    await _save_prompt(state, prompt)
+    await _save_prompt(state, prompt, ctx=ctx)
     await _set_state_timer(prompt, state, AdminStates.set_scan)
+    await _store_ctx(state, ctx)
 
 
 @router.message(AdminStates.set_scan)
 async def st_set_scan(msg: Message, state: FSMContext):
-    if not _allowed_place(msg):
-        return
     try:
-        seconds = int((msg.text or "").strip())
+        seconds = int(_text(msg))
         if seconds <= 0:
             raise ValueError
     except Exception:
         await _edit_saved_prompt_text(state, "❗ Нужно целое число > 0. Попробуйте ещё раз.")
-        try: await msg.delete()
-        except: pass
+        await _suppress(msg.delete())
         return
 
     upd = await _set_scan_intervel(seconds)
-    await log_info(
+    log_info_nowait(
         f"[admin {msg.from_user.id}] set recruitment_scan_intervel → {upd.get('recruitment_scan_intervel')}",
         type_msg="info", log="admins"
     )
 
-    await _delete_saved_prompt(state)
-    try:
-        await msg.delete()
-    except:
-        pass
-    # 2) очистить состояние, сохранив привязку к «живому» посту панели
-    await _clear_state_preserve_panel(state)
-    # 3) обновить/создать панель
-    kb = await build_admin_kb()
-    await _edit_panel_main_by_state(state, f"✅ Установлено: {seconds} сек.", kb)
+    # 1) очистить состояние, сохранив привязку к «живому» посту панели (подсказку удалим ниже)
+    ctx = await _load_ctx(state)
+    await _clear_state_preserve_panel(state, ctx)
+    # 2) удаление подсказки/ввода и перерисовка панели — независимые вызовы Bot API
+    kb = await build_admin_kb(cfg=upd)
+    await asyncio.gather(
+        _delete_prompt_message(ctx),
+        _suppress(msg.delete()),
+        _edit_panel_main_by_state(state, f"✅ Установлено: {seconds} сек.", kb),
+        return_exceptions=True,
+    )
 
 
 @router.callback_query(F.data == "admin:set_max")
 async def cb_set_max(cb: CallbackQuery, state: FSMContext):
-    if not _allowed_place(cb.message):
-        return
     await state.set_state(AdminStates.set_max)
+    # Изменения контекста панели копим и пишем одним update_data
+    ctx = await _load_ctx(state)
     await _cancel_panel_timer(state)
     await _delete_panel_safely(cb.message)
     prompt = await cb.message.answer("Введите время поиска водителя в минутах (> 0).", reply_markup=_cancel_kb(), disable_notification=True)
-    await _save_prompt(state, prompt)
+    await _save_prompt(state, prompt, ctx=ctx)
     await _set_state_timer(prompt, state, AdminStates.set_max)
+    await _store_ctx(state, ctx)
 
 
 @router.message(AdminStates.set_max)
 async def st_set_max(msg: Message, state: FSMContext):
-    if not _allowed_place(msg):
-        return
     try:
-        minutes = int((msg.text or "").strip())
+        minutes = int(_text(msg))
         if minutes <= 0:
             raise ValueError
     except Exception:
         await _edit_saved_prompt_text(state, "❗ Нужно целое число > 0. Попробуйте ещё раз.")
-        try: await msg.delete()
-        except: pass
+        await _suppress(msg.delete())
         return
 
     upd = await _set_max_minutes(minutes)
-    await log_info(
+    log_info_nowait(
         f"[admin {msg.from_user.id}] set recruitment_max_minutes → {upd.get('recruitment_max_minutes')}",
         type_msg="info", log="admins"
     )
-    await _delete_saved_prompt(state)
-    try:
-        await msg.delete()
-    except:
-        pass
-    # 2) сохранить привязку к панели и очистить остальное
-    await _clear_state_preserve_panel(state)
-    # 3) перерисовать панель
-    kb = await build_admin_kb()
-    await _edit_panel_main_by_state(state, f"✅ Установлено: {minutes} сек.", kb)
+    # 1) очистить состояние, сохранив привязку к «живому» посту панели (подсказку удалим ниже)
+    ctx = await _load_ctx(state)
+    await _clear_state_preserve_panel(state, ctx)
+    # 2) удаление подсказки/ввода и перерисовка панели — независимые вызовы Bot API
+    kb = await build_admin_kb(cfg=upd)
+    await asyncio.gather(
+        _delete_prompt_message(ctx),
+        _suppress(msg.delete()),
+        _edit_panel_main_by_state(state, f"✅ Установлено: {minutes} сек.", kb),
+        return_exceptions=True,
+    )
 
 
 @router.callback_query(F.data == "admin:close")
 async def cb_close(cb: CallbackQuery, state: FSMContext):
-    if not _allowed_place(cb.message):
-        return
     await state.clear()
     await _cancel_panel_timer(state)
+    _forget_edit(cb.message)
     try:
         await cb.message.delete()
     except Exception:
@@ -769,8 +1056,6 @@ async def cb_close(cb: CallbackQuery, state: FSMContext):
 
 @router.callback_query(F.data == "admin:cancel")
 async def cb_cancel(cb: CallbackQuery, state: FSMContext):
-    if not _allowed_place(cb.message):
-        return
     await _cancel_state_timer(state)
     await state.clear()
     kb = await build_admin_kb()
@@ -779,7 +1064,6 @@ async def cb_cancel(cb: CallbackQuery, state: FSMContext):
 
 @router.callback_query(F.data == "admin:add_country")
 async def cb_add_country(cb: CallbackQuery, state: FSMContext):
-    if not _allowed_place(cb.message): return
     await state.set_state(AdminStates.add_country)
     await _cancel_panel_timer(state)
     await _edit_panel(cb, state, "Введите НАЗВАНИЕ СТРАНЫ для добавления.", _cancel_kb())
@@ -787,22 +1071,35 @@ async def cb_add_country(cb: CallbackQuery, state: FSMContext):
 
 @router.message(AdminStates.add_country)
 async def st_add_country(msg: Message, state: FSMContext):
-    if not _allowed_place(msg): return
-    country = (msg.text or "").strip()
+    country = _text(msg)
     if not country:
         await _edit_panel(msg, state, "Пусто. Введите название страны ещё раз.", _cancel_kb())
         return
+    if err := _name_error(country):
+        await _edit_panel(msg, state, err, _cancel_kb())
+        return
 
-    await _upsert_country_sql(country)
-    await log_info(
+    # Запись и нормализация — одной транзакцией на одном соединении;
+    # ensure_config_exists уже возвращает итоговую строку
+    async def _write() -> Dict[str, Any]:
+        async with acquire() as conn:
+            async with conn.transaction():
+                await _upsert_country_sql(country, conn=conn)
+                row = await ensure_config_exists(conn=conn)
+        # сброс кешей — только после COMMIT: сброс внутри транзакции позволил бы
+        # параллельному читателю закешировать строку до коммита
+        invalidate_config_cache()
+        return row
+
+    # клавиатура панели от дерева стран не зависит — строим параллельно с записью
+    cfg, kb = await asyncio.gather(_write(), build_admin_kb())
+    log_info_nowait(
         f"[admin {msg.from_user.id}] cities: add country {country}",
         type_msg="info", log="admins"
     )
-    await ensure_config_exists()
     try:
-        cfg = await get_all_config()
-        await log_info(
-            f"[admin {msg.from_user.id}] after add country: cities={json.dumps(cfg.get('cities'), ensure_ascii=False)}",
+        log_info_nowait(
+            f"[admin {msg.from_user.id}] after add country: cities={orjson.dumps(cfg.get('cities')).decode()}",
             type_msg="info", log="admins"
         )
     except Exception:
@@ -810,19 +1107,17 @@ async def st_add_country(msg: Message, state: FSMContext):
 
     await _cancel_state_timer(state)
     await _clear_state_preserve_panel(state)
-    kb = await build_admin_kb()
-    await _edit_panel_main_by_state(state, f"✅ Страна добавлена/обновлена: {country}", kb)
-
-    # (опционально) подчистим сам пользовательский ввод
-    try: await msg.delete()
-    except: pass
+    # перерисовка панели и удаление пользовательского ввода — параллельно
+    await asyncio.gather(
+        _edit_panel_main_by_state(state, f"✅ Страна добавлена/обновлена: {country}", kb),
+        _suppress(msg.delete()),
+        return_exceptions=True,
+    )
 
 
 @router.message(AdminStates.remove_region_country)
 async def st_remove_region_country(msg: Message, state: FSMContext):
-    if not _allowed_place(msg):
-        return
-    country = (msg.text or "").strip()
+    country = _text(msg)
     if not country:
         await _edit_panel(msg, state, "Пусто. Введите страну ещё раз.", _cancel_kb())
         return
@@ -830,39 +1125,35 @@ async def st_remove_region_country(msg: Message, state: FSMContext):
     await state.set_state(AdminStates.remove_region_region)
     await _edit_panel(msg, state, f"Страна: {country}\nВведите НАЗВАНИЕ ЗЕМЛИ для удаления (каскадно).", _cancel_kb())
     # удаляем пользовательское сообщение с вводом
-    try: await msg.delete()
-    except: pass
+    await _suppress(msg.delete())
 
 @router.message(AdminStates.remove_region_region)
 async def st_remove_region_region(msg: Message, state: FSMContext):
-    if not _allowed_place(msg):
-        return
     data = await state.get_data()
-    country = (data.get("region_country") or "").strip()
-    region = (msg.text or "").strip()
+    country = _s(data, "region_country")
+    region = _text(msg)
     if not (country and region):
         await _edit_panel(msg, state, "Пусто. Введите данные ещё раз.", _cancel_kb())
         return
-    await _remove_region_sql(country, region)
-    await log_info(
+    # клавиатура панели от дерева городов не зависит — строим параллельно с записью
+    _, kb = await asyncio.gather(_remove_region_sql(country, region), build_admin_kb())
+    log_info_nowait(
         f"[admin {msg.from_user.id}] cities: remove region {country} → {region}",
         type_msg="info", log="admins"
     )
     await _cancel_state_timer(state)
     await _clear_state_preserve_panel(state)
-    kb = await build_admin_kb()
-    await _edit_panel_main_by_state(state, f"✅ Удалена земля (каскад): {country} → {region}", kb)
-    # удаляем пользовательское сообщение с вводом
-    try: await msg.delete()
-    except: pass
+    await asyncio.gather(
+        _edit_panel_main_by_state(state, f"✅ Удалена земля (каскад): {country} → {region}", kb),
+        _suppress(msg.delete()),
+        return_exceptions=True,
+    )
 
 @router.callback_query(F.data == "admin:add_region")
 async def cb_add_region(cb: CallbackQuery, state: FSMContext):
-    if not _allowed_place(cb.message): return
     await state.clear()
     await _cancel_panel_timer(state)
-    await ensure_config_exists()
-    countries = await list_countries()
+    countries = await _ensure_and_list_countries()
     if not countries:
         await _edit_panel(cb, state, "В базе нет стран. Сначала добавьте страну.", _cancel_kb())
         await cb.answer(); return
@@ -872,10 +1163,9 @@ async def cb_add_region(cb: CallbackQuery, state: FSMContext):
     await cb.answer()
 
 
-@router.callback_query(F.data.startswith("admin:pick_add_region:country:"))
-async def cb_pick_add_region_country(cb: CallbackQuery, state: FSMContext):
-    if not _allowed_place(cb.message): return
-    country = cb.data.split("admin:pick_add_region:country:", 1)[1]
+@router.callback_query(AdminCb.filter((F.action == "pick_add_region") & (F.level == "country")))
+async def cb_pick_add_region_country(cb: CallbackQuery, state: FSMContext, callback_data: AdminCb):
+    country = callback_data.country
     await state.update_data(region_country=country)
     await state.set_state(AdminStates.add_region_region)
     await _edit_panel(cb, state, f"Страна: {country}\nВведите НАЗВАНИЕ ЗЕМЛИ:", _cancel_kb())
@@ -884,29 +1174,31 @@ async def cb_pick_add_region_country(cb: CallbackQuery, state: FSMContext):
 
 @router.message(AdminStates.add_region_region)
 async def st_add_region_region(msg: Message, state: FSMContext):
-    if not _allowed_place(msg): return
     data = await state.get_data()
-    country = (data.get("region_country") or "").strip()
-    region = (msg.text or "").strip()
+    country = _s(data, "region_country")
+    region = _text(msg)
     if not (country and region):
         await _edit_panel(msg, state, "Пусто. Попробуйте ещё раз.", _cancel_kb()); return
-    await _upsert_region_sql(country, region)
-    await log_info(
+    if err := _name_error(region):
+        await _edit_panel(msg, state, err, _cancel_kb()); return
+    # клавиатура панели от дерева городов не зависит — строим параллельно с записью
+    _, kb = await asyncio.gather(_upsert_region_sql(country, region), build_admin_kb())
+    log_info_nowait(
         f"[admin {msg.from_user.id}] cities: add region {country} → {region}",
         type_msg="info", log="admins"
     )
     await _cancel_state_timer(state)
     await _clear_state_preserve_panel(state)
-    kb = await build_admin_kb()
-    await _edit_panel_main_by_state(state, f"✅ Добавлена земля: {country} → {region}", kb)
-    try: await msg.delete()
-    except: pass
+    await asyncio.gather(
+        _edit_panel_main_by_state(state, f"✅ Добавлена земля: {country} → {region}", kb),
+        _suppress(msg.delete()),
+        return_exceptions=True,
+    )
 
 @router.callback_query(F.data == "admin:add_city")
 async def cb_add_city(cb: CallbackQuery, state: FSMContext):
-    if not _allowed_place(cb.message): return
-    await state.clear(); await _cancel_panel_timer(state); await ensure_config_exists()
-    countries = await list_countries()
+    await state.clear(); await _cancel_panel_timer(state)
+    countries = await _ensure_and_list_countries()
     if not countries:
         await _edit_panel(cb, state, "В базе нет стран. Сначала добавьте страну.", _cancel_kb())
         await cb.answer(); return
@@ -915,10 +1207,9 @@ async def cb_add_city(cb: CallbackQuery, state: FSMContext):
     await _edit_panel(cb, state, "Выберите СТРАНУ:", kb)
     await cb.answer()
 
-@router.callback_query(F.data.startswith("admin:pick_add_city:country:"))
-async def cb_pick_add_city_country(cb: CallbackQuery, state: FSMContext):
-    if not _allowed_place(cb.message): return
-    country = cb.data.split("admin:pick_add_city:country:", 1)[1]
+@router.callback_query(AdminCb.filter((F.action == "pick_add_city") & (F.level == "country")))
+async def cb_pick_add_city_country(cb: CallbackQuery, state: FSMContext, callback_data: AdminCb):
+    country = callback_data.country
     regions = await list_regions(country)
     if not regions:
         await _edit_panel(cb, state, f"В стране {country} нет земель. Сначала добавьте землю.", _cancel_kb())
@@ -929,501 +1220,378 @@ async def cb_pick_add_city_country(cb: CallbackQuery, state: FSMContext):
     await _edit_panel(cb, state, f"Страна: {country}\nВыберите ЗЕМЛЮ:", kb)
     await cb.answer()
 
-@router.callback_query(F.data.startswith("admin:pick_add_city:region:"))
-async def cb_pick_add_city_region(cb: CallbackQuery, state: FSMContext):
-    if not _allowed_place(cb.message): return
-    payload = cb.data.split("admin:pick_add_city:region:", 1)[1]
-    country, region = payload.split("|", 1)
+@router.callback_query(AdminCb.filter((F.action == "pick_add_city") & (F.level == "region")))
+async def cb_pick_add_city_region(cb: CallbackQuery, state: FSMContext, callback_data: AdminCb):
+    country, region = callback_data.country, callback_data.region
     await state.update_data(add_city_country=country, add_city_region=region)
     await _edit_panel(cb, state, f"{country} → {region}\nВведите НАЗВАНИЕ ГОРОДА:", _cancel_kb())
     await cb.answer()
 
 @router.message(AdminStates.add_city_region)
 async def st_add_city_region(msg: Message, state: FSMContext):
-    if not _allowed_place(msg): return
     data = await state.get_data()
-    country = (data.get("add_city_country") or "").strip()
-    region  = (data.get("add_city_region")  or "").strip()
-    city    = (msg.text or "").strip()
+    country = _s(data, "add_city_country")
+    region  = _s(data, "add_city_region")
+    city    = _text(msg)
     if not (country and region and city):
         await _edit_panel(msg, state, "Пусто. Попробуйте ещё раз.", _cancel_kb()); return
-    await _upsert_city_sql(country, region, city)
-    await log_info(
+    if err := _name_error(city):
+        await _edit_panel(msg, state, err, _cancel_kb()); return
+    # клавиатура панели от дерева городов не зависит — строим параллельно с записью
+    _, kb = await asyncio.gather(_upsert_city_sql(country, region, city), build_admin_kb())
+    log_info_nowait(
         f"[admin {msg.from_user.id}] cities: add city {country} → {region} → {city}",
         type_msg="info", log="admins"
     )
     await _cancel_state_timer(state)
     await _clear_state_preserve_panel(state)
-    kb = await build_admin_kb()
-    await _edit_panel_main_by_state(state, f"✅ Добавлен город: {country} → {region} → {city}", kb)
-    try: await msg.delete()
-    except: pass
+    await asyncio.gather(
+        _edit_panel_main_by_state(state, f"✅ Добавлен город: {country} → {region} → {city}", kb),
+        _suppress(msg.delete()),
+        return_exceptions=True,
+    )
 
 @router.callback_query(F.data == "admin:remove_country")
 async def cb_remove_country(cb: CallbackQuery, state: FSMContext):
-    if not _allowed_place(cb.message): return
-    await state.clear(); await _cancel_panel_timer(state); await ensure_config_exists()
-    countries = await list_countries()
+    await state.clear(); await _cancel_panel_timer(state)
+    countries = await _ensure_and_list_countries()
     if not countries:
         await _edit_panel(cb, state, "Стран нет.", _cancel_kb()); await cb.answer(); return
     kb = _make_country_kb("del_country", countries)
     await _edit_panel(cb, state, "Удалить СТРАНУ:", kb); await cb.answer()
 
-@router.callback_query(F.data.startswith("admin:del_country:country:"))
-async def cb_del_country(cb: CallbackQuery, state: FSMContext):
-    if not _allowed_place(cb.message): return
-    country = cb.data.split("admin:del_country:country:", 1)[1]
-    await _remove_country_sql(country)
-    await log_info(
+@router.callback_query(AdminCb.filter((F.action == "del_country") & (F.level == "country")))
+async def cb_del_country(cb: CallbackQuery, state: FSMContext, callback_data: AdminCb):
+    country = callback_data.country
+    _, kb = await asyncio.gather(_remove_country_sql(country), build_admin_kb())
+    log_info_nowait(
         f"[admin {cb.from_user.id}] cities: remove country {country}",
         type_msg="info", log="admins"
     )
-    kb = await build_admin_kb()
     await _edit_panel_main_by_state(state, f"✅ Удалена страна (каскад): {country}", kb)
     await cb.answer()
 
 @router.callback_query(F.data == "admin:remove_region")
 async def cb_remove_region(cb: CallbackQuery, state: FSMContext):
-    if not _allowed_place(cb.message): return
-    await state.clear(); await _cancel_panel_timer(state); await ensure_config_exists()
-    countries = await list_countries()
+    await state.clear(); await _cancel_panel_timer(state)
+    countries = await _ensure_and_list_countries()
     if not countries:
         await _edit_panel(cb, state, "Стран нет.", _cancel_kb()); await cb.answer(); return
     kb = _make_country_kb("del_region", countries)
     await _edit_panel(cb, state, "Выберите СТРАНУ:", kb); await cb.answer()
 
-@router.callback_query(F.data.startswith("admin:del_region:country:"))
-async def cb_del_region_country(cb: CallbackQuery, state: FSMContext):
-    if not _allowed_place(cb.message): return
-    country = cb.data.split("admin:del_region:country:", 1)[1]
+@router.callback_query(AdminCb.filter((F.action == "del_region") & (F.level == "country")))
+async def cb_del_region_country(cb: CallbackQuery, state: FSMContext, callback_data: AdminCb):
+    country = callback_data.country
     regions = await list_regions(country)
     if not regions:
         await _edit_panel(cb, state, f"В стране {country} нет земель.", _cancel_kb()); await cb.answer(); return
     kb = _make_region_kb("del_region", country, regions)
     await _edit_panel(cb, state, f"Страна: {country}\nУдалить ЗЕМЛЮ:", kb); await cb.answer()
 
-@router.callback_query(F.data.startswith("admin:del_region:region:"))
-async def cb_del_region(cb: CallbackQuery, state: FSMContext):
-    if not _allowed_place(cb.message): return
-    payload = cb.data.split("admin:del_region:region:", 1)[1]
-    country, region = payload.split("|", 1)
-    await _remove_region_sql(country, region)
-    await log_info(
+@router.callback_query(AdminCb.filter((F.action == "del_region") & (F.level == "region")))
+async def cb_del_region(cb: CallbackQuery, state: FSMContext, callback_data: AdminCb):
+    country, region = callback_data.country, callback_data.region
+    _, kb = await asyncio.gather(_remove_region_sql(country, region), build_admin_kb())
+    log_info_nowait(
         f"[admin {cb.from_user.id}] cities: remove region {country} → {region}",
         type_msg="info", log="admins"
     )
-    kb = await build_admin_kb()
     await _edit_panel_main_by_state(state, f"✅ Удалена земля (каскад): {country} → {region}", kb)
     await cb.answer()
 
 @router.callback_query(F.data == "admin:remove_city")
 async def cb_remove_city(cb: CallbackQuery, state: FSMContext):
-    if not _allowed_place(cb.message): return
-    await state.clear(); await _cancel_panel_timer(state); await ensure_config_exists()
-    countries = await list_countries()
+    await state.clear(); await _cancel_panel_timer(state)
+    countries = await _ensure_and_list_countries()
     if not countries:
         await _edit_panel(cb, state, "Стран нет.", _cancel_kb()); await cb.answer(); return
     kb = _make_country_kb("del_city", countries)
     await _edit_panel(cb, state, "Выберите СТРАНУ:", kb); await cb.answer()
 
-@router.callback_query(F.data.startswith("admin:del_city:country:"))
-async def cb_del_city_country(cb: CallbackQuery, state: FSMContext):
-    if not _allowed_place(cb.message): return
-    country = cb.data.split("admin:del_city:country:", 1)[1]
+@router.callback_query(AdminCb.filter((F.action == "del_city") & (F.level == "country")))
+async def cb_del_city_country(cb: CallbackQuery, state: FSMContext, callback_data: AdminCb):
+    country = callback_data.country
     regions = await list_regions(country)
     if not regions:
         await _edit_panel(cb, state, f"В стране {country} нет земель.", _cancel_kb()); await cb.answer(); return
     kb = _make_region_kb("del_city", country, regions)
     await _edit_panel(cb, state, f"Страна: {country}\nВыберите ЗЕМЛЮ:", kb); await cb.answer()
 
-@router.callback_query(F.data.startswith("admin:del_city:region:"))
-async def cb_del_city_region(cb: CallbackQuery, state: FSMContext):
-    if not _allowed_place(cb.message): return
-    payload = cb.data.split("admin:del_city:region:", 1)[1]
-    country, region = payload.split("|", 1)
+@router.callback_query(AdminCb.filter((F.action == "del_city") & (F.level == "region")))
+async def cb_del_city_region(cb: CallbackQuery, state: FSMContext, callback_data: AdminCb):
+    country, region = callback_data.country, callback_data.region
     cities = await list_cities(country, region)
     if not cities:
         await _edit_panel(cb, state, f"В {country} → {region} нет городов.", _cancel_kb()); await cb.answer(); return
     kb = _make_city_kb("del_city", country, region, cities)
     await _edit_panel(cb, state, f"{country} → {region}\nУдалить ГОРОД:", kb); await cb.answer()
 
-@router.callback_query(F.data.startswith("admin:del_city:city:"))
-async def cb_del_city_city(cb: CallbackQuery, state: FSMContext):
-    if not _allowed_place(cb.message): return
-    payload = cb.data.split("admin:del_city:city:", 1)[1]
-    country, region, city = payload.split("|", 2)
-    await _remove_city_sql_tree(country, region, city)
-    await log_info(
+@router.callback_query(AdminCb.filter((F.action == "del_city") & (F.level == "city")))
+async def cb_del_city_city(cb: CallbackQuery, state: FSMContext, callback_data: AdminCb):
+    country, region, city = callback_data.country, callback_data.region, callback_data.city
+    _, kb = await asyncio.gather(_remove_city_sql_tree(country, region, city), build_admin_kb())
+    log_info_nowait(
         f"[admin {cb.from_user.id}] cities: remove city {country} → {region} → {city}",
         type_msg="info", log="admins"
     )
-    kb = await build_admin_kb()
     await _edit_panel_main_by_state(state, f"✅ Удалён город: {country} → {region} → {city}", kb)
     await cb.answer()
 
-@router.callback_query(
-    (F.data.startswith("admin:pick_add_city:back:") | F.data.startswith("admin:del_city:back:")) & F.data.contains("|")
-)
-async def cb_back_from_city(cb: CallbackQuery, state: FSMContext):
-    if not _allowed_place(cb.message): return
-    payload = cb.data.split(":back:", 1)[1]
-    # запасной предохранитель на всякий случай
-    parts = payload.split("|", 1)
-    if len(parts) != 2:
-        # это не уровень "город", пусть обработает другой back-хэндлер
-        await cb.answer()
-        return
-    country, region = parts
-    regions = await list_regions(country)
-    kb = _make_region_kb("pick_add_city" if "pick_add_city" in cb.data else "del_city", country, regions)
-    await _edit_panel(cb, state, f"Страна: {country}\nВыберите ЗЕМЛЮ:", kb)
-    await cb.answer("Назад")
+# «Назад» для сценариев add_city, del_city, add_region, del_region — один хэндлер на все уровни:
+#   admin:<scen>:back                   — из списка СТРАН → в ГЛАВНОЕ МЕНЮ
+#   admin:<scen>:back:<country>         — из выбора ЗЕМЛИ → к списку стран
+#   admin:<scen>:back:<country>|<region> — из выбора ГОРОДА → к списку земель
+_BACK_RE = re.compile(r"^admin:(?P<scen>pick_add_city|del_city|pick_add_region|del_region):back(?::(?P<payload>.*))?$")
 
-# Назад из выбора ЗЕМЛИ → к списку стран (для сценариев add_city, del_city, add_region, del_region)
-@router.callback_query(
-    (F.data.startswith("admin:pick_add_city:back:") |
-     F.data.startswith("admin:del_city:back:") |
-     F.data.startswith("admin:pick_add_region:back:") |
-     F.data.startswith("admin:del_region:back:")) & ~F.data.contains("|")
-)
-async def cb_back_from_region(cb: CallbackQuery, state: FSMContext):
-    if not _allowed_place(cb.message): return
-    # payload после back: "{country}" — но он нам не нужен для построения списка стран
-    countries = await list_countries()
-    prefix = (
-        "pick_add_city" if "pick_add_city" in cb.data else
-        "del_city" if "del_city" in cb.data else
-        "pick_add_region" if "pick_add_region" in cb.data else
-        "del_region"
-    )
-    kb = _make_country_kb(prefix, countries)
-    await _edit_panel(cb, state, "Выберите СТРАНУ:", kb)
-    await cb.answer("Назад")
 
-# Назад из списка СТРАН → в ГЛАВНОЕ МЕНЮ (для тех же 4 сценариев)
-@router.callback_query(
-    F.data.in_((
-        "admin:pick_add_city:back",
-        "admin:del_city:back",
-        "admin:pick_add_region:back",
-        "admin:del_region:back",
-    ))
-)
-async def cb_back_to_main(cb: CallbackQuery, state: FSMContext):
-    if not _allowed_place(cb.message): return
-    await _turn_into_panel(cb.message, state, "Админ-панель")
+@router.callback_query(F.data.regexp(_BACK_RE).as_("m"))
+async def cb_back(cb: CallbackQuery, state: FSMContext, m: re.Match):
+    scenario, payload = m.group("scen"), m.group("payload")
+    if payload is None:
+        await _turn_into_panel(cb.message, state, "Админ-панель")
+        await cb.answer("Назад")
+        return
+    country, sep, _region = payload.partition("|")
+    if sep:
+        regions = await list_regions(country)
+        kb = _make_region_kb(scenario, country, regions)
+        await _edit_panel(cb, state, f"Страна: {country}\nВыберите ЗЕМЛЮ:", kb)
+    else:
+        countries = await list_countries()
+        kb = _make_country_kb(scenario, countries)
+        await _edit_panel(cb, state, "Выберите СТРАНУ:", kb)
     await cb.answer("Назад")
 
 @router.callback_query(F.data == "admin:toggle_check_country")
 async def cb_toggle_check_country(cb: CallbackQuery, state: FSMContext):
-    if not _allowed_place(cb.message): return
     upd = await _toggle_check_country()
     await cb.answer(f"Проверка страны: {'Вкл' if upd.get('check_country') else 'Выкл'}")
-    await log_info(
+    log_info_nowait(
         f"[admin {cb.from_user.id}] toggle check_country → {bool(upd.get('check_country'))}",
         type_msg="info", log="admins"
     )
-    kb = await build_admin_kb()
+    kb = await build_admin_kb(cfg=upd)
     await _edit_panel_main_by_state(state, "Админ-панель", kb)
 
 @router.callback_query(F.data == "admin:toggle_region_in_bot")
 async def cb_toggle_region_in_bot(cb: CallbackQuery, state: FSMContext):
-    if not _allowed_place(cb.message): return
     upd = await _toggle_region_in_bot()
     await cb.answer(f"Земля в боте: {'Вкл' if upd.get('region_in_bot') else 'Выкл'}")
-    await log_info(
+    log_info_nowait(
         f"[admin {cb.from_user.id}] toggle region_in_bot → {bool(upd.get('region_in_bot'))}",
         type_msg="info", log="admins"
     )
-    kb = await build_admin_kb()
+    kb = await build_admin_kb(cfg=upd)
     await _edit_panel_main_by_state(state, "Админ-панель", kb)
 
-@router.callback_query(F.data == "admin:delete_user")
-async def cb_delete_user(cb: CallbackQuery, state: FSMContext):
-    if not _allowed_place(cb.message): return
-    await state.set_state(AdminStates.delete_user_id)
+# ====== Действия над пользователем по user_id (удалить / заблокировать / разблокировать) ======
+
+@dataclass(frozen=True, slots=True)
+class UserAction:
+    """Описание сценария: всё, чем различаются три ветки «ввести user_id → подтвердить»."""
+    state: State                       # ожидание ввода user_id
+    state_key: str                     # ключ FSM с выбранным user_id
+    prompt: str                        # подсказка для ввода
+    confirm_text: str                  # кнопка подтверждения
+    question: str                      # вопрос под карточкой пользователя
+    sql: Callable[[int], Awaitable[bool]]
+    log_verb: str                      # для журнала: "[admin …] <verb> user …"
+    done: str                          # итог на панели при успехе
+    failed: str                        # итог на панели при ошибке
+    notify: Callable[[int], Awaitable[None]] | None = None
+
+
+_USER_ACTIONS: dict[str, UserAction] = {
+    "delete": UserAction(
+        state=AdminStates.delete_user_id,
+        state_key="del_user_id",
+        prompt="Введите user_id пользователя для удаления:",
+        confirm_text="✅ Подтвердить удаление",
+        question="Удалить?",
+        sql=_delete_user_sql,
+        log_verb="delete",
+        done="✅ Удалён",
+        failed="❌ Не удалён",
+        notify=lambda uid: _notify_user(
+            uid,
+            "Ваши учётные данные были удалены из нашей базы.\n"
+            "Вы можете снова начать пользоваться сервисом — отправьте /start.",
+            "deleted",
+        ),
+    ),
+    "block": UserAction(
+        state=AdminStates.block_user_id,
+        state_key="block_user_id",
+        prompt="Введите user_id пользователя для блокировки:",
+        confirm_text="✅ Подтвердить блокировку",
+        question="Заблокировать?",
+        sql=_block_user_sql,
+        log_verb="block",
+        done="✅ Заблокирован",
+        failed="❌ Не заблокирован",
+        # уведомляем юзера основным ботом (не info_bot)
+        notify=lambda uid: _notify_user(
+            uid,
+            "Ваш доступ к сервису временно заблокирован.\n"
+            "Если Вы считаете это ошибкой — напишите в поддержку командой /support.",
+            "blocked",
+        ),
+    ),
+    "unblock": UserAction(
+        state=AdminStates.unblock_user_id,
+        state_key="unblock_user_id",
+        prompt="Введите user_id пользователя для разблокировки:",
+        confirm_text="✅ Подтвердить разблокировку",
+        question="Разблокировать?",
+        sql=_unblock_user_sql,
+        log_verb="unblock",
+        done="✅ Разблокирован",
+        failed="❌ Не разблокирован",
+        # (необязательно, но удобно) уведомим юзера, что доступ восстановлен
+        notify=_notify_unblocked,
+    ),
+}
+
+
+# user_id в Telegram — до 52 значащих бит, т.е. не длиннее 16 десятичных цифр
+_UID_MAX_DIGITS = 16
+
+
+@lru_cache(maxsize=256)
+def _confirm_user_kb(name: str, uid: int) -> InlineKeyboardMarkup:
+    # повторный ввод того же user_id (или повтор после ошибки) отдаёт готовую разметку
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(
+            text=_USER_ACTIONS[name].confirm_text,
+            callback_data=AdminCb(action="confirm_user", level=name, user_id=uid).pack(),
+        )],
+        [_CANCEL_BUTTON],
+    ])
+
+
+async def _ask_user_id(cb: CallbackQuery, state: FSMContext, name: str) -> None:
+    action = _USER_ACTIONS[name]
+    await state.set_state(action.state)
     await _cancel_panel_timer(state)
     await _delete_panel_safely(cb.message)
-    prompt = await cb.message.answer("Введите user_id пользователя для удаления:", reply_markup=_cancel_kb(), disable_notification=True)
+    # одноразовая подсказка, которую потом удалим
+    prompt = await cb.message.answer(action.prompt, reply_markup=_cancel_kb(), disable_notification=True)
     await _save_prompt(state, prompt)
     await cb.answer()
 
-@router.message(AdminStates.delete_user_id)
-async def st_delete_user_id(msg: Message, state: FSMContext):
-    if not _allowed_place(msg): return
-    text = (msg.text or "").strip()
-    try:
-        uid = int(text);  assert uid > 0
-    except Exception:
+
+async def _st_user_id(msg: Message, state: FSMContext, name: str) -> None:
+    action = _USER_ACTIONS[name]
+    text = _text(msg)
+    # отсев мусора без исключений: int() получает только строку из цифр
+    uid = int(text) if text.isdecimal() and len(text) <= _UID_MAX_DIGITS else 0
+    if uid <= 0:
         await _edit_panel_main(msg, state, "Нужен положительный целый user_id. Попробуйте ещё раз.", _cancel_kb())
-        try: await msg.delete()
-        except: pass
-        await _delete_saved_prompt(state)   # ← удалить подсказку
+        await asyncio.gather(_suppress(msg.delete()), _delete_saved_prompt(state))  # ← удалить подсказку
         return
 
-    from db.db_utils import get_user_data
     data = await get_user_data("users", uid)
     if not data:
         kb = await build_admin_kb()
-        await _clear_state_preserve_panel(state)
-        await _edit_panel_main_by_state(state, f"Пользователь user_id={uid} не найден.", kb)
-        try: await msg.delete()
-        except: pass
-        await _delete_saved_prompt(state)   # ← удалить подсказку
+        ctx = await _load_ctx(state)
+        await _clear_state_preserve_panel(state, ctx)
+        await asyncio.gather(
+            _edit_panel_main_by_state(state, f"Пользователь user_id={uid} не найден.", kb),
+            _suppress(msg.delete()),
+            _delete_prompt_message(ctx),   # ← удалить подсказку
+            return_exceptions=True,
+        )
         return
 
-    await state.update_data(del_user_id=uid)
+    await state.update_data({action.state_key: uid})
     card = _fmt_user_card(data)
-    kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="✅ Подтвердить удаление", callback_data=f"admin:confirm_delete_user:{uid}")],
-        [InlineKeyboardButton(text="Отмена", callback_data="admin:cancel")]
-    ])
-    await _edit_panel_main(msg, state, f"Найден пользователь (user_id={uid}):\n\n{card}\n\nУдалить?", kb)
-    try: await msg.delete()
-    except: pass
-    await _delete_saved_prompt(state)       # ← удалить подсказку
-
-@router.callback_query(F.data.startswith("admin:confirm_delete_user:"))
-async def cb_confirm_delete_user(cb: CallbackQuery, state: FSMContext):
-    if not _allowed_place(cb.message): return
-    uid_str = cb.data.split("admin:confirm_delete_user:", 1)[1]
-    try:
-        uid = int(uid_str)
-    except Exception:
-        await cb.answer("Некорректный id"); return
-    ok = await _delete_user_sql(uid)
-    if ok:
-        main_bot = getattr(bot_instance, "bot", None)
-        if not main_bot or not getattr(main_bot, "token", None):
-            await log_info("notify deleted: main bot instance is missing or has no token", type_msg="warning", log="admins")
-        else:
-            try:
-                await main_bot.send_message(
-                    uid,
-                    "Ваши учётные данные были удалены из нашей базы.\n"
-                    "Вы можете снова начать пользоваться сервисом — отправьте /start.",
-                    reply_markup=ReplyKeyboardRemove()
-                )
-            except Exception as e:
-                await log_info(f"notify deleted user failed: {e}", type_msg="warning", log="admins")
-
-    await log_info(
-        f"[admin {cb.from_user.id}] delete user user_id={uid}: {'OK' if ok else 'FAILED'}",
-        type_msg=("info" if ok else "warning"), log="admins"
-    )
-    kb = await build_admin_kb()
-    await state.clear()
-    result = '✅ Удалён' if ok else '❌ Не удалён'
-    await _turn_into_panel(cb.message, state, f"{result} пользователь user_id={uid}")
-    await cb.answer("Готово" if ok else "Ошибка")
+    kb = _confirm_user_kb(name, uid)
+    await _edit_panel_main(msg, state, f"Найден пользователь (user_id={uid}):\n\n{card}\n\n{action.question}", kb)
+    await asyncio.gather(_suppress(msg.delete()), _delete_saved_prompt(state))  # ← удалить подсказку
+
+
+@router.callback_query(F.data == "admin:delete_user")
+async def cb_delete_user(cb: CallbackQuery, state: FSMContext):
+    await _ask_user_id(cb, state, "delete")
+
+@router.message(AdminStates.delete_user_id)
+async def st_delete_user_id(msg: Message, state: FSMContext):
+    await _st_user_id(msg, state, "delete")
 
 @router.callback_query(F.data == "admin:block_user")
 async def cb_block_user(cb: CallbackQuery, state: FSMContext):
-    if not _allowed_place(cb.message): return
-    await state.set_state(AdminStates.block_user_id)
-    await _cancel_panel_timer(state)
-    await _delete_panel_safely(cb.message)
-    prompt = await cb.message.answer("Введите user_id пользователя для блокировки:", reply_markup=_cancel_kb(), disable_notification=True)
-    await _save_prompt(state, prompt)
-    await cb.answer()
+    await _ask_user_id(cb, state, "block")
 
 @router.message(AdminStates.block_user_id)
 async def st_block_user_id(msg: Message, state: FSMContext):
-    if not _allowed_place(msg): return
-    text = (msg.text or "").strip()
-    try:
-        uid = int(text);  assert uid > 0
-    except Exception:
-        await _edit_panel_main(msg, state, "Нужен положительный целый user_id. Попробуйте ещё раз.", _cancel_kb())
-        try: await msg.delete()
-        except: pass
-        await _delete_saved_prompt(state)
-        return
-
-    from db.db_utils import get_user_data
-    data = await get_user_data("users", uid)
-    if not data:
-        kb = await build_admin_kb()
-        await _clear_state_preserve_panel(state)
-        await _edit_panel_main_by_state(state, f"Пользователь user_id={uid} не найден.", kb)
-        try: await msg.delete()
-        except: pass
-        await _delete_saved_prompt(state)
-        return
-
-    await state.update_data(block_user_id=uid)
-    card = _fmt_user_card(data)
-    kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="✅ Подтвердить блокировку", callback_data=f"admin:confirm_block_user:{uid}")],
-        [InlineKeyboardButton(text="Отмена", callback_data="admin:cancel")]
-    ])
-    await _edit_panel_main(msg, state, f"Найден пользователь (user_id={uid}):\n\n{card}\n\nЗаблокировать?", kb)
-    try: await msg.delete()
-    except: pass
-    await _delete_saved_prompt(state)
-
-@router.callback_query(F.data.startswith("admin:confirm_block_user:"))
-async def cb_confirm_block_user(cb: CallbackQuery, state: FSMContext):
-    if not _allowed_place(cb.message): return
-    uid_str = cb.data.split("admin:confirm_block_user:", 1)[1]
-    try:
-        uid = int(uid_str)
-    except Exception:
-        await cb.answer("Некорректный id"); return
-
-    ok = await _block_user_sql(uid)
-    await log_info(
-        f"[admin {cb.from_user.id}] block user user_id={uid}: {'OK' if ok else 'FAILED'}",
-        type_msg=("info" if ok else "warning"), log="admins"
-    )
-
-    # Уведомляем юзера основным ботом (не info_bot)
-    if ok:
-        main_bot = getattr(bot_instance, "bot", None)
-        if not main_bot or not getattr(main_bot, "token", None):
-            await log_info("notify blocked: main bot instance is missing or has no token", type_msg="warning", log="admins")
-        else:
-            try:
-                await main_bot.send_message(
-                    uid,
-                    "Ваш доступ к сервису временно заблокирован.\n"
-                    "Если Вы считаете это ошибкой — напишите в поддержку командой /support.",
-                    reply_markup=ReplyKeyboardRemove()
-                )
-            except Exception as e:
-                await log_info(f"notify blocked user failed: {e}", type_msg="warning", log="admins")
-
-    # ↓↓↓ ДОБАВЬ ЭТО
-    kb = await build_admin_kb()
-    await state.clear()
-    result = '✅ Заблокирован' if ok else '❌ Не заблокирован'
-    await _turn_into_panel(cb.message, state, f"{result} пользователь user_id={uid}")
-    await cb.answer("Готово" if ok else "Ошибка")
+    await _st_user_id(msg, state, "block")
 
 @router.callback_query(F.data == "admin:unblock_user")
 async def cb_unblock_user(cb: CallbackQuery, state: FSMContext):
-    if not _allowed_place(cb.message): return
-    await state.set_state(AdminStates.unblock_user_id)
-    await _cancel_panel_timer(state)
-    await _delete_panel_safely(cb.message)
-    # одноразовая подсказка, которую потом удалим
-    prompt = await cb.message.answer("Введите user_id пользователя для разблокировки:", reply_markup=_cancel_kb(), disable_notification=True)
-    await _save_prompt(state, prompt)
-    await cb.answer()
+    await _ask_user_id(cb, state, "unblock")
 
 @router.message(AdminStates.unblock_user_id)
 async def st_unblock_user_id(msg: Message, state: FSMContext):
-    if not _allowed_place(msg): return
-    text = (msg.text or "").strip()
-    try:
-        uid = int(text);  assert uid > 0
-    except Exception:
-        await _edit_panel_main(msg, state, "Нужен положительный целый user_id. Попробуйте ещё раз.", _cancel_kb())
-        try: await msg.delete()
-        except: pass
-        await _delete_saved_prompt(state)
-        return
-
-    from db.db_utils import get_user_data
-    data = await get_user_data("users", uid)
-    if not data:
-        kb = await build_admin_kb()
-        await _clear_state_preserve_panel(state)
-        await _edit_panel_main_by_state(state, f"Пользователь user_id={uid} не найден.", kb)
-        try: await msg.delete()
-        except: pass
-        await _delete_saved_prompt(state)
-        return
+    await _st_user_id(msg, state, "unblock")
 
-    await state.update_data(unblock_user_id=uid)
-    card = _fmt_user_card(data)
-    kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="✅ Подтвердить разблокировку", callback_data=f"admin:confirm_unblock_user:{uid}")],
-        [InlineKeyboardButton(text="Отмена", callback_data="admin:cancel")]
-    ])
-    await _edit_panel_main(msg, state, f"Найден пользователь (user_id={uid}):\n\n{card}\n\nРазблокировать?", kb)
-    try: await msg.delete()
-    except: pass
-    await _delete_saved_prompt(state)
-
-@router.callback_query(F.data.startswith("admin:confirm_unblock_user:"))
-async def cb_confirm_unblock_user(cb: CallbackQuery, state: FSMContext):
-    if not _allowed_place(cb.message): return
-    uid_str = cb.data.split("admin:confirm_unblock_user:", 1)[1]
-    try:
-        uid = int(uid_str)
-    except Exception:
+@router.callback_query(AdminCb.filter(F.action == "confirm_user"))
+async def cb_confirm_user(cb: CallbackQuery, state: FSMContext, callback_data: AdminCb):
+    action = _USER_ACTIONS.get(callback_data.level or "")
+    uid = callback_data.user_id
+    if action is None or not uid:
         await cb.answer("Некорректный id"); return
 
-    ok = await _unblock_user_sql(uid)
-    await log_info(
-        f"[admin {cb.from_user.id}] unblock user user_id={uid}: {'OK' if ok else 'FAILED'}",
+    # запись в БД — отдельно и до конца: сбой соседних вызовов не должен оборвать её на полпути
+    ok = await action.sql(uid)
+    log_info_nowait(
+        f"[admin {cb.from_user.id}] {action.log_verb} user user_id={uid}: {'OK' if ok else 'FAILED'}",
         type_msg=("info" if ok else "warning"), log="admins"
     )
-
-    # (необязательно, но удобно) уведомим юзера основным ботом, что доступ восстановлен
-    if ok:
-        main_bot = getattr(bot_instance, "bot", None)
-        if main_bot and getattr(main_bot, "token", None):
-            try:
-                kb = await reply_keyboard(uid)
-                await main_bot.send_message(
-                    uid,
-                    "Ваш доступ к сервису восстановлен. Добро пожаловать обратно!",
-                    reply_markup=kb
-                )
-            except Exception as e:
-                await log_info(f"notify unblocked user failed: {e}", type_msg="warning", log="admins")
-
-    kb = await build_admin_kb()
-    await state.clear()
-    result = '✅ Разблокирован' if ok else '❌ Не разблокирован'
-    await _turn_into_panel(cb.message, state, f"{result} пользователь user_id={uid}")
+    # уведомление пользователя уходит в фоне: админ сразу видит результат на панели
+    # (ошибки отправки логируются внутри notify)
+    if ok and action.notify is not None:
+        _spawn(action.notify(uid))
+    result = action.done if ok else action.failed
+    # клавиатура панели и сброс состояния независимы — параллельно
+    kb, _ = await asyncio.gather(build_admin_kb(), state.clear())
+    await _turn_into_panel(cb.message, state, f"{result} пользователь user_id={uid}", kb)
     await cb.answer("Готово" if ok else "Ошибка")
 
 @router.callback_query(F.data == "admin:export_config")
 async def cb_export_config(cb: CallbackQuery, state: FSMContext):
-    if not _allowed_place(cb.message):
-        return
+    version = config_version()
     cfg = await get_all_config()
-    text = _human_readable_config(cfg)
+    # запись или чужая правка во время чтения — снимок может не соответствовать версии, не кешируем
+    text = _human_readable_config(cfg, version if version == config_version() else None)
+    # дерево из get_all_config уже нормализовано — считаем напрямую,
+    # а на случай битой структуры не мешаем экрану экспорта
+    cities = cfg.get("cities") or {}
     try:
-        cities = cfg.get("cities") or {}
-        n_countries = len(cities) if isinstance(cities, dict) else 0
-        n_regions = 0
-        n_cities = 0
-        if isinstance(cities, dict):
-            for _regions in cities.values():
-                if isinstance(_regions, dict):
-                    n_regions += len(_regions)
-                    for _lst in _regions.values():
-                        if isinstance(_lst, list):
-                            n_cities += len(_lst)
-        await log_info(
-            f"[admin {cb.from_user.id}] export config: countries={n_countries}, regions={n_regions}, cities={n_cities}, "
-            f"stars_enabled={bool(cfg.get('stars_enabled', False))}, check_country={bool(cfg.get('check_country', False))}, "
-            f"region_in_bot={bool(cfg.get('region_in_bot', True))}",
-            type_msg="info", log="admins"
-        )
-    except Exception:
-        # не мешаем экрану экспорта, если подсчёт не удался
-        pass
+        n_countries = len(cities)
+        n_regions = sum(len(r) for r in cities.values())
+        n_cities = sum(len(lst) for r in cities.values() for lst in r.values())
+    except (TypeError, AttributeError):
+        n_countries = n_regions = n_cities = 0
+    log_info_nowait(
+        f"[admin {cb.from_user.id}] export config: countries={n_countries}, regions={n_regions}, cities={n_cities}, "
+        f"stars_enabled={bool(cfg.get('stars_enabled', False))}, check_country={bool(cfg.get('check_country', False))}, "
+        f"region_in_bot={bool(cfg.get('region_in_bot', True))}",
+        type_msg="info", log="admins"
+    )
     kb = _export_kb()
     await _edit_panel_main(cb, state, text, kb)  # редактируем текущий пост
     await cb.answer()
 
 @router.callback_query(F.data == "admin:export_config:back")
 async def cb_export_config_back(cb: CallbackQuery, state: FSMContext):
-    if not _allowed_place(cb.message):
-        return
     await _turn_into_panel(cb.message, state, "Админ-панель")
     await cb.answer("Назад")
 
 @router.callback_query(F.data == "admin:export_config:cancel")
 async def cb_export_config_cancel(cb: CallbackQuery, state: FSMContext):
-    if not _allowed_place(cb.message):
-        return
     # просто удаляем текущий экран экспорта
+    _forget_edit(cb.message)
     try:
         await cb.message.delete()
     except Exception:
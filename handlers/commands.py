@@ -1,6 +1,7 @@
-import json
+import asyncio
+import weakref
+import orjson
 from datetime import datetime, timezone
-from decimal import Decimal, InvalidOperation
 from typing import Any, Mapping
 from uuid import uuid4
 
@@ -9,34 +10,74 @@ from aiogram.filters import Command
 from aiogram.enums import ChatType
 from aiogram.types import Message, ReplyKeyboardRemove, PreCheckoutQuery
 
-from db.db_utils import user_exists, insert_into_table, get_user_data, update_table
-from log.log import log_info, send_info_msg
+from db.db_utils import insert_user_if_absent, get_user_data, get_user_row_cached, upsert_user_transaction
+from log.log import log_info, log_info_nowait, send_info_msg
 from keyboards.inline_kb_commands import get_start_inline_kb
-from config.config import SUPPORTED_LANGUAGES, DEFAULT_LANGUAGES, USERS_TABLE, MESSAGES
+from config.config import (
+    SUPPORTED_LANGUAGES,
+    DEFAULT_LANGUAGES,
+    USERS_TABLE,
+    MESSAGES,
+    LOGGING_SETTINGS_TO_SEND_PAYMENTS,
+)
 from config.config_utils import lang_dict
 from web.web_notify import notify_user
 
 router = Router()
 
-router.message.filter(F.chat.type == ChatType.PRIVATE)
-router.callback_query.filter(F.message.chat.type == ChatType.PRIVATE)
+# Блокировки /start по user_id; запись исчезает, когда lock никто не держит
+_START_LOCKS: "weakref.WeakValueDictionary[int, asyncio.Lock]" = weakref.WeakValueDictionary()
 
-async def _is_user_blocked(user_id: int) -> bool:
+
+def _start_lock(user_id: int) -> asyncio.Lock:
+    lock = _START_LOCKS.get(user_id)
+    if lock is None:
+        lock = _START_LOCKS[user_id] = asyncio.Lock()
+    return lock
+
+
+# SUPPORTED_LANGUAGES в config — упорядоченный список (его перебирает UI), здесь нужна только проверка вхождения
+_SUPPORTED_LANGS = frozenset(SUPPORTED_LANGUAGES or ())
+
+# канал отчётов о платежах: при permission=False send_info_msg молча выходит — текст не нужен
+_PAYMENTS_INFO_ENABLED = bool((LOGGING_SETTINGS_TO_SEND_PAYMENTS or {}).get("permission", True))
+
+# текст для заблокированных: локализация, если есть ключ; иначе — дефолтный текст
+_BLOCKED_DEFAULT = (
+    "Ваш доступ к сервису временно заблокирован.\n"
+    "Если Вы считаете это ошибкой — напишите в поддержку командой /support."
+)
+_BLOCKED_BY_LANG: dict[str, str] = {
+    code: (msgs or {}).get("blocked_user_info") or _BLOCKED_DEFAULT
+    for code, msgs in (MESSAGES or {}).items()
+}
+
+
+# Фильтры роутера проверяются на каждом апдейте — обычные функции без разбора magic-filter
+def _is_private(message: Message) -> bool:
+    return message.chat.type == ChatType.PRIVATE
+
+
+def _is_private_cb(callback: types.CallbackQuery) -> bool:
+    return callback.message is not None and callback.message.chat.type == ChatType.PRIVATE
+
+
+router.message.filter(_is_private)
+router.callback_query.filter(_is_private_cb)
+
+def _row_is_blocked(row: Mapping[str, Any] | None) -> bool:
     """
-    Унифицированная проверка блокировки пользователя.
-    Поддерживает разные схемы: is_blocked/blocked/black_list/status == 'blocked'.
+    Признак блокировки по уже прочитанной строке users.
+    Единственный источник — колонка black_list (её пишут admin-хендлеры block/unblock).
     """
+    return bool(row and row.get("black_list"))
+
+
+async def _is_user_blocked(user_id: int) -> bool:
+    """Унифицированная проверка блокировки пользователя по user_id."""
     try:
-        row = await get_user_data(USERS_TABLE, user_id)
-        if not row:
-            return False
-        v = (
-            row.get("is_blocked")
-            or row.get("blocked")
-            or row.get("black_list")
-            or (row.get("status") == "blocked")
-        )
-        return bool(v)
+        # статус блокировки читается часто — берём строку из короткого TTL-кеша
+        return _row_is_blocked(await get_user_row_cached(user_id))
     except Exception as e:
         # если не смогли прочитать — не блокируем по ошибке, но логируем
         await log_info(
@@ -48,16 +89,22 @@ async def _is_user_blocked(user_id: int) -> bool:
 
 
 def _load_transactions(raw: object) -> list[dict[str, Any]]:
-    """Преобразует произвольные данные транзакций к списку словарей."""
+    """
+    Преобразует произвольные данные транзакций к списку словарей.
+    Список, уже декодированный JSONB-кодеком, возвращается как есть (без копий):
+    строка users читается свежей, вызывающий код мутирует её элементы на месте.
+    """
     if isinstance(raw, list):
+        if all(type(item) is dict for item in raw):
+            return raw
         return [dict(item) for item in raw if isinstance(item, Mapping)]
-    if isinstance(raw, str):
+    if isinstance(raw, (str, bytes)):
         try:
-            data = json.loads(raw)
-        except json.JSONDecodeError:
+            data = orjson.loads(raw)
+        except orjson.JSONDecodeError:
             return []
         if isinstance(data, list):
-            return [dict(item) for item in data if isinstance(item, Mapping)]
+            return [item for item in data if isinstance(item, dict)]
     return []
 
 
@@ -67,59 +114,60 @@ def _extract_order_from_payload(payload: str | None) -> tuple[str, dict[str, Any
         return "", {}
     if isinstance(payload, str):
         try:
-            data = json.loads(payload)
+            data = orjson.loads(payload)
             if isinstance(data, Mapping):
                 order_id = str(data.get("order_id") or "")
                 return order_id, dict(data)
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             pass
     return str(payload), {}
 
 @router.message(Command("start"))
 async def send_welcome(message: types.Message):
     try:
-        user_id: int | None = message.from_user.id
+        from_user = message.from_user  # один доступ к вложенной модели вместо пяти
+        user_id: int | None = from_user.id
         await log_info(
             f"Получена команда /start от пользователя {user_id}",
             type_msg="info",
             user_id=user_id,
         )
-        chat_id = message.chat.id if message.chat.type == ChatType.PRIVATE else message.from_user.id
-        user_lang = message.from_user.language_code
-        lang = user_lang if user_lang in SUPPORTED_LANGUAGES else DEFAULT_LANGUAGES
-
-        user_id_exists = await user_exists(user_id)
-        await log_info(
-            f"Проверка существования пользователя {user_id} в БД: {'найден' if user_id_exists else 'не найден'}",
-            type_msg="info",
-            user_id=user_id,
-        )
-
-        if user_id_exists == False:
-            user_data = {
-                "user_id": user_id,
-                "username": message.from_user.username,
-                "first_name": message.from_user.first_name,
-                "language": lang,
-                "role": "unknown"
-            }
-            await insert_into_table(USERS_TABLE, user_data)
-            await send_info_msg(text=f'Тип сообщения: Инфо\nНовый пользователь!\nUsername: {user_data["username"]}\nFirst name: {user_data["first_name"]}\nUser ID: {user_data["user_id"]}', type_msg_tg="new_users")
+        user_lang = from_user.language_code
+        lang = user_lang if user_lang in _SUPPORTED_LANGS else DEFAULT_LANGUAGES
+
+        # повторные /start одного пользователя (двойной тап) сериализуем: вторая копия увидит уже созданную строку
+        async with _start_lock(user_id):
+            # одно чтение строки (из TTL-кеша) даёт и существование, и статус блокировки
+            user_row = await get_user_row_cached(user_id)
+            user_id_exists = user_row is not None
             await log_info(
-                f'Новый пользователь Username: {user_data["username"]} '
-                f'First name: {user_data["first_name"]} '
-                f'User ID: {user_data["user_id"]}',
+                f"Проверка существования пользователя {user_id} в БД: {'найден' if user_id_exists else 'не найден'}",
                 type_msg="info",
                 user_id=user_id,
             )
 
-        if await _is_user_blocked(user_id):
-            # локализация, если есть ключ; иначе — дефолтный текст
-            text = (
-                (MESSAGES.get(lang, {}) or {}).get("blocked_user_info")
-                or "Ваш доступ к сервису временно заблокирован.\n"
-                   "Если Вы считаете это ошибкой — напишите в поддержку командой /support."
-            )
+            if not user_id_exists:
+                user_data = {
+                    "user_id": user_id,
+                    "username": from_user.username,
+                    "first_name": from_user.first_name,
+                    "language": lang,
+                    "role": "unknown"
+                }
+                # ON CONFLICT DO NOTHING: параллельный воркер мог успеть вставить — тогда без «нового пользователя»
+                if await insert_user_if_absent(user_data):
+                    await send_info_msg(text=f'Тип сообщения: Инфо\nНовый пользователь!\nUsername: {user_data["username"]}\nFirst name: {user_data["first_name"]}\nUser ID: {user_data["user_id"]}', type_msg_tg="new_users")
+                    await log_info(
+                        f'Новый пользователь Username: {user_data["username"]} '
+                        f'First name: {user_data["first_name"]} '
+                        f'User ID: {user_data["user_id"]}',
+                        type_msg="info",
+                        user_id=user_id,
+                    )
+
+        # только что созданный пользователь не заблокирован (black_list DEFAULT FALSE)
+        if _row_is_blocked(user_row):
+            text = _BLOCKED_BY_LANG.get(lang, _BLOCKED_DEFAULT)
             await log_info(
                 f"/start: user {user_id} is blocked → show blocked notice",
                 type_msg="info",
@@ -176,7 +224,7 @@ async def handle_successful_payment(message: Message) -> None:
         return
 
     if not user_row:
-        await log_info(
+        log_info_nowait(
             "[payments][success] пользователь не найден в БД",
             type_msg="warning",
             user_id=user_id,
@@ -187,12 +235,28 @@ async def handle_successful_payment(message: Message) -> None:
     user_lang = (user_lang or DEFAULT_LANGUAGES).lower()
 
     transactions = _load_transactions(user_row.get("transactions"))
+    # order_id в транзакциях всегда строка (его так пишут web_profile_menu и этот обработчик),
+    # а ожидающий инвойс добавлен последним — ищем с конца без приведения типов
     existing_tx: dict[str, Any] | None = None
     if order_id:
-        for tx in transactions:
-            if str(tx.get("order_id")) == order_id:
-                existing_tx = tx
-                break
+        existing_tx = next((tx for tx in reversed(transactions) if tx.get("order_id") == order_id), None)
+
+    # повтор уже проведённого платежа — сразу ответ «дубликат», без сборки и записи транзакции
+    if (
+        existing_tx is not None
+        and str(existing_tx.get("status")).lower() == "succeeded"
+        and existing_tx.get("performed_at")
+    ):
+        log_info_nowait(
+            f"[payments][success] платёж уже обработан ранее order_id={order_id}",
+            type_msg="warning",
+            user_id=user_id,
+        )
+        try:
+            await message.answer(lang_dict("profile_balance_topup_payment_duplicate", user_lang))
+        except Exception:
+            pass
+        return
 
     amount_stars = int(payment.total_amount)
     now_dt = datetime.now(timezone.utc)
@@ -223,24 +287,6 @@ async def handle_successful_payment(message: Message) -> None:
             "is_refund": False,
             "raw": {},
         }
-        transactions.append(existing_tx)
-
-    already_processed = bool(
-        str(existing_tx.get("status")).lower() == "succeeded"
-        and existing_tx.get("performed_at")
-    )
-
-    if already_processed:
-        await log_info(
-            f"[payments][success] платёж уже обработан ранее order_id={order_id}",
-            type_msg="warning",
-            user_id=user_id,
-        )
-        try:
-            await message.answer(lang_dict("profile_balance_topup_payment_duplicate", user_lang))
-        except Exception:
-            pass
-        return
 
     existing_tx["status"] = "succeeded"
     existing_tx["amount_stars"] = amount_stars
@@ -251,26 +297,26 @@ async def handle_successful_payment(message: Message) -> None:
     existing_tx["tg_transaction_id"] = payment.telegram_payment_charge_id
     if payment.provider_payment_charge_id:
         existing_tx["provider_payment_charge_id"] = payment.provider_payment_charge_id
-    existing_tx.setdefault("raw", {})["successful_payment"] = payment.model_dump()
+    # транзакция лежит в JSONB-истории пользователя — храним только нужные поля,
+    # а не полный model_dump() (invoice_payload уже лежит в tg_payload)
+    payment_raw: dict[str, Any] = {
+        "currency": payment.currency,
+        "total_amount": payment.total_amount,
+        "telegram_payment_charge_id": payment.telegram_payment_charge_id,
+        "provider_payment_charge_id": payment.provider_payment_charge_id,
+    }
+    if payment.shipping_option_id:
+        payment_raw["shipping_option_id"] = payment.shipping_option_id
+    if payment.order_info:
+        payment_raw["order_info"] = payment.order_info.model_dump(exclude_none=True)
+    existing_tx.setdefault("raw", {})["successful_payment"] = payment_raw
     if payload_dict:
         existing_tx["raw"]["payload"] = payload_dict
 
-    balance_raw = user_row.get("balance")
-    try:
-        balance_decimal = Decimal(str(balance_raw)) if balance_raw not in (None, "") else Decimal("0")
-    except (InvalidOperation, TypeError):
-        balance_decimal = Decimal("0")
-
-    balance_decimal += Decimal(amount_stars)
-    balance_decimal = balance_decimal.quantize(Decimal("0.01"))
-
-    updates = {
-        "transactions": json.dumps(transactions, ensure_ascii=False),
-        "balance": str(balance_decimal),
-    }
-
     try:
-        updated = await update_table(USERS_TABLE, user_id, updates)
+        # в БД уходит только эта транзакция — история в users.transactions не переписывается целиком;
+        # баланс сдвигается в том же UPDATE (без read-modify-write и потерянных обновлений)
+        balance_after = await upsert_user_transaction(user_id, existing_tx, balance_delta=amount_stars)
     except Exception as update_error:
         await log_info(
             f"[payments][success] ошибка обновления БД: {update_error}",
@@ -279,83 +325,87 @@ async def handle_successful_payment(message: Message) -> None:
         )
         return
 
-    if not updated:
-        await log_info(
-            "[payments][success] обновление пользователей вернуло False",
-            type_msg="error",
+    if balance_after is None:
+        # UPDATE не затронул строку: параллельная доставка того же платежа уже провела транзакцию
+        log_info_nowait(
+            f"[payments][success] платёж уже обработан ранее order_id={order_id}",
+            type_msg="warning",
             user_id=user_id,
         )
+        try:
+            await message.answer(lang_dict("profile_balance_topup_payment_duplicate", user_lang))
+        except Exception:
+            pass
         return
 
-    await log_info(
+    log_info_nowait(
         f"[payments][success] платёж подтверждён, order_id={order_id}, amount={amount_stars}",
         type_msg="info",
         user_id=user_id,
     )
 
-    paid_at_str = datetime.fromtimestamp(performed_ts, tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%S UTC")
-
-    user_tg_name = (
-        (message.from_user.full_name or "").strip()
-        or (user_row.get("first_name") or "").strip()
-        or ""
-    )
-    user_tg_username = f"@{message.from_user.username}" if message.from_user.username else ""
-    user_lang_db = user_row.get("language") or ""
-    user_phone = user_row.get("phone_passenger") or user_row.get("phone_driver") or ""
-    user_balance_str = str(balance_decimal)
-
-    # делаем payload «красивым» для админа
-    payload_pretty = ""
-    if payload_dict:
-        try:
-            payload_pretty = json.dumps(payload_dict, ensure_ascii=False, indent=2)
-        except Exception:
-            payload_pretty = str(payload_dict)
-
-    info_text = (
-        "🟢 Платёж по Telegram Stars подтверждён\n"
-        f"Пользователь: {user_id} {user_tg_username} {user_tg_name}\n"
-        f"Язык пользователя: {user_lang_db or user_lang}\n"
-        f"Телефон: {user_phone or '—'}\n"
-        f"order_id: {existing_tx.get('order_id')}\n"
-        f"Внутренний tx_id: {existing_tx.get('id')}\n"
-        f"Статус: {existing_tx.get('status')}\n"
-        f"Направление: {existing_tx.get('direction')}\n"
-        f"Сумма (stars): {amount_stars}\n"
-        f"Валюта: {payment.currency}\n"
-        f"Баланс после операции: {user_balance_str}\n"
-        f"tg_transaction_id: {existing_tx.get('tg_transaction_id')}\n"
-        f"provider_payment_charge_id: {existing_tx.get('provider_payment_charge_id', '—')}\n"
-        f"Время проведения: {paid_at_str}\n"
-        f"Исходный invoice_payload: {payment.invoice_payload}\n"
-        f"Распарсенный payload:\n{payload_pretty or '  —'}\n"
-        f"Заголовок: {existing_tx.get('title')}\n"
-        f"Описание: {existing_tx.get('description')}\n"
-        "Источник: handle_successful_payment"
-    )
+    confirmation_text = lang_dict("profile_balance_topup_payment_success", user_lang, amount=str(amount_stars))
+    calls = [
+        message.answer(confirmation_text),
+        notify_user(user_id, confirmation_text, level="positive", position="center"),
+    ]
+
+    # отчёт админам собираем, только если канал payments включён (иначе send_info_msg его отбросит)
+    if _PAYMENTS_INFO_ENABLED:
+        paid_at_str = now_dt.strftime("%Y-%m-%d %H:%M:%S UTC")
+
+        user_tg_name = (
+            (message.from_user.full_name or "").strip()
+            or (user_row.get("first_name") or "").strip()
+            or ""
+        )
+        user_tg_username = f"@{message.from_user.username}" if message.from_user.username else ""
+        user_lang_db = user_row.get("language") or ""
+        user_phone = user_row.get("phone_passenger") or user_row.get("phone_driver") or ""
+        user_balance_str = str(balance_after)
+
+        # делаем payload «красивым» для админа
+        payload_pretty = ""
+        if payload_dict:
+            try:
+                payload_pretty = orjson.dumps(payload_dict, option=orjson.OPT_INDENT_2).decode()
+            except Exception:
+                payload_pretty = str(payload_dict)
+
+        info_text = (
+            "🟢 Платёж по Telegram Stars подтверждён\n"
+            f"Пользователь: {user_id} {user_tg_username} {user_tg_name}\n"
+            f"Язык пользователя: {user_lang_db or user_lang}\n"
+            f"Телефон: {user_phone or '—'}\n"
+            f"order_id: {existing_tx.get('order_id')}\n"
+            f"Внутренний tx_id: {existing_tx.get('id')}\n"
+            f"Статус: {existing_tx.get('status')}\n"
+            f"Направление: {existing_tx.get('direction')}\n"
+            f"Сумма (stars): {amount_stars}\n"
+            f"Валюта: {payment.currency}\n"
+            f"Баланс после операции: {user_balance_str}\n"
+            f"tg_transaction_id: {existing_tx.get('tg_transaction_id')}\n"
+            f"provider_payment_charge_id: {existing_tx.get('provider_payment_charge_id', '—')}\n"
+            f"Время проведения: {paid_at_str}\n"
+            f"Исходный invoice_payload: {payment.invoice_payload}\n"
+            f"Распарсенный payload:\n{payload_pretty or '  —'}\n"
+            f"Заголовок: {existing_tx.get('title')}\n"
+            f"Описание: {existing_tx.get('description')}\n"
+            "Источник: handle_successful_payment"
+        )
+        calls.append(send_info_msg(info_text, type_msg_tg="payments"))
 
-    try:
-        await send_info_msg(info_text, type_msg_tg="payments")
-    except Exception as send_error:
-        await log_info(
-            f"[payments][success] send_info_msg error: {send_error}",
+    # независимые сетевые вызовы — параллельно; ошибки не прерывают остальные
+    _answer_res, notify_res, *info_res = await asyncio.gather(*calls, return_exceptions=True)
+    if info_res and isinstance(info_res[0], Exception):
+        log_info_nowait(
+            f"[payments][success] send_info_msg error: {info_res[0]}",
             type_msg="warning",
             user_id=user_id,
         )
-
-    confirmation_text = lang_dict("profile_balance_topup_payment_success", user_lang, amount=str(amount_stars))
-
-    try:
-        await message.answer(confirmation_text)
-    except Exception:
-        pass
-
-    try:
-        await notify_user(user_id, confirmation_text, level="positive", position="center")
-    except Exception as notify_error:
-        await log_info(
-            f"[payments][success] notify_user error: {notify_error}",
+    if isinstance(notify_res, Exception):
+        log_info_nowait(
+            f"[payments][success] notify_user error: {notify_res}",
             type_msg="warning",
             user_id=user_id,
-        )
\ No newline at end of file
+        )
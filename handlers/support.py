@@ -25,6 +25,7 @@ from __future__ import annotations
 
 import re
 import json
+import asyncio
 import tempfile
 from datetime import datetime, timezone
 from uuid import uuid4
@@ -43,10 +44,9 @@ from config.config import (
     LOGGING_SETTINGS_TO_SEND_SUPPORT,
     DEFAULT_LANGUAGES,
     MESSAGES,
-    USERS_TABLE,
 )
 from log.log import log_info, send_info_msg
-from db.db_utils import get_user_data, append_support_message
+from db.db_utils import get_user_row_cached, append_support_message
 from web.web_notify import notify_user
 from keyboards.inline_kb_support import cancel_support_keyboard
 
@@ -76,6 +76,11 @@ SUPPORT_THREAD_ID = int(raw_thread) if isinstance(raw_thread, str) and raw_threa
 CAPTION_LIMIT = 1024   # подпись к медиа
 REPLY_CHAIN_MAX_DEPTH = 10
 
+# Поиск user_id в шапке обращения: "User: 12345" или "user_id=12345"
+_USER_ID_RE = re.compile(r"(?:User\s*:\s*|user_id\s*=\s*)(\d+)")
+# Шапка (_compose_header и её аналог в web_profile_menu) — роль + "User: id" в первых строках
+_STUB_SCAN_LIMIT = 256
+
 
 # ----------------------------------------------------------------------------
 # 1) FSM состояния
@@ -90,8 +95,8 @@ class SupportStates(StatesGroup):
 # ----------------------------------------------------------------------------
 
 async def user_lang(user_id: int, fallback: str = DEFAULT_LANGUAGES) -> str:
-    """Вернуть язык пользователя или fallback."""
-    user = await get_user_data(USERS_TABLE, user_id)
+    """Вернуть язык пользователя или fallback (строка users из TTL-кеша db_utils)."""
+    user = await get_user_row_cached(user_id)
     return (user or {}).get("language") or fallback
 
 
@@ -107,7 +112,8 @@ def _extract_user_id_from_support_stub(text_or_caption: str | None) -> int | Non
     """
     if not text_or_caption:
         return None
-    m = re.search(r"(?:User\s*:\s*|user_id\s*=\s*)(\d+)", text_or_caption)
+    # Маркер стоит в начале шапки — дальше первых _STUB_SCAN_LIMIT символов не ищем
+    m = _USER_ID_RE.search(text_or_caption, 0, _STUB_SCAN_LIMIT)
     return int(m.group(1)) if m else None
 
 
@@ -294,6 +300,30 @@ async def _download_file_via_bot(bot: Bot, file_id: str, *, filename_hint: str |
         )
         return None
 
+
+async def _safe_delete(bot: Bot, chat_id: int, message_id: int | None) -> None:
+    """Удалить сообщение, игнорируя ошибки (уже удалено, нет прав и т.п.)."""
+    if not message_id:
+        return
+    try:
+        await bot.delete_message(chat_id, message_id)
+    except Exception:
+        pass
+
+
+async def _collect_prologue(message: Message, state: FSMContext) -> tuple[dict | None, str]:
+    """
+    Общее начало support_collect_*: убрать интро и прочитать строку пользователя.
+    Оба вызова сетевые и независимые — идут параллельно; язык берётся из той же строки.
+    """
+    data = await state.get_data()
+    user_row, _ = await asyncio.gather(
+        get_user_row_cached(message.from_user.id),
+        _safe_delete(message.bot, message.chat.id, data.get("support_intro_msg_id")),
+    )
+    return user_row, (user_row or {}).get("language") or DEFAULT_LANGUAGES
+
+
 # -- Отправка в служебный чат -------------------------------------------------
 
 async def _send_support_entry(message: Message, user_row: dict | None, text_for_header: str | None):
@@ -429,15 +459,11 @@ async def support_cancel(callback: CallbackQuery, state: FSMContext):
     """Отменить ожидание сообщения для техподдержки и убрать интро."""
     try:
         data = await state.get_data()
-        intro_id = data.get("support_intro_msg_id")
-
-        if intro_id:
-            try:
-                await callback.bot.delete_message(callback.message.chat.id, intro_id)
-            except Exception:
-                pass
-
-        lang = await user_lang(callback.from_user.id)
+        # удаление интро и чтение языка независимы — выполняем параллельно
+        _, lang = await asyncio.gather(
+            _safe_delete(callback.bot, callback.message.chat.id, data.get("support_intro_msg_id")),
+            user_lang(callback.from_user.id),
+        )
         await state.clear()
         await callback.answer()
         await log_info(f"Support waiting cancelled: user={callback.from_user.id}", type_msg="info")
@@ -458,15 +484,7 @@ async def support_cancel(callback: CallbackQuery, state: FSMContext):
 async def support_collect_text(message: Message, state: FSMContext):
     """Пользователь прислал текст — передать в служебный чат и подтвердить отправку."""
     try:
-        data = await state.get_data()
-        intro_id = data.get("support_intro_msg_id")
-        if intro_id:
-            try:
-                await message.bot.delete_message(message.chat.id, intro_id)
-            except Exception:
-                pass
-
-        user_row = await get_user_data(USERS_TABLE, message.from_user.id)
+        user_row, lang = await _collect_prologue(message, state)
         clean_text = (message.text or "").strip()
         await _send_support_entry(message, user_row, text_for_header=clean_text)
 
@@ -479,7 +497,6 @@ async def support_collect_text(message: Message, state: FSMContext):
         )
         await _store_support_entry(message.from_user.id, entry)
 
-        lang = await user_lang(message.from_user.id)
         await message.answer(_msgs(lang).get("support_sent") or "✅ Сообщение передано в техподдержку. Спасибо!")
 
         await state.clear()
@@ -496,15 +513,7 @@ async def support_collect_text(message: Message, state: FSMContext):
 async def support_collect_photo(message: Message, state: FSMContext):
     """Пользователь прислал фото — передать в служебный чат (copy_message) и подтвердить отправку."""
     try:
-        data = await state.get_data()
-        intro_id = data.get("support_intro_msg_id")
-        if intro_id:
-            try:
-                await message.bot.delete_message(message.chat.id, intro_id)
-            except Exception:
-                pass
-
-        user_row = await get_user_data(USERS_TABLE, message.from_user.id)
+        user_row, lang = await _collect_prologue(message, state)
         cap = (message.caption or "").strip() or None
         await _send_support_entry(message, user_row, text_for_header=cap)
 
@@ -517,7 +526,6 @@ async def support_collect_photo(message: Message, state: FSMContext):
         )
         await _store_support_entry(message.from_user.id, entry)
 
-        lang = await user_lang(message.from_user.id)
         await message.answer(_msgs(lang).get("support_sent") or "✅ Сообщение передано в техподдержку. Спасибо!")
 
         await state.clear()
@@ -534,15 +542,7 @@ async def support_collect_photo(message: Message, state: FSMContext):
 async def support_collect_doc(message: Message, state: FSMContext):
     """Пользователь прислал документ — передать в служебный чат (copy_message) и подтвердить отправку."""
     try:
-        data = await state.get_data()
-        intro_id = data.get("support_intro_msg_id")
-        if intro_id:
-            try:
-                await message.bot.delete_message(message.chat.id, intro_id)
-            except Exception:
-                pass
-
-        user_row = await get_user_data(USERS_TABLE, message.from_user.id)
+        user_row, lang = await _collect_prologue(message, state)
         cap = (message.caption or "").strip() or None
         await _send_support_entry(message, user_row, text_for_header=cap)
 
@@ -555,7 +555,6 @@ async def support_collect_doc(message: Message, state: FSMContext):
         )
         await _store_support_entry(message.from_user.id, entry)
 
-        lang = await user_lang(message.from_user.id)
         await message.answer(_msgs(lang).get("support_sent") or "✅ Сообщение передано в техподдержку. Спасибо!")
 
         await state.clear()
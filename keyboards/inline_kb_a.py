@@ -5,7 +5,7 @@ from typing import Dict, Any
 
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
-from config.config_from_db import get_all_config
+from config.config_from_db import get_all_config, config_version
 
 
 def _fmt_dt(dt):
@@ -13,9 +13,34 @@ def _fmt_dt(dt):
         return dt.astimezone(timezone.utc).strftime("%Y-%m-%d %H:%M:%S UTC")
     return str(dt) if dt is not None else "—"
 
-async def build_admin_kb() -> InlineKeyboardMarkup:
-    cfg: Dict[str, Any] = await get_all_config()
-    updated = _fmt_dt(cfg.get("updated_at"))
+# Кеш главной админ-клавиатуры: (версия config, разметка). Версию ведёт config_from_db:
+# она растёт при любой записи config и при обнаружении правки из другого процесса
+_ADMIN_KB_CACHE: tuple[int, InlineKeyboardMarkup] | None = None
+
+
+async def build_admin_kb(cfg: Dict[str, Any] | None = None) -> InlineKeyboardMarkup:
+    """
+    cfg — уже прочитанная строка config (например, из UPDATE ... RETURNING *):
+    клавиатура строится по ней без повторного SELECT.
+    """
+    global _ADMIN_KB_CACHE
+    # Версию фиксируем до чтения: если запись config завершится во время await,
+    # клавиатура по устаревшему cfg не попадёт в кеш под новой версией
+    version = config_version()
+    if not cfg:
+        # get_all_config обычно отдаёт снимок из памяти, а по TTL перечитывает строку
+        # и поднимает версию, если config изменили в обход этого процесса
+        cfg = await get_all_config()
+        cached = _ADMIN_KB_CACHE
+        if cached is not None and cached[0] == config_version():
+            return cached[1]
+    kb = _render_admin_kb(cfg)
+    if config_version() == version:
+        _ADMIN_KB_CACHE = (version, kb)
+    return kb
+
+
+def _render_admin_kb(cfg: Dict[str, Any]) -> InlineKeyboardMarkup:
     chk_country = bool(cfg.get("check_country", False))
     use_region  = bool(cfg.get("region_in_bot", True))
     stars = bool(cfg.get("stars_enabled", False))
@@ -281,21 +281,16 @@ def _resolve_caller_context() -> tuple[str, dict[str, object]]:
             pass
 
 
-async def log_info(
+def _build_log_record(
     message: str,
     type_msg: str,
-    log: str | None = None,
-    *args,
-    user_id: object | None = None,
-    uid: object | None = None,
-    **kwargs,
-) -> None:
-    await init_logging()
-    logger = logging.getLogger()  # root по умолчанию
-    if log == "admins":
-        await init_admin_logging()
-        logger = _admin_logger or logger
-
+    log: str | None,
+    args: tuple,
+    user_id: object | None,
+    uid: object | None,
+    kwargs: dict,
+) -> tuple:
+    """Собирает запись лога синхронно (контекст вызывающего берётся из текущего стека)."""
     caller_name, caller_locals = _resolve_caller_context()
     user_identifier = user_id if user_id not in (None, "") else uid
     if user_identifier in (None, ""):
@@ -340,7 +335,17 @@ async def log_info(
     if kwargs:
         logger_extra.update(kwargs)
 
-    level = (type_msg or "").lower()
+    return log, (type_msg or "").lower(), final_message, args, logger_extra, logger_kwargs
+
+
+async def _emit_log_record(log, level, final_message, args, logger_extra, logger_kwargs) -> None:
+    """Пишет готовую запись в логгер и, для ошибок/предупреждений, в служебный чат."""
+    await init_logging()
+    logger = logging.getLogger()  # root по умолчанию
+    if log == "admins":
+        await init_admin_logging()
+        logger = _admin_logger or logger
+
     if "info" in level:
         logger.info(final_message, *args, extra=logger_extra, **logger_kwargs)
     elif "error" in level:
@@ -361,3 +366,92 @@ async def log_info(
         )
     else:
         logger.info(final_message, *args, extra=logger_extra, **logger_kwargs)
+
+
+async def log_info(
+    message: str,
+    type_msg: str,
+    log: str | None = None,
+    *args,
+    user_id: object | None = None,
+    uid: object | None = None,
+    **kwargs,
+) -> None:
+    record = _build_log_record(message, type_msg, log, args, user_id, uid, kwargs)
+    await _emit_log_record(*record)
+
+
+# === Неблокирующее логирование: запись собирается сразу, а пишется фоновым воркером ===
+
+_LOG_QUEUE_MAX = 10_000
+_LOG_BATCH_MAX = 64
+_log_queue: asyncio.Queue | None = None
+_log_worker_task: asyncio.Task | None = None
+_log_dropped = 0
+
+
+async def _log_worker() -> None:
+    """
+    Единственный потребитель очереди: сохраняет порядок записей.
+    За одно пробуждение забирает всё накопленное (до _LOG_BATCH_MAX) без лишних переключений.
+    """
+    while True:
+        batch = [await _log_queue.get()]
+        while len(batch) < _LOG_BATCH_MAX:
+            try:
+                batch.append(_log_queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        try:
+            for record in batch:
+                try:
+                    await _emit_log_record(*record)
+                except Exception as e:
+                    logging.getLogger().error(f"log worker: ошибка записи лога: {e}")
+        finally:
+            for _ in batch:
+                _log_queue.task_done()
+
+
+def log_info_nowait(
+    message: str,
+    type_msg: str,
+    log: str | None = None,
+    *args,
+    user_id: object | None = None,
+    uid: object | None = None,
+    **kwargs,
+) -> None:
+    """
+    Аналог log_info для горячих путей: не ждёт записи/отправки в Telegram.
+    При переполнении очереди запись отбрасывается (счётчик _log_dropped).
+    """
+    global _log_queue, _log_worker_task, _log_dropped
+    record = _build_log_record(message, type_msg, log, args, user_id, uid, kwargs)
+    if _log_queue is None:
+        _log_queue = asyncio.Queue(maxsize=_LOG_QUEUE_MAX)
+    if _log_worker_task is None or _log_worker_task.done():
+        _log_worker_task = asyncio.get_running_loop().create_task(_log_worker())
+    try:
+        _log_queue.put_nowait(record)
+    except asyncio.QueueFull:
+        _log_dropped += 1
+
+
+async def flush_log_queue(timeout: float = 5.0) -> None:
+    """Дописывает накопленные записи и останавливает воркер (вызывать при остановке приложения)."""
+    global _log_worker_task
+    if _log_queue is not None and _log_worker_task is not None and not _log_worker_task.done():
+        try:
+            await asyncio.wait_for(_log_queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+    if _log_worker_task is not None:
+        _log_worker_task.cancel()
+        try:
+            await _log_worker_task
+        except asyncio.CancelledError:
+            pass
+        _log_worker_task = None
+    if _log_dropped:
+        logging.getLogger().warning(f"log queue: отброшено записей при переполнении: {_log_dropped}")
@@ -17,7 +17,8 @@ from aiogram.types import (
 from bot_instance import initialize_bots
 from config.config_from_db import ensure_config_exists
 from db.db_table_init import close_pool, create_pool, init_db_tables, monitor_pool_health
-from log.log import log_info, set_info_bot
+from db.db_utils import start_pending_city_listener, stop_pending_city_listener
+from log.log import flush_log_queue, log_info, set_info_bot
 from log.json_watcher import run_json_watch
 from log.server_logs_scheduler import send_server_logs_once, start_daily_server_logs_task
 from handlers import commands, verification, support
@@ -153,6 +154,7 @@ async def main() -> None:
                 await init_db_tables()
                 await log_info("Инициализация базы данных завершена", type_msg="info")
                 await ensure_config_exists()
+                await start_pending_city_listener()
 
                 pool_monitor_task = asyncio.create_task(monitor_pool_health())
                 await log_info("Pool мониторинг запущен", type_msg="info")
@@ -226,6 +228,8 @@ async def main() -> None:
                 # 5. Закрыть все активные соединения
                 await asyncio.gather(poll_main, poll_info, return_exceptions=True)
                 await log_info("Все задачи завершены", type_msg="info")
+                await stop_pending_city_listener()
+                await flush_log_queue()
                 
                 # 6. Отправить финальные логи
                 # try:
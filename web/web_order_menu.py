@@ -4,7 +4,7 @@ import asyncio
 import json
 from dataclasses import dataclass
 from datetime import datetime
-from typing import Any, Awaitable, Callable, Optional
+from typing import Any, Awaitable, Callable, Mapping, Optional
 
 from nicegui import app, ui
 
@@ -15,7 +15,7 @@ from db.db_utils import (
     cancel_order,
     complete_order,
     get_active_order_for_driver,
-    get_driver_stats_summary,
+    get_driver_dashboard,
     get_latest_open_order_id_for_passenger,
     get_order_data,
     list_available_orders_for_driver,
@@ -25,6 +25,7 @@ from db.db_utils import (
     mark_passenger_comeout,
     mark_trip_started,
     reserve_order,
+    OrderRow,
 )
 
 __all__ = ["render_order_tab"]
@@ -338,9 +339,8 @@ class TripsTabView:
             if self.role == "driver":
                 await asyncio.gather(
                     self._refresh_driver_offers(),
-                    self._refresh_driver_active(),
+                    self._refresh_driver_dashboard(),
                     self._refresh_history(role="driver"),
-                    self._refresh_driver_stats(),
                 )
             else:
                 await asyncio.gather(
@@ -418,27 +418,34 @@ class TripsTabView:
                 await self._maybe_switch_main_button_driver()
                 return
             raw_order = await get_active_order_for_driver(driver_id)
-            normalized_order = self._normalize_order(raw_order)
-            self.active_state.order = normalized_order
-            self.active_state.need_topup = bool((normalized_order or {}).get("need_topup"))
-            self.active_state.awaiting_fee_deadline = None
-            await self._render_driver_active()
-            await self._maybe_switch_main_button_driver()
+            await self._apply_driver_active(raw_order)
         except Exception as error:  # noqa: BLE001
             await self._handle_api_error(error)
 
-    async def _refresh_driver_stats(self) -> None:
-        """Обновляем статистику водителя."""
+    async def _apply_driver_active(self, raw_order: dict[str, Any] | None) -> None:
+        """Сохраняем и отрисовываем активный заказ водителя."""
+
+        normalized_order = self._normalize_order(raw_order)
+        self.active_state.order = normalized_order
+        self.active_state.need_topup = bool((normalized_order or {}).get("need_topup"))
+        self.active_state.awaiting_fee_deadline = None
+        await self._render_driver_active()
+        await self._maybe_switch_main_button_driver()
+
+    async def _refresh_driver_dashboard(self) -> None:
+        """Активный заказ и статистика водителя одним запросом к БД."""
 
-        if self._driver_stats_container is None:
-            return
         try:
             driver_id = int(self.user_id) if self.user_id else None
             if driver_id is None:
-                await self._render_driver_stats({})
+                await self._apply_driver_active(None)
+                if self._driver_stats_container is not None:
+                    await self._render_driver_stats({})
                 return
-            stats = await get_driver_stats_summary(driver_id)
-            await self._render_driver_stats(stats or {})
+            dashboard = await get_driver_dashboard(driver_id)
+            await self._apply_driver_active(dashboard.get("active_order"))
+            if self._driver_stats_container is not None:
+                await self._render_driver_stats(dashboard.get("stats") or {})
         except Exception as error:  # noqa: BLE001
             await self._handle_api_error(error)
 
@@ -724,13 +731,15 @@ class TripsTabView:
             )
         else:
             await self.main_button.set_state(text_key="driver_active", visible=False, enabled=False)
-    def _normalize_order(self, payload: dict[str, Any] | None) -> dict[str, Any] | None:
+    def _normalize_order(self, payload: Mapping[str, Any] | OrderRow | None) -> dict[str, Any] | None:
         """Приводим словарь заказа к унифицированному виду для UI."""
 
-        if not isinstance(payload, dict):
+        if isinstance(payload, OrderRow):
+            order = payload.as_dict()
+        elif isinstance(payload, Mapping):
+            order = dict(payload)
+        else:
             return None
-
-        order = dict(payload)
         # Адреса: поддерживаем как REST-ответы, так и структуру из orders
         order.setdefault("pickup_address", order.get("address_from"))
         order.setdefault("dropoff_address", order.get("address_to"))
@@ -749,7 +758,7 @@ class TripsTabView:
         order["need_topup"] = bool(order.get("need_topup"))
         return order
 
-    def _normalize_orders(self, items: list[dict[str, Any]] | None) -> list[dict[str, Any]]:
+    def _normalize_orders(self, items: list[Mapping[str, Any] | OrderRow] | None) -> list[dict[str, Any]]:
         """Применяем нормализацию к списку заказов."""
 
         if not items: